@@ -17,7 +17,9 @@
 from __future__ import absolute_import
 
 from . import state_util
+from .beam_search import batched_beam_search
 from .beam_search import beam_search
+from .beam_search import PrefixSequence
 from .nade import Nade
 from .sequence_example_lib import count_records
 from .sequence_example_lib import flatten_maybe_padded_sequences
@@ -21,12 +21,89 @@ import collections
 import copy
 import heapq
 
+# internal imports
+
+import numpy as np
+
 
 # A beam entry containing a) the current sequence, b) a "state" containing any
 # information needed to extend the sequence, and c) a score for the current
 # sequence e.g. log-likelihood.
 BeamEntry = collections.namedtuple('BeamEntry', ['sequence', 'state', 'score'])
 
+# A node in the tree of events appended to a PrefixSequence, pointing to the
+# node for the previous event.
+_PrefixNode = collections.namedtuple('_PrefixNode', ['event', 'parent'])
+
+
+class PrefixSequence(object):
+  """A list-like sequence that shares its prefix with its branches.
+
+  The sequence consists of a base sequence, which is never modified, followed
+  by appended events stored as a chain of immutable nodes with parent pointers.
+  Branching a PrefixSequence creates a new sequence that shares all existing
+  nodes, so branching costs the same regardless of sequence length, and the
+  branches can then be extended independently.
+
+  Indexing the appended part walks back from the most recent event, so access
+  near the end of the sequence (as used when extending it) is cheap.
+  """
+
+  def __init__(self, base):
+    """Construct a PrefixSequence.
+
+    Args:
+      base: The list-like base sequence. It must not be modified while this
+          sequence or any of its branches are in use.
+    """
+    self._base = base
+    self._base_length = len(base)
+    self._tail = None
+    self._length = self._base_length
+
+  def branch(self):
+    """Returns a new sequence that shares this sequence's events."""
+    return copy.copy(self)
+
+  def append(self, event):
+    """Appends an event to this sequence without affecting any branches."""
+    self._tail = _PrefixNode(event, self._tail)
+    self._length += 1
+
+  def appended_events(self):
+    """Returns a list of the events appended after the base sequence."""
+    events = []
+    node = self._tail
+    while node is not None:
+      events.append(node.event)
+      node = node.parent
+    events.reverse()
+    return events
+
+  def __len__(self):
+    return self._length
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return list(self)[i]
+    i = int(i)
+    if i < 0:
+      i += self._length
+    if i < 0 or i >= self._length:
+      raise IndexError('sequence index out of range')
+    if i < self._base_length:
+      return self._base[i]
+    node = self._tail
+    for _ in range(self._length - 1 - i):
+      node = node.parent
+    return node.event
+
+  def __iter__(self):
+    for event in self._base:
+      yield event
+    for event in self.appended_events():
+      yield event
+
 
 def _generate_branches(beam_entries, generate_step_fn, branch_factor,
                        num_steps):
@@ -145,3 +222,105 @@ def beam_search(initial_sequence, initial_state, generate_step_fn, num_steps,
   beam_entry = _prune_branches(beam_entries, k=1)[0]
 
   return beam_entry.sequence, beam_entry.state, beam_entry.score
+
+
+def _top_k_indices(scores, k):
+  """Returns the indices of the `k` highest scores, in descending order.
+
+  Ties are broken in favor of lower indices, matching `_prune_branches`.
+  """
+  return np.argsort(-scores, kind='mergesort')[:k]
+
+
+def _generate_batched_branches(sequences, states, scores, indices,
+                               generate_step_fn, branch_factor, num_steps):
+  """Performs a single iteration of branch generation for batched beam search.
+
+  Args:
+    sequences: A list of PrefixSequence objects, the current beam.
+    states: A state_util.BatchedState, whose batch indexes `sequences`.
+    scores: A 1-D NumPy array containing the score of each sequence.
+    indices: An integer array of the beam entries to branch from.
+    generate_step_fn: The step function, as described in
+        `batched_beam_search`.
+    branch_factor: The integer branch factor to use.
+    num_steps: The integer number of steps to take per branch.
+
+  Returns:
+    The updated sequences, states, and scores, with `branch_factor` times as
+    many entries as `indices`.
+  """
+  # Branches are ordered the same way as in `_generate_branches`.
+  indices = np.tile(indices, branch_factor)
+  sequences = [sequences[i].branch() for i in indices]
+  states = states.gather(indices)
+  scores = scores[indices]
+
+  for _ in range(num_steps):
+    sequences, states, scores = generate_step_fn(sequences, states, scores)
+
+  return sequences, states, scores
+
+
+def batched_beam_search(initial_sequence, initial_state, generate_step_fn,
+                        num_steps, beam_size, branch_factor,
+                        steps_per_iteration):
+  """Generates a sequence using beam search, without copying the beam.
+
+  This performs the same search as `beam_search`, and returns the same best
+  sequence, but never copies sequences or states. Sequences are PrefixSequence
+  objects that share their common prefixes, and the states of all beam entries
+  are kept in a single state_util.BatchedState, which is branched and pruned by
+  gathering along the batch dimension.
+
+  Args:
+    initial_sequence: The initial sequence, a Python list-like object
+        supporting `append`. It is not modified.
+    initial_state: The state corresponding to the initial sequence, a
+        state_util.BatchedState with a batch size of one.
+    generate_step_fn: A function that takes three parameters: a list of
+        PrefixSequence objects, a state_util.BatchedState whose batch indexes
+        the sequences, and a 1-D NumPy array of scores. The function
+        should generate a single step for each of the sequences (appending to
+        them in place) and return the extended sequences, updated batched
+        states, and updated (total) scores.
+    num_steps: The integer length in steps of the final sequence, after
+        generation.
+    beam_size: The integer beam size to use.
+    branch_factor: The integer branch factor to use.
+    steps_per_iteration: The integer number of steps to take per iteration.
+
+  Returns:
+    A tuple containing a) the highest-scoring sequence as computed by the beam
+    search, a copy of `initial_sequence` extended with the generated events, b)
+    the state corresponding to this sequence, without a batch dimension, and
+    c) the score of this sequence.
+  """
+  sequences = [PrefixSequence(initial_sequence)]
+  states = initial_state
+  scores = np.zeros(1)
+
+  # Choose the number of steps for the first iteration such that subsequent
+  # iterations can all take the same number of steps.
+  first_iteration_num_steps = (num_steps - 1) % steps_per_iteration + 1
+
+  # The initial beam contains `beam_size` branches of the initial sequence.
+  sequences, states, scores = _generate_batched_branches(
+      sequences, states, scores, np.zeros(beam_size, dtype=np.int64),
+      generate_step_fn, branch_factor, first_iteration_num_steps)
+
+  num_iterations = (num_steps -
+                    first_iteration_num_steps) // steps_per_iteration
+
+  for _ in range(num_iterations):
+    sequences, states, scores = _generate_batched_branches(
+        sequences, states, scores, _top_k_indices(scores, beam_size),
+        generate_step_fn, branch_factor, steps_per_iteration)
+
+  # Materialize the single best beam entry.
+  best = _top_k_indices(scores, 1)[0]
+  sequence = copy.deepcopy(initial_sequence)
+  for event in sequences[best].appended_events():
+    sequence.append(event)
+
+  return sequence, states.extract(best), scores[best]
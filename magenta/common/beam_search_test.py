@@ -14,9 +14,11 @@
 """Tests for beam search."""
 
 # internal imports
+import numpy as np
 import tensorflow as tf
 
 from magenta.common import beam_search
+from magenta.common import state_util
 
 
 class BeamSearchTest(tf.test.TestCase):
@@ -37,6 +39,12 @@ class BeamSearchTest(tf.test.TestCase):
         value = 1 - value
     return sequences, states, scores
 
+  def _generate_batched_step_fn(self, sequences, states, scores):
+    # The same binary counter, with the states in a single batched array.
+    sequences, states, scores = self._generate_step_fn(
+        sequences, states.states, scores)
+    return sequences, state_util.BatchedState(states), scores
+
   def testNoBranchingSingleStepPerIteration(self):
     sequence, state, score = beam_search.beam_search(
         initial_sequence=[], initial_state=1,
@@ -84,6 +92,47 @@ class BeamSearchTest(tf.test.TestCase):
     self.assertEqual(state, 1)
     self.assertEqual(score, 16)
 
+  def testBatchedBeamSearch(self):
+    # Batched beam search should find the same sequence, state, and score as
+    # beam search, with the batched states held in a single array.
+    for beam_size, branch_factor, steps_per_iteration in [
+        (1, 1, 1), (1, 1, 2), (1, 32, 1), (32, 1, 1), (4, 3, 2)]:
+      expected_sequence, expected_state, expected_score = (
+          beam_search.beam_search(
+              initial_sequence=[], initial_state=1,
+              generate_step_fn=self._generate_step_fn, num_steps=5,
+              beam_size=beam_size, branch_factor=branch_factor,
+              steps_per_iteration=steps_per_iteration))
+      sequence, state, score = beam_search.batched_beam_search(
+          initial_sequence=[],
+          initial_state=state_util.BatchedState(np.array([1])),
+          generate_step_fn=self._generate_batched_step_fn, num_steps=5,
+          beam_size=beam_size, branch_factor=branch_factor,
+          steps_per_iteration=steps_per_iteration)
+      self.assertEqual(expected_sequence, sequence)
+      self.assertEqual(expected_state, state)
+      self.assertEqual(expected_score, score)
+
+  def testPrefixSequence(self):
+    base = [0, 1]
+    sequence = beam_search.PrefixSequence(base)
+    sequence.append(2)
+    branch = sequence.branch()
+    sequence.append(3)
+    branch.append(4)
+    branch.append(5)
+
+    self.assertEqual([0, 1], base)
+    self.assertEqual([0, 1, 2, 3], list(sequence))
+    self.assertEqual([0, 1, 2, 4, 5], list(branch))
+    self.assertEqual(5, len(branch))
+    self.assertEqual(4, branch[-2])
+    self.assertEqual(1, branch[1])
+    self.assertEqual([2, 4], branch[2:4])
+    self.assertEqual([2, 4, 5], branch.appended_events())
+    with self.assertRaises(IndexError):
+      _ = sequence[4]
+
 
 if __name__ == '__main__':
   tf.test.main()
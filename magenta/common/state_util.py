@@ -74,3 +74,136 @@ def batch(states, batch_size=None):
       stacked.resize([batch_size] + list(stacked.shape)[1:])
     return stacked
   return tf_nest.map_structure(stack_and_pad, *states)
+
+
+def gather(batched_states, indices):
+  """Selects states from a batch of states by index.
+
+  Args:
+    batched_states: A nested structure with entries whose first dimensions all
+      equal N.
+    indices: An integer array of indices in the range [0, N), or a slice.
+
+  Returns:
+    A nested structure of the same form as `batched_states`, whose entries
+    contain only the states at `indices` (in order, possibly repeated).
+  """
+  return tf_nest.map_structure(lambda x: x[indices], batched_states)
+
+
+def concatenate(batched_states_list):
+  """Concatenates a list of batched state structures along the batch dimension.
+
+  Args:
+    batched_states_list: A list of nested structures of the same form, with
+      entries whose first dimensions are batch dimensions.
+
+  Returns:
+    A single nested structure whose batch dimension contains the states of
+    each structure in `batched_states_list`, in order.
+  """
+  return tf_nest.map_structure(
+      lambda *states: np.concatenate(states), *batched_states_list)
+
+
+class BatchedState(object):
+  """A batch of nested states stored as contiguous arrays.
+
+  Each entry of the nested state structure is a single array whose first
+  dimension indexes the batch. States can be gathered, scattered, and reordered
+  by index as a whole batch, without splitting them into individual states and
+  stacking them again.
+  """
+
+  def __init__(self, batched_states):
+    """Construct a BatchedState.
+
+    Args:
+      batched_states: A nested structure with entries whose first dimensions
+        all equal the batch size.
+    """
+    self._batched_states = batched_states
+
+  @classmethod
+  def from_states(cls, states, batch_size=None):
+    """Creates a BatchedState from a collection of individual states.
+
+    Args:
+      states: A collection of individual nested state structures.
+      batch_size: The desired batch size, as in `batch`.
+
+    Returns:
+      A BatchedState containing `states`.
+    """
+    return cls(batch(states, batch_size))
+
+  @classmethod
+  def concatenate(cls, batched_states_list):
+    """Creates a BatchedState by concatenating a list of BatchedStates."""
+    return cls(concatenate(
+        [batched_states.states for batched_states in batched_states_list]))
+
+  @property
+  def states(self):
+    """The nested structure of batched state arrays."""
+    return self._batched_states
+
+  def __len__(self):
+    flat_states = tf_nest.flatten(self._batched_states)
+    return len(flat_states[0]) if flat_states else 0
+
+  def gather(self, indices):
+    """Returns a new BatchedState containing the states at `indices`.
+
+    Args:
+      indices: An integer array of indices into the batch, or a slice.
+
+    Returns:
+      A BatchedState containing the selected states, in order.
+    """
+    return BatchedState(gather(self._batched_states, indices))
+
+  def scatter(self, indices, batched_states):
+    """Overwrites the states at `indices` in place.
+
+    Args:
+      indices: An integer array of indices into the batch, or a slice.
+      batched_states: A BatchedState containing one state for each index.
+    """
+    def assign(x, y):
+      x[indices] = y
+    tf_nest.map_structure(assign, self._batched_states, batched_states.states)
+
+  def reorder(self, indices):
+    """Reorders the batch in place so that it contains the states at `indices`.
+
+    Args:
+      indices: An integer array of indices into the batch. Indices may be
+        repeated or omitted, changing the batch size.
+    """
+    self._batched_states = gather(self._batched_states, indices)
+
+  def empty_like(self, batch_size=None):
+    """Returns an uninitialized BatchedState with the same structure.
+
+    Args:
+      batch_size: The batch size of the new BatchedState. If None, use the
+        batch size of this BatchedState.
+
+    Returns:
+      A BatchedState whose arrays have the same shapes (other than the batch
+      dimension) and types as this one, to be filled using `scatter`.
+    """
+    if batch_size is None:
+      batch_size = len(self)
+    return BatchedState(tf_nest.map_structure(
+        lambda x: np.empty((batch_size,) + x.shape[1:], dtype=x.dtype),
+        self._batched_states))
+
+  def extract(self, i):
+    """Returns the individual state at index `i`."""
+    return extract_state(self._batched_states, i)
+
+  def unbatch(self):
+    """Returns a list of all individual states in the batch."""
+    return unbatch(self._batched_states, len(self))
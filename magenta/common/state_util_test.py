@@ -77,6 +77,54 @@ class StateUtilTest(tf.test.TestCase):
 
     self._assert_sructures_equal(self._unbatched_states[1], extracted_state)
 
+  def testGather(self):
+    gathered_states = state_util.gather(self._batched_states, [1, 1, 0])
+    expected_gathered_states = state_util.batch(
+        [self._unbatched_states[1], self._unbatched_states[1],
+         self._unbatched_states[0]])
+
+    self._assert_sructures_equal(expected_gathered_states, gathered_states)
+
+  def testConcatenate(self):
+    concatenated_states = state_util.concatenate(
+        [state_util.gather(self._batched_states, slice(0, 1)),
+         state_util.gather(self._batched_states, slice(1, 3))])
+
+    self._assert_sructures_equal(self._batched_states, concatenated_states)
+
+  def testBatchedState(self):
+    batched_states = state_util.BatchedState.from_states(
+        self._unbatched_states)
+    self.assertEqual(2, len(batched_states))
+    self._assert_sructures_equal(
+        self._unbatched_states[1], batched_states.extract(1))
+    self._assert_sructures_equal(
+        self._unbatched_states, batched_states.unbatch())
+
+    # Gather the states in reverse, then scatter them back into place.
+    reversed_states = batched_states.gather([1, 0])
+    self._assert_sructures_equal(
+        self._unbatched_states[::-1], reversed_states.unbatch())
+    scattered_states = batched_states.empty_like()
+    scattered_states.scatter([1, 0], reversed_states)
+    self._assert_sructures_equal(
+        self._unbatched_states, scattered_states.unbatch())
+
+    batched_states.reorder([1, 1, 0])
+    self.assertEqual(3, len(batched_states))
+    self._assert_sructures_equal(
+        [self._unbatched_states[1], self._unbatched_states[1],
+         self._unbatched_states[0]],
+        batched_states.unbatch())
+
+  def testBatchedStateConcatenate(self):
+    batched_states = state_util.BatchedState(self._batched_states)
+    concatenated_states = state_util.BatchedState.concatenate(
+        [batched_states.gather(slice(0, 1)), batched_states.gather([1, 2])])
+
+    self._assert_sructures_equal(
+        self._batched_states, concatenated_states.states)
+
 
 if __name__ == '__main__':
   tf.test.main()
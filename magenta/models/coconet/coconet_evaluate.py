@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import functools
 import os
 # internal imports
 import numpy as np
@@ -29,6 +30,19 @@ flags.DEFINE_integer('ensemble_size', 5,
 flags.DEFINE_bool('chronological', False,
                   'Indicates evaluation should proceed in chronological order.')
 flags.DEFINE_string('checkpoint', None, 'Path to checkpoint directory.')
+flags.DEFINE_bool('packed', False,
+                  'Evaluate all pieces of the same length in packed batches.')
+flags.DEFINE_integer('num_workers', 0,
+                     'Number of worker processes over which to spread the '
+                     'orderings of all pieces. Each worker loads its own copy '
+                     'of the model. If 0, evaluates in the main process.')
+flags.DEFINE_integer('seed', None,
+                     'Optional seed from which the seed of every ordering is '
+                     'derived.')
+flags.DEFINE_integer('memory_budget_mb', 0,
+                     'Approximate memory in megabytes a single model '
+                     'evaluation may use. If 0, each model evaluation covers '
+                     'at most one piece.')
 flags.DEFINE_string('sample_npy_path', None, 'Path to samples to be evaluated.')
 
 
@@ -54,7 +68,9 @@ def main(unused_argv):
       raise ValueError(
           'Need to provide a path to checkpoint directory or use an '
           'eval_logdir with only 1 checkpoint subdirectory.')
-  wmodel = lib_graph.load_checkpoint(checkpoint_dir)
+  # With worker processes, only the workers need a session.
+  wmodel = lib_graph.load_checkpoint(
+      checkpoint_dir, instantiate_sess=not FLAGS.num_workers)
   if FLAGS.eval_logdir is None:
     raise ValueError(
         'Set flag eval_logdir to specify a path for saving eval statistics.')
@@ -62,23 +78,56 @@ def main(unused_argv):
     eval_logdir = os.path.join(FLAGS.eval_logdir, EVAL_SUBDIR)
     tf.gfile.MakeDirs(eval_logdir)
 
+  memory_budget = FLAGS.memory_budget_mb * 2**20 or None
   evaluator = lib_evaluation.BaseEvaluator.make(
-      FLAGS.unit, wmodel=wmodel, chronological=FLAGS.chronological)
-  evaluator = lib_evaluation.EnsemblingEvaluator(evaluator, FLAGS.ensemble_size)
+      FLAGS.unit, wmodel=wmodel, chronological=FLAGS.chronological,
+      memory_budget=memory_budget)
+  evaluator = lib_evaluation.EnsemblingEvaluator(
+      evaluator, FLAGS.ensemble_size, seed=FLAGS.seed,
+      num_workers=FLAGS.num_workers,
+      evaluator_factory=functools.partial(
+          make_evaluator, checkpoint_dir, FLAGS.unit, FLAGS.chronological,
+          memory_budget))
 
   if not FLAGS.sample_npy_path and FLAGS.fold is None:
     raise ValueError(
         'Either --fold must be specified, or paths of npy files to load must '
         'be given, but not both.')
-  if FLAGS.fold is not None:
-    evaluate_fold(
-        FLAGS.fold, evaluator, wmodel.hparams, eval_logdir, checkpoint_dir)
-  if FLAGS.sample_npy_path is not None:
-    evaluate_paths([FLAGS.sample_npy_path], evaluator, wmodel.hparams,
-                   eval_logdir)
+  try:
+    if FLAGS.fold is not None:
+      evaluate_fold(
+          FLAGS.fold, evaluator, wmodel.hparams, eval_logdir, checkpoint_dir)
+    if FLAGS.sample_npy_path is not None:
+      evaluate_paths([FLAGS.sample_npy_path], evaluator, wmodel.hparams,
+                     eval_logdir)
+  finally:
+    evaluator.close()
   tf.logging.info('Done')
 
 
+def make_evaluator(checkpoint_dir, unit, chronological, memory_budget=None):
+  """Loads a model from checkpoint_dir and returns an evaluator for it.
+
+  The model is built in a graph of its own, so that the factory can be called
+  in worker processes that inherit the graph of the main process, and more
+  than once in the same process.
+
+  Args:
+    checkpoint_dir: path to the checkpoint directory.
+    unit: the key of the BaseEvaluator to make, e.g. note or frame.
+    chronological: whether to evaluate in chronological order.
+    memory_budget: optional memory budget in bytes; see BaseEvaluator.
+
+  Returns:
+    A BaseEvaluator instance.
+  """
+  with tf.Graph().as_default():
+    wmodel = lib_graph.load_checkpoint(checkpoint_dir)
+  return lib_evaluation.BaseEvaluator.make(
+      unit, wmodel=wmodel, chronological=chronological,
+      memory_budget=memory_budget)
+
+
 def evaluate_fold(fold, evaluator, hparams, eval_logdir, checkpoint_dir):
   """Writes to file the neg. loglikelihood of given fold (train/valid/test)."""
   eval_run_name = 'eval_%s_%s%s_%s_ensemble%s_chrono%s' % (
@@ -90,7 +139,8 @@ def evaluate_fold(fold, evaluator, hparams, eval_logdir, checkpoint_dir):
 
   pianorolls = get_fold_pianorolls(fold, hparams)
 
-  rval = lib_evaluation.evaluate(evaluator, pianorolls)
+  rval = lib_evaluation.evaluate(
+      evaluator, pianorolls, packed=FLAGS.packed or FLAGS.num_workers > 0)
   tf.logging.info('Writing to path: %s' % log_fpath)
   with lib_util.atomic_file(log_fpath) as p:
     np.savez_compressed(p, **rval)
@@ -108,7 +158,8 @@ def evaluate_paths(paths, evaluator, unused_hparams, eval_logdir):
     log_fpath = os.path.join(eval_logdir, log_fname)
 
     pianorolls = get_path_pianorolls(path)
-    rval = lib_evaluation.evaluate(evaluator, pianorolls)
+    rval = lib_evaluation.evaluate(
+        evaluator, pianorolls, packed=FLAGS.packed or FLAGS.num_workers > 0)
     tf.logging.info('Writing evaluation statistics to %s', log_fpath)
     with lib_util.atomic_file(log_fpath) as p:
       np.savez_compressed(p, **rval)
@@ -0,0 +1,63 @@
+"""Tests for coconet_evaluate."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.models.coconet import coconet_evaluate
+from magenta.models.coconet import lib_graph
+from magenta.models.coconet import lib_hparams
+
+
+class MakeEvaluatorTest(tf.test.TestCase):
+
+  def save_checkpoint(self):
+    logdir = tempfile.mkdtemp()
+    save_path = os.path.join(logdir, 'best_model.ckpt')
+
+    hparams = lib_hparams.Hyperparameters(num_layers=4, num_filters=16)
+
+    tf.gfile.MakeDirs(logdir)
+    config_fpath = os.path.join(logdir, 'config')
+    with tf.gfile.Open(config_fpath, 'w') as p:
+      hparams.dump(p)
+
+    with tf.Graph().as_default():
+      lib_graph.build_graph(is_training=True, hparams=hparams)
+      sess = tf.Session()
+      sess.run(tf.global_variables_initializer())
+
+      saver = tf.train.Saver()
+      saver.save(sess, save_path)
+
+    return logdir, hparams
+
+  def test_make_evaluator_twice(self):
+    checkpoint_dir, hparams = self.save_checkpoint()
+    pianoroll = np.zeros([2, hparams.num_pitches, hparams.num_instruments])
+    pianoroll[:, 0, :] = 1.
+
+    with tf.Graph().as_default():
+      # Like the main process of coconet_evaluate, from which worker processes
+      # inherit a default graph that already holds the model.
+      lib_graph.load_checkpoint(checkpoint_dir, instantiate_sess=False)
+      evaluators = [
+          coconet_evaluate.make_evaluator(checkpoint_dir, 'note', False)
+          for _ in range(2)
+      ]
+    self.assertIsNot(evaluators[0].wmodel.graph, evaluators[1].wmodel.graph)
+    self.assertAllClose(
+        evaluators[0].evaluate_many([pianoroll], seeds=[1])[0],
+        evaluators[1].evaluate_many([pianoroll], seeds=[1])[0])
+    tf.gfile.DeleteRecursively(checkpoint_dir)
+
+
+if __name__ == '__main__':
+  tf.test.main()
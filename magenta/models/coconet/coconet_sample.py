@@ -35,6 +35,17 @@ flags.DEFINE_string("checkpoint", None, "Path to checkpoint file")
 flags.DEFINE_bool("midi_io", False, "Run in midi in and midi out mode."
                   "Does not write any midi or logs to disk.")
 flags.DEFINE_bool("tfsample", True, "Run sampling in Tensorflow graph.")
+flags.DEFINE_integer("speculative_block_size", 0,
+                     "If greater than 1, ancestral strategies propose and "
+                     "verify this many variables per model evaluation.")
+flags.DEFINE_bool("incremental_inference", False,
+                  "Only recompute model outputs within the receptive field of "
+                  "the time steps that changed since the previous step.")
+flags.DEFINE_bool("stream_intermediate_steps", False,
+                  "Write intermediate steps to disk while sampling, with "
+                  "pianorolls and masks bit-packed and predictions "
+                  "quantized, instead of keeping them in memory and writing "
+                  "an npz file at the end.")
 
 
 def main(unused_argv):
@@ -46,7 +57,15 @@ def main(unused_argv):
     generator = TFGenerator(FLAGS.checkpoint)
   else:
     wmodel = instantiate_model(FLAGS.checkpoint)
-    generator = Generator(wmodel, FLAGS.strategy)
+    logger = None
+    if FLAGS.stream_intermediate_steps:
+      # The sample directory is named after the time taken, so stream to a
+      # temporary directory and move it into place afterwards.
+      stream_path = os.path.join(
+          FLAGS.generation_output_dir,
+          "intermediate_steps_%s.tmp" % lib_util.timestamp())
+      logger = lib_logging.StreamingLogger(stream_path)
+    generator = Generator(wmodel, FLAGS.strategy, logger=logger)
   midi_outs = generator.run_generation(
       gen_batch_size=FLAGS.gen_batch_size, piece_length=FLAGS.piece_length)
 
@@ -77,48 +96,71 @@ def main(unused_argv):
     return
 
   # Stores all the (intermediate) steps.
-  intermediate_steps_path = os.path.join(basepath, "intermediate_steps.npz")
-  with lib_util.timing("writing_out_sample_npz"):
-    tf.logging.info("Writing intermediate steps to %s", intermediate_steps_path)
-    generator.logger.dump(intermediate_steps_path)
-
-  # Save the prime as midi and npy if in harmonization mode.
-  # First, checks the stored npz for the first (context) and last step.
-  tf.logging.info("Reading to check %s", intermediate_steps_path)
-  with tf.gfile.Open(intermediate_steps_path, "r") as p:
-    foo = np.load(p)
-    for key in foo.keys():
-      if re.match(r"0_root/.*?_strategy/.*?_context/0_pianorolls", key):
-        context_rolls = foo[key]
-        context_fpath = os.path.join(basepath, "context.npy")
-        tf.logging.info("Writing context to %s", context_fpath)
-        with lib_util.atomic_file(context_fpath) as context_p:
-          np.save(context_p, context_rolls)
-        if "harm" in FLAGS.strategy:
-          # Only synthesize the one prime if in Midi-melody-prime mode.
-          primes = context_rolls
-          if "Melody" in FLAGS.strategy:
-            primes = [context_rolls[0]]
-          prime_midi_outs = get_midi_from_pianorolls(primes, generator.decoder)
-          save_midis(prime_midi_outs, midi_path, label + "_prime")
-        break
+  if FLAGS.stream_intermediate_steps:
+    intermediate_steps_path = os.path.join(basepath, "intermediate_steps")
+    generator.logger.close()
+    tf.logging.info("Moving intermediate steps to %s", intermediate_steps_path)
+    tf.gfile.Rename(generator.logger.path, intermediate_steps_path)
+    reader = lib_logging.LogReader(intermediate_steps_path)
+    _save_context(reader, basepath, midi_path, label, generator.decoder)
+    reader.close()
+  else:
+    intermediate_steps_path = os.path.join(basepath, "intermediate_steps.npz")
+    with lib_util.timing("writing_out_sample_npz"):
+      tf.logging.info("Writing intermediate steps to %s",
+                      intermediate_steps_path)
+      generator.logger.dump(intermediate_steps_path)
+    tf.logging.info("Reading to check %s", intermediate_steps_path)
+    with tf.gfile.Open(intermediate_steps_path, "r") as p:
+      _save_context(np.load(p), basepath, midi_path, label, generator.decoder)
   tf.logging.info("Done")
 
 
+def _save_context(steps, basepath, midi_path, label, decoder):
+  """Save the prime as midi and npy if in harmonization mode.
+
+  Args:
+    steps: A mapping from the keys of the intermediate steps to arrays, i.e.
+        a loaded npz file or a lib_logging.LogReader.
+    basepath: The directory of the sample.
+    midi_path: The directory in which to save midi.
+    label: The label of the sample.
+    decoder: A PianorollEncoderDecoder to convert pianorolls to midi.
+  """
+  # Checks the stored steps for the first (context) step.
+  for key in steps.keys():
+    if re.match(r"0_root/.*?_strategy/.*?_context/0_pianorolls", key):
+      context_rolls = steps[key]
+      context_fpath = os.path.join(basepath, "context.npy")
+      tf.logging.info("Writing context to %s", context_fpath)
+      with lib_util.atomic_file(context_fpath) as context_p:
+        np.save(context_p, context_rolls)
+      if "harm" in FLAGS.strategy:
+        # Only synthesize the one prime if in Midi-melody-prime mode.
+        primes = context_rolls
+        if "Melody" in FLAGS.strategy:
+          primes = [context_rolls[0]]
+        prime_midi_outs = get_midi_from_pianorolls(primes, decoder)
+        save_midis(prime_midi_outs, midi_path, label + "_prime")
+      break
+
+
 class Generator(object):
   """Instantiates model and generates according to strategy and midi input."""
 
-  def __init__(self, wmodel, strategy_name="complete_midi"):
+  def __init__(self, wmodel, strategy_name="complete_midi", logger=None):
     """Initializes Generator with a wrapped model and strategy name.
 
     Args:
       wmodel: A lib_tfutil.WrappedModel loaded from a model checkpoint.
       strategy_name: A string specifying the key of the default strategy.
+      logger: An optional logger for intermediate steps. Defaults to a
+          lib_logging.Logger that keeps the steps in memory.
     """
     self.wmodel = wmodel
     self.hparams = self.wmodel.hparams
     self.decoder = lib_pianoroll.get_pianoroll_encoder_decoder(self.hparams)
-    self.logger = lib_logging.Logger()
+    self.logger = logger if logger is not None else lib_logging.Logger()
     # Instantiates generation strategy.
     self.strategy_name = strategy_name
     self.strategy = BaseStrategy.make(self.strategy_name, self.wmodel,
@@ -270,7 +312,91 @@ class TFGenerator(object):
     return self._time_taken
 
 
+class BatchedGenerator(object):
+  """Serves many generation requests concurrently from one wrapped model.
+
+  Requests are queued on a lib_sampling.BatchedGibbsSampler, which packs all
+  pieces in flight into one batch per Gibbs step. Call `start` to serve
+  requests from a background thread, then `submit` requests and `wait` for
+  their results.
+  """
+
+  def __init__(self, wmodel, max_batch_size=16, temperature=0.99):
+    """Initializes BatchedGenerator with a wrapped model.
+
+    Args:
+      wmodel: A lib_tfutil.WrappedModel loaded from a model checkpoint.
+      max_batch_size: The maximum number of pieces to sample in one batch.
+      temperature: The default sampling temperature.
+    """
+    self.wmodel = wmodel
+    self.hparams = self.wmodel.hparams
+    self.decoder = lib_pianoroll.get_pianoroll_encoder_decoder(self.hparams)
+    self.sampler = lib_sampling.BatchedGibbsSampler(
+        wmodel=self.wmodel,
+        temperature=temperature,
+        max_batch_size=max_batch_size)
+
+  def start(self):
+    self.sampler.start()
+
+  def stop(self):
+    self.sampler.stop()
+
+  def submit(self,
+             midi_in=None,
+             pianoroll_in=None,
+             mask=None,
+             piece_length=16,
+             temperature=None,
+             harmonize=False):
+    """Queues a generation request.
+
+    Args:
+      midi_in: An optional PrettyMIDI instance containing notes to be
+          conditioned on.
+      pianoroll_in: An optional numpy.ndarray of shape (time, pitch,
+          instrument) encoding the notes to be conditioned on.
+      mask: An optional binary array of the same shape as the pianoroll,
+          with 1s indicating the area to fill in. Defaults to the silences in
+          the pianoroll, or to all but the first instrument if harmonizing.
+      piece_length: An integer specifying the desired number of time steps
+          when starting from midi or from scratch.
+      temperature: An optional sampling temperature for this request.
+      harmonize: If True, `midi_in` is taken to be a melody that is
+          harmonized.
+
+    Returns:
+      A lib_sampling.SamplingRequest.
+    """
+    shape = [1, piece_length] + self.hparams.pianoroll_shape[1:]
+    if midi_in is not None and harmonize:
+      mroll = self.decoder.encode_midi_melody_to_pianoroll(midi_in)
+      pianoroll = np.zeros([mroll.shape[0]] + shape[2:], dtype=np.float32)
+      pianoroll[:, :, 0] = mroll[
+          :, self.hparams.min_pitch:self.hparams.max_pitch + 1]
+      if mask is None:
+        mask = lib_sampling.HarmonizationMasker()(pianoroll[None].shape)[0]
+    elif midi_in is not None:
+      pianoroll = self.decoder.encode_midi_to_pianoroll(midi_in, shape)[0]
+    elif pianoroll_in is not None:
+      pianoroll = pianoroll_in
+    else:
+      pianoroll = np.zeros(shape[1:], dtype=np.float32)
+    return self.sampler.submit(pianoroll, mask=mask, temperature=temperature)
+
+  def wait(self, request, timeout=None):
+    """Waits for a request to be served and returns its PrettyMIDI instance."""
+    pianoroll = request.wait(timeout)
+    if pianoroll is None:
+      return None
+    return self.decoder.decode_to_midi(pianoroll)
+
+
 def get_midi_from_pianorolls(rolls, decoder):
+  if isinstance(rolls, np.ndarray) and rolls.ndim == 4:
+    tf.logging.info("pianorolls shape: %r", rolls.shape)
+    return decoder.decode_batch_to_midi(rolls)
   midi_datas = []
   for pianoroll in rolls:
     tf.logging.info("pianoroll shape: %r", pianoroll.shape)
@@ -319,9 +445,19 @@ class BaseStrategy(lib_util.Factory):
 
   # convenience function to avoid passing the same arguments over and over
   def make_sampler(self, key, **kwargs):
-    kwargs.update(wmodel=self.wmodel, logger=self.logger)
+    kwargs.update(wmodel=self.wmodel, logger=self.logger,
+                  incremental=FLAGS.incremental_inference)
     return lib_sampling.BaseSampler.make(key, **kwargs)
 
+  def make_ancestral_sampler(self, selector, **kwargs):
+    if FLAGS.speculative_block_size > 1:
+      return self.make_sampler(
+          "speculative_ancestral",
+          selector=selector,
+          block_size=FLAGS.speculative_block_size,
+          **kwargs)
+    return self.make_sampler("ancestral", selector=selector, **kwargs)
+
 
 class HarmonizeMidiMelodyStrategy(BaseStrategy):
   """Harmonizes a midi melody (fname given by FLAGS.prime_midi_melody_fpath)."""
@@ -504,10 +640,8 @@ class ChronologicalStrategy(BaseStrategy):
   key = "chronological"
 
   def run(self, shape):
-    sampler = self.make_sampler(
-        "ancestral",
-        temperature=FLAGS.temperature,
-        selector=lib_sampling.ChronologicalSelector())
+    sampler = self.make_ancestral_sampler(
+        lib_sampling.ChronologicalSelector(), temperature=FLAGS.temperature)
     pianorolls, masks = self.blank_slate(shape)
     pianorolls = sampler(pianorolls, masks)
     return pianorolls
@@ -517,10 +651,8 @@ class OrderlessStrategy(BaseStrategy):
   key = "orderless"
 
   def run(self, shape):
-    sampler = self.make_sampler(
-        "ancestral",
-        temperature=FLAGS.temperature,
-        selector=lib_sampling.OrderlessSelector())
+    sampler = self.make_ancestral_sampler(
+        lib_sampling.OrderlessSelector(), temperature=FLAGS.temperature)
     pianorolls, masks = self.blank_slate(shape)
     pianorolls = sampler(pianorolls, masks)
     return pianorolls
@@ -33,6 +33,16 @@ flags.DEFINE_string('dataset', None,
                     'PianoMidiDe')
 flags.DEFINE_float('quantization_level', 0.125, 'Quantization duration.'
                    'For qpm=120, notated quarter note equals 0.5.')
+flags.DEFINE_string('packed_data_dir', None,
+                    'If set, pianorolls are encoded once and cached '
+                    'bit-packed in this directory, and batches are read from '
+                    'the cache.')
+flags.DEFINE_integer('prefetch_workers', 1,
+                     'Number of background threads that prepare training '
+                     'batches while the model trains. If 0, batches are '
+                     'prepared in the training loop.')
+flags.DEFINE_integer('prefetch_queue_depth', 2,
+                     'Maximum number of batches prepared ahead of training.')
 
 flags.DEFINE_integer('num_instruments', 4,
                      'Maximum number of instruments that appear in this '
@@ -106,8 +116,7 @@ def estimate_popstats(unused_sv, sess, m, dataset, unused_hparams):
   nepochs = 3
   nppopstats = [lib_util.AggregateMean('') for _ in tfpopstats]
   for _ in range(nepochs):
-    batches = (
-        dataset.get_featuremaps().batches(size=m.batch_size, shuffle=True))
+    batches = dataset.get_batches(size=m.batch_size, shuffle=True)
     for unused_step, batch in enumerate(batches):
       feed_dict = batch.get_feed_dict(m.placeholders)
       npbatchstats = sess.run(tfbatchstats, feed_dict=feed_dict)
@@ -128,10 +137,11 @@ def run_epoch(supervisor, sess, m, dataset, hparams, eval_op, experiment_type,
   """Runs an epoch of training or evaluate the model on given data."""
   # reduce variance in validation loss by fixing the seed
   data_seed = 123 if experiment_type == 'valid' else None
-  with lib_util.numpy_seed(data_seed):
-    batches = (
-        dataset.get_featuremaps().batches(
-            size=m.batch_size, shuffle=True, shuffle_rng=data_seed))
+  jobs = dataset.get_batch_jobs(
+      size=m.batch_size, shuffle=True, shuffle_rng=data_seed)
+  batches = lib_data.BatchPrefetcher(
+      jobs, num_workers=FLAGS.prefetch_workers,
+      queue_depth=FLAGS.prefetch_queue_depth)
 
   losses = lib_util.AggregateMean('losses')
   losses_total = lib_util.AggregateMean('losses_total')
@@ -168,6 +178,7 @@ def run_epoch(supervisor, sess, m, dataset, hparams, eval_op, experiment_type,
   run_stats['loss_unmask'] = losses_unmask.mean
   run_stats['loss_total'] = losses_total.mean
   run_stats['loss'] = losses.mean
+  run_stats['input_stall_time'] = batches.stall_time
   if experiment_type == 'train':
     run_stats['learning_rate'] = float(learning_rate)
 
@@ -181,12 +192,13 @@ def run_epoch(supervisor, sess, m, dataset, hparams, eval_op, experiment_type,
     supervisor.summary_computed(sess, summaries, epoch_count)
 
   tf.logging.info('%s, epoch %d: loss (mask): %.4f, loss (unmask): %.4f, '
-                  'loss (total): %.4f, log lr: %.4f, time taken: %.4f',
+                  'loss (total): %.4f, log lr: %.4f, time taken: %.4f, '
+                  'input stall time: %.4f',
                   experiment_type, epoch_count, run_stats['loss_mask'],
                   run_stats['loss_unmask'], run_stats['loss_total'],
                   np.log2(run_stats['learning_rate'])
                   if 'learning_rate' in run_stats else 0,
-                  time.time() - start_time)
+                  time.time() - start_time, run_stats['input_stall_time'])
 
   return run_stats['loss']
 
@@ -209,6 +221,12 @@ def main(unused_argv):
   print('current dir:', os.path.curdir)
   train_data = lib_data.get_dataset(FLAGS.data_dir, hparams, 'train')
   valid_data = lib_data.get_dataset(FLAGS.data_dir, hparams, 'valid')
+  if FLAGS.packed_data_dir is not None:
+    tf.gfile.MakeDirs(FLAGS.packed_data_dir)
+    train_data, valid_data = [
+        lib_data.PackedDataset(data, os.path.join(
+            FLAGS.packed_data_dir, '%s_%s' % (hparams.dataset, fold)))
+        for data, fold in [(train_data, 'train'), (valid_data, 'valid')]]
   print('# of train_data:', train_data.num_examples)
   print('# of valid_data:', valid_data.num_examples)
   if train_data.num_examples < hparams.batch_size:
@@ -2,9 +2,13 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import functools
 import os
+import threading
+import time
 # internal imports
 import numpy as np
+from six.moves import queue as Queue
 import tensorflow as tf
 
 from magenta.models.coconet import lib_mask
@@ -41,10 +45,10 @@ class Dataset(lib_util.Factory):
     hparams.pitch_ranges = [self.min_pitch, self.max_pitch]
     hparams.shortest_duration = self.shortest_duration
     self.encoder = lib_pianoroll.get_pianoroll_encoder_decoder(hparams)
-    data_path = os.path.join(tf.resource_loader.get_data_files_path(),
-                             self.basepath, "%s.npz" % self.name)
-    print("Loading data from", data_path)
-    with tf.gfile.Open(data_path, "r") as p:
+    self.data_path = os.path.join(tf.resource_loader.get_data_files_path(),
+                                  self.basepath, "%s.npz" % self.name)
+    print("Loading data from", self.data_path)
+    with tf.gfile.Open(self.data_path, "r") as p:
       self.data = np.load(p)[fold]
 
   @property
@@ -78,7 +82,7 @@ class Dataset(lib_util.Factory):
       sequences = self.get_sequences()
     return list(map(self.encoder.encode, sequences))
 
-  def get_featuremaps(self, sequences=None):
+  def get_featuremaps(self, sequences=None, rng=None):
     """Turn sequences into features for training/evaluation.
 
     Encodes sequences into randomly cropped and masked pianorolls, and returns
@@ -88,10 +92,12 @@ class Dataset(lib_util.Factory):
     Args:
       sequences: the collection of sequences to convert. If not given, the
           entire dataset is converted.
+      rng: optional seed or numpy RandomState for cropping and masking.
 
     Returns:
       A Batch containing pianorolls, masks and piece lengths.
     """
+    rng = lib_util.get_rng(rng)
     if sequences is None:
       sequences = self.get_sequences()
 
@@ -100,12 +106,14 @@ class Dataset(lib_util.Factory):
 
     for sequence in sequences:
       pianoroll = self.encoder.encode(sequence)
-      pianoroll = lib_util.random_crop(pianoroll, self.hparams.crop_piece_len)
+      pianoroll = lib_util.random_crop(
+          pianoroll, self.hparams.crop_piece_len, rng=rng)
       mask = lib_mask.get_mask(
           self.hparams.maskout_method,
           pianoroll.shape,
           separate_instruments=self.hparams.separate_instruments,
-          blankout_ratio=self.hparams.corrupt_ratio)
+          blankout_ratio=self.hparams.corrupt_ratio,
+          rng=rng)
       pianorolls.append(pianoroll)
       masks.append(mask)
 
@@ -114,6 +122,45 @@ class Dataset(lib_util.Factory):
     assert pianorolls.shape == masks.shape
     return Batch(pianorolls=pianorolls, masks=masks, lengths=lengths)
 
+  def get_batch_jobs(self, size=1, shuffle=False, shuffle_rng=None,
+                     discard_remainder=True):
+    """Return a list of jobs that each prepare a Batch of featuremaps.
+
+    The examples and random seed of each job are determined up front, so the
+    jobs can be run in any thread and in any order; see BatchPrefetcher.
+
+    Args:
+      size: number of examples per batch.
+      shuffle: if true, yield examples in randomly determined order.
+      shuffle_rng: seed or rng to determine random order and the seed of
+          each job.
+      discard_remainder: if true, discard final short batch.
+
+    Returns:
+      A list of callables without arguments that return Batches.
+    """
+    rng = lib_util.get_rng(shuffle_rng)
+    return [
+        functools.partial(self._prepare_batch, indices, rng.randint(2**31))
+        for indices in _split_indices(self.num_examples, size, shuffle, rng,
+                                      discard_remainder)
+    ]
+
+  def _prepare_batch(self, indices, seed):
+    sequences = self.get_sequences()
+    return self.get_featuremaps([sequences[i] for i in indices], rng=seed)
+
+  def get_batches(self, **batches_kwargs):
+    """Iterate over Batches of featuremaps of the entire dataset.
+
+    Args:
+      **batches_kwargs: kwargs passed on to lib_util.batches.
+
+    Returns:
+      An iterator over Batches.
+    """
+    return self.get_featuremaps().batches(**batches_kwargs)
+
   def update_hparams(self, hparams):
     """Update subset of Hyperparameters pertaining to data."""
     for key in "num_instruments num_pitches min_pitch max_pitch qpm".split():
@@ -125,6 +172,279 @@ def get_dataset(basepath, hparams, fold):
   return Dataset.make(hparams.dataset, basepath, hparams, fold)
 
 
+def _split_indices(num_examples, size, shuffle, rng, discard_remainder):
+  """Split example indices into batches, as lib_util.batches does."""
+  indices = np.arange(num_examples)
+  if shuffle:
+    rng.shuffle(indices)
+  for start in range(0, num_examples, size):
+    batch_indices = indices[start:start + size]
+    if len(batch_indices) < size and discard_remainder:
+      break
+    yield batch_indices
+
+
+def _compile_key(dataset):
+  """Return a string identifying what `compile_pianorolls` would write.
+
+  The key covers the encoder settings that determine the pianorolls as well as
+  the source file and fold they are encoded from, so that a compiled dataset
+  is recompiled whenever any of these change.
+
+  Args:
+    dataset: Dataset instance to compile.
+
+  Returns:
+    The key as a string.
+  """
+  encoder = dataset.encoder
+  stat = tf.gfile.Stat(dataset.data_path)
+  return repr([
+      dataset.name, dataset.fold, dataset.data_path, stat.length,
+      stat.mtime_nsec, encoder.quantization_level, encoder.shortest_duration,
+      encoder.min_pitch, encoder.max_pitch, encoder.separate_instruments,
+      encoder.num_instruments
+  ])
+
+
+def _is_compiled(path, key):
+  """Check whether there is a compiled dataset with the given key at `path`."""
+  index_path = "%s_index.npz" % path
+  if not os.path.exists(index_path) or not os.path.exists("%s.npy" % path):
+    return False
+  with np.load(index_path) as index:
+    return "key" in index.files and str(index["key"]) == key
+
+
+def compile_pianorolls(dataset, path):
+  """Encode a dataset once and store its pianorolls bit-packed on disk.
+
+  Writes two files: `path`.npy holds a (total duration, bytes per time step)
+  uint8 array with every time step of every pianoroll packed into bits, and
+  `path`_index.npz holds the offset and length of each pianoroll in it as well
+  as the pitch and instrument dimensions and the key of the dataset (see
+  `_compile_key`).
+
+  Args:
+    dataset: Dataset instance to compile.
+    path: path prefix of the files to write.
+  """
+  pianorolls = dataset.get_pianorolls()
+  lengths = np.array([len(pianoroll) for pianoroll in pianorolls])
+  offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+  pp, ii = pianorolls[0].shape[1:]
+  bits = np.lib.format.open_memmap(
+      "%s.npy" % path, mode="w+", dtype=np.uint8,
+      shape=(int(lengths.sum()), (pp * ii + 7) // 8))
+  for offset, pianoroll in zip(offsets, pianorolls):
+    bits[offset:offset + len(pianoroll)] = np.packbits(
+        pianoroll.reshape([len(pianoroll), pp * ii]).astype(bool), axis=1)
+  bits.flush()
+  del bits
+  with open("%s_index.npz" % path, "wb") as p:
+    np.savez(p, offsets=offsets, lengths=lengths, shape=[pp, ii],
+             key=_compile_key(dataset))
+
+
+class PackedDataset(object):
+  """A Dataset whose pianorolls are read from a compiled, memory-mapped file.
+
+  The pianorolls are encoded only once, by `compile_pianorolls`. Batches are
+  then cropped, masked and padded with vectorized numpy operations, and only
+  the cropped time steps of the pieces in a batch are read and unpacked.
+  """
+
+  def __init__(self, dataset, path):
+    """Initialize a `PackedDataset` instance.
+
+    Args:
+      dataset: Dataset instance to pack. Compiled to `path` if there is no
+          compiled version there yet, or if it was compiled from a different
+          source file or with different encoder settings.
+      path: path prefix of the compiled files.
+    """
+    self.dataset = dataset
+    self.hparams = dataset.hparams
+    if not _is_compiled(path, _compile_key(dataset)):
+      print("Compiling pianorolls to", path)
+      compile_pianorolls(dataset, path)
+    with np.load("%s_index.npz" % path) as index:
+      self.offsets = index["offsets"]
+      self.lengths = index["lengths"]
+      self.pianoroll_shape = tuple(index["shape"])
+    self.bits = np.load("%s.npy" % path, mmap_mode="r")
+
+  @property
+  def num_examples(self):
+    return len(self.lengths)
+
+  def update_hparams(self, hparams):
+    self.dataset.update_hparams(hparams)
+
+  def _read(self, indices, starts, lengths):
+    """Read and unpack time steps into a zero-padded batch of pianorolls."""
+    pp, ii = self.pianoroll_shape
+    steps = np.arange(max(lengths))
+    valid = steps[None, :] < lengths[:, None]
+    rows = (self.offsets[indices] + starts)[:, None] + np.where(
+        valid, steps[None, :], 0)
+    pianorolls = np.unpackbits(self.bits[rows.ravel()], axis=1)[:, :pp * ii]
+    pianorolls = pianorolls.reshape(rows.shape + (pp, ii)).astype(np.float32)
+    pianorolls *= valid[:, :, None, None]
+    return pianorolls
+
+  def get_pianorolls(self, indices=None):
+    """Return a list of the (uncropped) pianorolls."""
+    if indices is None:
+      indices = np.arange(self.num_examples)
+    return [
+        self._read(np.array([i]), np.zeros(1, dtype=np.int64),
+                   self.lengths[[i]])[0] for i in indices
+    ]
+
+  def get_featuremaps(self, indices=None, rng=None):
+    """Return a Batch of randomly cropped and masked pianorolls.
+
+    Args:
+      indices: indices of the examples to include. Defaults to all examples.
+      rng: optional seed or numpy RandomState for cropping and masking.
+
+    Returns:
+      A Batch containing pianorolls, masks and piece lengths.
+    """
+    rng = lib_util.get_rng(rng)
+    if indices is None:
+      indices = np.arange(self.num_examples)
+    indices = np.asarray(indices)
+    lengths = np.minimum(self.lengths[indices], self.hparams.crop_piece_len)
+    # Crop start is uniform over the leeway, as in lib_util.random_crop.
+    leeways = self.lengths[indices] - lengths
+    starts = (rng.random_sample(len(indices)) * (1 + leeways)).astype(np.int64)
+    pianorolls = self._read(indices, starts, lengths)
+    masks = lib_mask.get_batch_masks(
+        self.hparams.maskout_method,
+        pianorolls.shape,
+        lengths,
+        separate_instruments=self.hparams.separate_instruments,
+        blankout_ratio=self.hparams.corrupt_ratio,
+        rng=rng)
+    return Batch(pianorolls=pianorolls, masks=masks, lengths=lengths)
+
+  def get_batch_jobs(self, size=1, shuffle=False, shuffle_rng=None,
+                     discard_remainder=True):
+    """Return a list of jobs that each prepare a Batch of featuremaps.
+
+    Args:
+      size: number of examples per batch.
+      shuffle: if true, yield examples in randomly determined order.
+      shuffle_rng: seed or rng to determine random order and the seeds for
+          the random crops and masks of each job.
+      discard_remainder: if true, discard final short batch.
+
+    Returns:
+      A list of callables without arguments that return Batches.
+    """
+    rng = lib_util.get_rng(shuffle_rng)
+    return [
+        functools.partial(
+            self.get_featuremaps, indices, rng=rng.randint(2**31))
+        for indices in _split_indices(self.num_examples, size, shuffle, rng,
+                                      discard_remainder)
+    ]
+
+  def get_batches(self, **batch_jobs_kwargs):
+    """Iterate over Batches, reading only the examples in each batch.
+
+    Args:
+      **batch_jobs_kwargs: kwargs passed on to get_batch_jobs.
+
+    Yields:
+      Batches of featuremaps.
+    """
+    for job in self.get_batch_jobs(**batch_jobs_kwargs):
+      yield job()
+
+
+class BatchPrefetcher(object):
+  """Iterates over Batches that are prepared ahead by background threads.
+
+  Jobs are handed to `num_workers` threads, and at most `queue_depth` batches
+  are prepared ahead of the consumer. Batches come out in the order of the
+  jobs. `stall_time` accumulates the time the consumer spent waiting for
+  batches, i.e. the time a training loop spent waiting on input.
+  """
+
+  def __init__(self, jobs, num_workers=1, queue_depth=2):
+    """Initialize a BatchPrefetcher instance.
+
+    Args:
+      jobs: iterable of callables without arguments that return Batches.
+      num_workers: number of background threads. If 0, batches are prepared
+          on demand in the consuming thread.
+      queue_depth: maximum number of batches to prepare ahead.
+    """
+    self.jobs = jobs
+    self.num_workers = num_workers
+    self.queue_depth = max(1, queue_depth)
+    self.stall_time = 0.
+    self.num_batches = 0
+
+  def __iter__(self):
+    if not self.num_workers:
+      for job in self.jobs:
+        yield self._wait(job)
+      return
+
+    # Each job gets its own result queue. The result queues are queued in job
+    # order, which bounds the number of batches in flight and lets the
+    # consumer receive batches in order although workers finish out of order.
+    results = Queue.Queue(maxsize=self.queue_depth)
+    work = Queue.Queue()
+
+    def dispatch():
+      for job in self.jobs:
+        result = Queue.Queue(maxsize=1)
+        results.put(result)
+        work.put((job, result))
+      results.put(None)
+      for _ in range(self.num_workers):
+        work.put(None)
+
+    def run():
+      while True:
+        item = work.get()
+        if item is None:
+          return
+        job, result = item
+        try:
+          result.put((True, job()))
+        except Exception as e:  # pylint: disable=broad-except
+          result.put((False, e))
+
+    threads = [threading.Thread(target=dispatch)]
+    threads.extend(
+        threading.Thread(target=run) for _ in range(self.num_workers))
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    while True:
+      result = results.get()
+      if result is None:
+        return
+      succeeded, value = self._wait(result.get)
+      if not succeeded:
+        raise value
+      yield value
+
+  def _wait(self, get):
+    start_time = time.time()
+    value = get()
+    self.stall_time += time.time() - start_time
+    self.num_batches += 1
+    return value
+
+
 class Jsb16thSeparated(Dataset):
   key = "Jsb16thSeparated"
   min_pitch = 36
@@ -0,0 +1,104 @@
+"""Tests for lib_data."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.models.coconet import lib_data
+from magenta.models.coconet import lib_hparams
+
+
+class DatasetTest(tf.test.TestCase):
+
+  def testBatchJobsUseTheirOwnRandomState(self):
+    hparams = lib_hparams.Hyperparameters(dataset='TestData', crop_piece_len=4)
+    dataset = lib_data.get_dataset('testdata', hparams, 'train')
+    jobs = dataset.get_batch_jobs(size=1, shuffle_rng=0) * 4
+
+    np.random.seed(1)
+    expected_sample = np.random.random_sample()
+    np.random.seed(1)
+    features = [job().features for job in jobs]
+    # The global numpy random state is neither used nor modified.
+    self.assertEqual(expected_sample, np.random.random_sample())
+
+    prefetched = lib_data.BatchPrefetcher(jobs, num_workers=2)
+    for expected, batch in zip(features, prefetched):
+      for key in expected:
+        self.assertAllEqual(expected[key], batch.features[key])
+
+
+class PackedDatasetTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.path = os.path.join(self.get_temp_dir(), 'TestData_train')
+
+  def get_dataset(self, basepath='testdata'):
+    hparams = lib_hparams.Hyperparameters(dataset='TestData', crop_piece_len=4)
+    return lib_data.get_dataset(basepath, hparams, 'train')
+
+  def testPianorollsRoundTrip(self):
+    dataset = self.get_dataset()
+    packed = lib_data.PackedDataset(dataset, self.path)
+    self.assertEqual(dataset.num_examples, packed.num_examples)
+    for expected, actual in zip(dataset.get_pianorolls(),
+                                packed.get_pianorolls()):
+      self.assertAllEqual(expected, actual)
+
+  def testFeaturemapsAreCropsOfPianorolls(self):
+    dataset = self.get_dataset()
+    packed = lib_data.PackedDataset(dataset, self.path)
+    pianorolls = dataset.get_pianorolls()
+    features = packed.get_featuremaps(rng=0).features
+    self.assertAllEqual(
+        [len(pianoroll) for pianoroll in pianorolls],
+        packed.lengths)
+    for pianoroll, crop, length in zip(pianorolls, features['pianorolls'],
+                                       features['lengths']):
+      self.assertEqual(min(len(pianoroll), 4), length)
+      starts = [start for start in range(len(pianoroll) - length + 1)
+                if np.array_equal(pianoroll[start:start + length],
+                                  crop[:length])]
+      self.assertTrue(starts)
+    self.assertAllEqual(features['pianorolls'].shape, features['masks'].shape)
+
+    # Featuremaps are determined by the seed.
+    other_features = packed.get_featuremaps(rng=0).features
+    for key in features:
+      self.assertAllEqual(features[key], other_features[key])
+
+  def testRecompilesWhenSourceChanges(self):
+    dataset = self.get_dataset()
+    lib_data.PackedDataset(dataset, self.path)
+
+    # Write a modified copy of the source data, with the same number of
+    # examples, and pack it to the same path.
+    basepath = self.get_temp_dir()
+    with tf.gfile.Open(dataset.data_path, 'r') as p:
+      data = dict(np.load(p))
+    data['train'] = [sequence[:-1] + 1 for sequence in data['train']]
+    with tf.gfile.Open(os.path.join(basepath, 'TestData.npz'), 'w') as p:
+      np.savez(p, **data)
+    dataset = self.get_dataset(basepath)
+    packed = lib_data.PackedDataset(dataset, self.path)
+    for expected, actual in zip(dataset.get_pianorolls(),
+                                packed.get_pianorolls()):
+      self.assertAllEqual(expected, actual)
+
+  def testReusesUpToDateCompilation(self):
+    dataset = self.get_dataset()
+    lib_data.PackedDataset(dataset, self.path)
+    mtime = os.path.getmtime('%s.npy' % self.path)
+    os.utime('%s.npy' % self.path, (mtime - 100, mtime - 100))
+    lib_data.PackedDataset(dataset, self.path)
+    self.assertEqual(mtime - 100, os.path.getmtime('%s.npy' % self.path))
+
+
+if __name__ == '__main__':
+  tf.test.main()
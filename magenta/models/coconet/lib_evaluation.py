@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import multiprocessing
 import time
 # internal imports
 import numpy as np
@@ -11,7 +12,7 @@ from magenta.models.coconet import lib_tfutil
 from magenta.models.coconet import lib_util
 
 
-def evaluate(evaluator, pianorolls):
+def evaluate(evaluator, pianorolls, packed=False):
   """Evaluate a sequence of pianorolls.
 
   The returned dictionary contains two kinds of evaluation results: the "unit"
@@ -24,6 +25,9 @@ def evaluate(evaluator, pianorolls):
   Args:
     evaluator: an instance of BaseEvaluator
     pianorolls: sequence of pianorolls to evaluate
+    packed: whether to evaluate all pianorolls at once through the evaluator's
+        `evaluate_many`, packing pianorolls of the same shape into the same
+        batches.
 
   Returns:
     A dictionary with evaluation results.
@@ -31,11 +35,22 @@ def evaluate(evaluator, pianorolls):
   example_losses = []
   unit_losses = []
 
+  if packed:
+    tf.logging.info("evaluating %d pieces", len(pianorolls))
+    start_time = time.time()
+    packed_unit_losses = [-lls for lls in evaluator.evaluate_many(pianorolls)]
+    duration = (time.time() - start_time) / 60.
+    tf.logging.info("evaluated %d pieces in %5.2fmin", len(pianorolls),
+                    duration)
+
   for pi, pianoroll in enumerate(pianorolls):
     tf.logging.info("evaluating piece %d", pi)
     start_time = time.time()
 
-    unit_loss = -evaluator(pianoroll)
+    if packed:
+      unit_loss = packed_unit_losses[pi]
+    else:
+      unit_loss = -evaluator(pianoroll)
     example_loss = np.mean(unit_loss)
 
     example_losses.append(example_loss)
@@ -82,17 +97,27 @@ def _flatcat(xs):
 
 
 class BaseEvaluator(lib_util.Factory):
-  """Evaluator base class."""
+  """Evaluator base class.
+
+  Evaluators compile one model input per unit of prediction. Rather than
+  materializing all of them at once, the inputs are generated lazily in chunks
+  whose size is derived from `memory_budget`, and the inputs for several
+  pianorolls of the same shape are packed into the same chunks.
+  """
 
-  def __init__(self, wmodel, chronological):
+  def __init__(self, wmodel, chronological, memory_budget=None):
     """Initialize BaseEvaluator instance.
 
     Args:
       wmodel: WrappedModel instance
       chronological: whether to evaluate in chronological order or in any order
+      memory_budget: approximate number of bytes a single model evaluation may
+          use. If None, each model evaluation covers the inputs of at most
+          one pianoroll, as when evaluating pianorolls one at a time.
     """
     self.wmodel = wmodel
     self.chronological = chronological
+    self.memory_budget = memory_budget
 
     def predictor(pianorolls, masks):
       p = self.wmodel.sess.run(
@@ -122,21 +147,126 @@ class BaseEvaluator(lib_util.Factory):
     Returns:
       unit losses
     """
+    return self.evaluate_many([pianoroll])[0]
+
+  def evaluate_many(self, pianorolls, seeds=None):
+    """Evaluate a sequence of pianorolls in packed batches.
+
+    Orderings are drawn for the pianorolls in turn, so given the same random
+    state the results are the same as when calling the evaluator on each
+    pianoroll one after another.
+
+    Args:
+      pianorolls: sequence of pianorolls, each shaped (tt, pp, ii)
+      seeds: optional sequence of numpy seeds, one for each pianoroll, under
+          which to draw its ordering.
+
+    Returns:
+      A list with the unit losses of each pianoroll.
+    """
+    pianorolls = [np.asarray(pianoroll) for pianoroll in pianorolls]
+    if seeds is None:
+      seeds = [None] * len(pianorolls)
+    orderings = []
+    for pianoroll, seed in lib_util.eqzip(pianorolls, seeds):
+      tt = pianoroll.shape[0]
+      with lib_util.numpy_seed(seed):
+        orderings.append(self.draw_ordering(tt, self._variables_per_step(
+            pianoroll.shape)))
+
+    indices_by_shape = {}
+    for i, pianoroll in enumerate(pianorolls):
+      indices_by_shape.setdefault(pianoroll.shape, []).append(i)
+
+    lls = [None] * len(pianorolls)
+    for indices in indices_by_shape.values():
+      group_lls = self._evaluate_group(
+          np.array([pianorolls[i] for i in indices]),
+          np.array([orderings[i][0] for i in indices]),
+          np.array([orderings[i][1] for i in indices]))
+      for i, group_ll in zip(indices, group_lls):
+        lls[i] = group_ll
+    return lls
+
+  def draw_ordering(self, tt, dd):
+    """Draw the order in which to evaluate the variables of a pianoroll.
+
+    Args:
+      tt: number of time steps.
+      dd: number of variables per time step.
+
+    Returns:
+      A tuple `(ts, ds)` of time and variable indices, each shaped (tt * dd,).
+    """
     raise NotImplementedError()
 
-  def _update_lls(self, lls, x, pxhat, t, d):
-    """Update accumulated log-likelihoods.
+  def _evaluate_group(self, xs, ts, ds):
+    """Evaluate pianorolls of the same shape.
 
-    Note: the shape of `lls` and the range of `d` depends on the "number of
-    variables per time step" `dd`, which is the number of instruments if
-    instruments if instruments are separated or the number of pitches otherwise.
+    Args:
+      xs: the pianorolls, shape (N, tt, P, I).
+      ts: the time indices of each pianoroll's ordering, shape (N, tt * dd).
+      ds: the variable indices of each pianoroll's ordering, shape
+          (N, tt * dd).
+
+    Returns:
+      A sequence with the unit losses of each pianoroll.
+    """
+    raise NotImplementedError()
+
+  def _variables_per_step(self, shape):
+    unused_tt, pp, ii = shape
+    assert self.separate_instruments or ii == 1
+    return ii if self.separate_instruments else pp
+
+  def chunk_size(self, shape):
+    """Number of examples shaped `shape` that fit in the memory budget."""
+    if self.memory_budget is None:
+      return None
+    tt, pp, ii = shape
+    # Inputs, masks and outputs, plus about three live hidden featuremaps.
+    floats_per_example = tt * pp * (3 * ii + 3 * self.hparams.num_filters)
+    return max(1, int(self.memory_budget // (4 * floats_per_example)))
+
+  def _chunks(self, num_examples, shape, examples_per_piece):
+    """Iterate over index ranges of examples that fit the memory budget.
+
+    Args:
+      num_examples: total number of examples.
+      shape: shape (tt, pp, ii) of each example.
+      examples_per_piece: number of examples compiled for each pianoroll,
+          which is the chunk size if there is no memory budget.
+
+    Yields:
+      Arrays of consecutive example indices.
+    """
+    size = self.chunk_size(shape) or examples_per_piece
+    for start in range(0, num_examples, size):
+      yield np.arange(start, min(start + size, num_examples))
+
+  def _tile_masks(self, masks, shape):
+    """Tile (B, tt, dd) variable masks into (B, tt, P, I) model masks."""
+    unused_tt, pp, ii = shape
+    masks = masks.astype(np.float32)
+    if self.separate_instruments:
+      return np.tile(masks[:, :, None, :], [1, 1, pp, 1])
+    return np.tile(masks[:, :, :, None], [1, 1, 1, ii])
+
+  def _unit_lls(self, x, pxhat, t, d):
+    """Compute unit log-likelihoods.
+
+    Note: the range of `d` depends on the "number of variables per time step"
+    `dd`, which is the number of instruments if instruments are separated or
+    the number of pitches otherwise.
 
     Args:
-      lls: (tt, dd)-shaped array of unit log-likelihoods.
       x: the pianoroll being evaluated, shape (B, tt, P, I).
       pxhat: the probabilities output by the model, shape (B, tt, P, I).
       t: the batch of time indices being evaluated, shape (B,).
       d: the batch of variable indices being evaluated, shape (B,).
+
+    Returns:
+      The log-likelihood of each variable, shape (B,).
     """
     # The code below assumes x is binary, so instead of x * log(px) which is
     # inconveniently NaN if both x and log(px) are zero, we can use
@@ -145,7 +275,19 @@ class BaseEvaluator(lib_util.Factory):
     index = ((np.arange(x.shape[0]), t, slice(None), d)
              if self.separate_instruments else (np.arange(x.shape[0]), t, d,
                                                 slice(None)))
-    lls[t, d] = np.log(np.where(x[index], pxhat[index], 1)).sum(axis=1)
+    return np.log(np.where(x[index], pxhat[index], 1)).sum(axis=1)
+
+  def _update_lls(self, lls, x, pxhat, t, d):
+    """Update accumulated log-likelihoods.
+
+    Args:
+      lls: (tt, dd)-shaped array of unit log-likelihoods.
+      x: the pianoroll being evaluated, shape (B, tt, P, I).
+      pxhat: the probabilities output by the model, shape (B, tt, P, I).
+      t: the batch of time indices being evaluated, shape (B,).
+      d: the batch of variable indices being evaluated, shape (B,).
+    """
+    lls[t, d] = self._unit_lls(x, pxhat, t, d)
 
 
 class FrameEvaluator(BaseEvaluator):
@@ -160,68 +302,57 @@ class FrameEvaluator(BaseEvaluator):
   """
   key = "frame"
 
-  def __call__(self, pianoroll):
-    tt, pp, ii = pianoroll.shape
-    assert self.separate_instruments or ii == 1
-    dd = ii if self.separate_instruments else pp
-
-    # Compile a batch with each frame being an example.
-    bb = tt
-    xs = np.tile(pianoroll[None], [bb, 1, 1, 1])
-
-    ts, ds = self.draw_ordering(tt, dd)
-
-    # Set up sequence of masks to predict the first (according to ordering)
-    # instrument for each frame
-    mask = []
-    mask_scratch = np.ones([tt, pp, ii], dtype=np.float32)
-    for j, (t, d) in enumerate(zip(ts, ds)):
-      # When time rolls over, reveal the entire current frame for purposes of
-      # predicting the next one.
-      if j % dd != 0:
-        continue
-      mask.append(mask_scratch.copy())
-      mask_scratch[t, :, :] = 0
-    assert np.allclose(mask_scratch, 0)
-    del mask_scratch
-    mask = np.array(mask)
-
-    lls = np.zeros([tt, dd], dtype=np.float32)
-
-    # We can't parallelize within the frame, as we need the predictions of
-    # some of the other instruments.
-    # Hence we outer loop over the instruments and parallelize across frames.
-    xs_scratch = xs.copy()
-    for d_idx in range(dd):
-      # Call out to the model to get predictions for the first instrument
-      # at each time step.
-      pxhats = self.predictor(xs_scratch, mask)
-
-      t, d = ts[d_idx::dd], ds[d_idx::dd]
-      assert len(t) == bb and len(d) == bb
-
-      # Write in predictions and update mask.
-      if self.separate_instruments:
-        xs_scratch[np.arange(bb), t, :, d] = np.eye(pp)[np.argmax(
-            pxhats[np.arange(bb), t, :, d], axis=1)]
-        mask[np.arange(bb), t, :, d] = 0
-        # Every example in the batch sees one frame more than the previous.
-        assert np.allclose(
-            (1 - mask).sum(axis=(1, 2, 3)),
-            [(k * dd + d_idx + 1) * pp for k in range(mask.shape[0])])
-      else:
-        xs_scratch[np.arange(bb), t, d, :] = (
-            pxhats[np.arange(bb), t, d, :] > 0.5)
-        mask[np.arange(bb), t, d, :] = 0
-        # Every example in the batch sees one frame more than the previous.
-        assert np.allclose(
-            (1 - mask).sum(axis=(1, 2, 3)),
-            [(k * dd + d_idx + 1) * ii for k in range(mask.shape[0])])
-
-      self._update_lls(lls, xs, pxhats, t, d)
+  def _evaluate_group(self, xs, ts, ds):
+    nn, tt, pp, ii = xs.shape
+    dd = self._variables_per_step((tt, pp, ii))
+
+    # There is an example for each frame, which reveals all frames that come
+    # before it in the ordering. frame_ranks[n, t] is the position of frame t
+    # in the ordering of pianoroll n.
+    frame_ranks = np.zeros([nn, tt], dtype=np.int32)
+    frame_ranks[np.arange(nn)[:, None], ts[:, ::dd]] = np.arange(tt)[None, :]
+
+    lls = np.zeros([nn, tt, dd], dtype=np.float32)
+    for rows in self._chunks(nn * tt, (tt, pp, ii), tt):
+      n, k = np.divmod(rows, tt)
+      bb = len(rows)
+      x = xs[n]
+      mask = self._tile_masks(
+          np.tile((frame_ranks[n] >= k[:, None])[:, :, None], [1, 1, dd]),
+          (tt, pp, ii))
+
+      # We can't parallelize within the frame, as we need the predictions of
+      # some of the other instruments.
+      # Hence we outer loop over the instruments and parallelize across
+      # frames.
+      xs_scratch = x.copy()
+      for d_idx in range(dd):
+        # Call out to the model to get predictions for the first instrument
+        # at each time step.
+        pxhats = self.predictor(xs_scratch, mask)
+
+        t, d = ts[n, k * dd + d_idx], ds[n, k * dd + d_idx]
+
+        # Write in predictions and update mask.
+        if self.separate_instruments:
+          xs_scratch[np.arange(bb), t, :, d] = np.eye(pp)[np.argmax(
+              pxhats[np.arange(bb), t, :, d], axis=1)]
+          mask[np.arange(bb), t, :, d] = 0
+          # Every example in the batch sees one frame more than the previous.
+          assert np.allclose((1 - mask).sum(axis=(1, 2, 3)),
+                             (k * dd + d_idx + 1) * pp)
+        else:
+          xs_scratch[np.arange(bb), t, d, :] = (
+              pxhats[np.arange(bb), t, d, :] > 0.5)
+          mask[np.arange(bb), t, d, :] = 0
+          # Every example in the batch sees one frame more than the previous.
+          assert np.allclose((1 - mask).sum(axis=(1, 2, 3)),
+                             (k * dd + d_idx + 1) * ii)
+
+        lls[n, t, d] = self._unit_lls(x, pxhats, t, d)
 
     # conjunction over notes within frames; frame is the unit of prediction
-    return lls.sum(axis=1)
+    return lls.sum(axis=2)
 
   def draw_ordering(self, tt, dd):
     o = np.arange(tt, dtype=np.int32)
@@ -232,7 +363,7 @@ class FrameEvaluator(BaseEvaluator):
     for t in range(tt):
       np.random.shuffle(o[t])
     o = o.reshape([tt * dd])
-    ts, ds = np.unravel_index(o.T, dims=(tt, dd))
+    ts, ds = np.unravel_index(o.T, (tt, dd))
     return ts, ds
 
 
@@ -240,42 +371,31 @@ class NoteEvaluator(BaseEvaluator):
   """Evalutes note-based negative likelihood."""
   key = "note"
 
-  def __call__(self, pianoroll):
-    tt, pp, ii = pianoroll.shape
-    assert self.separate_instruments or ii == 1
-    dd = ii if self.separate_instruments else pp
-
-    # compile a batch with an example for each variable
-    bb = tt * dd
-    xs = np.tile(pianoroll[None], [bb, 1, 1, 1])
-
-    ts, ds = self.draw_ordering(tt, dd)
-    assert len(ts) == bb and len(ds) == bb
-
-    # set up sequence of masks, one for each variable
-    mask = []
-    mask_scratch = np.ones([tt, pp, ii], dtype=np.float32)
-    for unused_j, (t, d) in enumerate(zip(ts, ds)):
-      mask.append(mask_scratch.copy())
-      if self.separate_instruments:
-        mask_scratch[t, :, d] = 0
-      else:
-        mask_scratch[t, d, :] = 0
-    assert np.allclose(mask_scratch, 0)
-    del mask_scratch
-    mask = np.array(mask)
-
-    pxhats = self.predictor(xs, mask)
-
-    lls = np.zeros([tt, dd], dtype=np.float32)
-    self._update_lls(lls, xs, pxhats, ts, ds)
+  def _evaluate_group(self, xs, ts, ds):
+    nn, tt, pp, ii = xs.shape
+    dd = self._variables_per_step((tt, pp, ii))
+
+    # There is an example for each variable, which reveals all variables that
+    # come before it in the ordering. ranks[n, t, d] is the position of
+    # variable (t, d) in the ordering of pianoroll n.
+    ranks = np.zeros([nn, tt, dd], dtype=np.int32)
+    ranks[np.arange(nn)[:, None], ts, ds] = np.arange(tt * dd)[None, :]
+
+    lls = np.zeros([nn, tt, dd], dtype=np.float32)
+    for rows in self._chunks(nn * tt * dd, (tt, pp, ii), tt * dd):
+      n, j = np.divmod(rows, tt * dd)
+      x = xs[n]
+      mask = self._tile_masks(ranks[n] >= j[:, None, None], (tt, pp, ii))
+      pxhats = self.predictor(x, mask)
+      t, d = ts[n, j], ds[n, j]
+      lls[n, t, d] = self._unit_lls(x, pxhats, t, d)
     return lls
 
-  def _draw_ordering(self, tt, dd):
+  def draw_ordering(self, tt, dd):
     o = np.arange(tt * dd, dtype=np.int32)
     if not self.chronological:
       np.random.shuffle(o)
-    ts, ds = np.unravel_index(o.T, dims=(tt, dd))
+    ts, ds = np.unravel_index(o.T, (tt, dd))
     return ts, ds
 
 
@@ -287,13 +407,111 @@ class EnsemblingEvaluator(object):
   in probability space, which gives a better result than averaging in log space
   (which would correspond to a geometric mean that is unnormalized and tends
   to waste probability mass).
+
+  `evaluate_many` can spread the orderings of all pieces over a pool of worker
+  processes, each of which loads its own copy of the model through
+  `evaluator_factory`. Every ordering is drawn under its own seed, so results
+  do not depend on the number of workers or on how work is assigned to them.
+  The pool is started on first use and kept for later calls until `close` is
+  called.
   """
   key = "_ensembling"
 
-  def __init__(self, evaluator, ensemble_size):
+  def __init__(self, evaluator, ensemble_size, seed=None, num_workers=0,
+               evaluator_factory=None):
+    """Initialize EnsemblingEvaluator instance.
+
+    Args:
+      evaluator: BaseEvaluator instance to ensemble.
+      ensemble_size: number of orderings to average over.
+      seed: optional seed from which the seed of each ordering is derived.
+      num_workers: number of worker processes. If 0, evaluates in this
+          process.
+      evaluator_factory: picklable callable without arguments that returns a
+          BaseEvaluator; called once in each worker process.
+
+    Raises:
+      ValueError: if num_workers is set but evaluator_factory is not.
+    """
+    if num_workers and evaluator_factory is None:
+      raise ValueError("Need an evaluator_factory to evaluate in workers.")
     self.evaluator = evaluator
     self.ensemble_size = ensemble_size
+    self.seed = seed
+    self.num_workers = num_workers
+    self.evaluator_factory = evaluator_factory
+    self._pool = None
+
+  def close(self):
+    """Shut down the worker processes, if any were started."""
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
 
   def __call__(self, pianoroll):
     lls = [self.evaluator(pianoroll) for _ in range(self.ensemble_size)]
     return logsumexp(lls, b=1. / len(lls), axis=0)
+
+  def evaluate_many(self, pianorolls):
+    """Evaluate a sequence of pianorolls with all orderings packed together."""
+    pianorolls = list(pianorolls)
+    seeds = self._ordering_seeds(len(pianorolls))
+    if self.num_workers:
+      lls = self._evaluate_in_workers(pianorolls, seeds)
+    else:
+      lls = self.evaluator.evaluate_many(
+          [pianoroll for pianoroll in pianorolls
+           for _ in range(self.ensemble_size)],
+          seeds=seeds)
+    return [
+        logsumexp(lls[i:i + self.ensemble_size], b=1. / self.ensemble_size,
+                  axis=0)
+        for i in range(0, len(lls), self.ensemble_size)
+    ]
+
+  def _ordering_seeds(self, num_pieces):
+    """Returns a seed for every ordering of every piece, in piece order."""
+    seed = self.seed
+    if seed is None:
+      if not self.num_workers:
+        return None
+      seed = np.random.randint(2**31)
+    rng = np.random.RandomState(seed)
+    return list(rng.randint(2**31, size=num_pieces * self.ensemble_size))
+
+  def _evaluate_in_workers(self, pianorolls, seeds):
+    tasks = [(j, pianoroll, seeds[j])
+             for j, pianoroll in enumerate(
+                 pianoroll for pianoroll in pianorolls
+                 for _ in range(self.ensemble_size))]
+    lls = [None] * len(tasks)
+    if self._pool is None:
+      self._pool = multiprocessing.Pool(
+          self.num_workers,
+          initializer=_init_worker,
+          initargs=(self.evaluator_factory,))
+    start_time = time.time()
+    for count, (j, ll) in enumerate(
+        self._pool.imap_unordered(_evaluate_in_worker, tasks), 1):
+      lls[j] = ll
+      elapsed = (time.time() - start_time) / 60.
+      tf.logging.info(
+          "evaluated %d/%d orderings, %5.2fmin elapsed, %5.2fmin left",
+          count, len(tasks), elapsed,
+          elapsed / count * (len(tasks) - count))
+    return lls
+
+
+# Evaluator instantiated in each worker process by _init_worker.
+_worker_evaluator = None
+
+
+def _init_worker(evaluator_factory):
+  global _worker_evaluator
+  _worker_evaluator = evaluator_factory()
+
+
+def _evaluate_in_worker(task):
+  j, pianoroll, seed = task
+  return j, _worker_evaluator.evaluate_many([pianoroll], seeds=[seed])[0]
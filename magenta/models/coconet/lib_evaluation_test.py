@@ -0,0 +1,172 @@
+"""Tests for lib_evaluation."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.models.coconet import lib_evaluation
+from magenta.models.coconet import lib_hparams
+from magenta.models.coconet import lib_util
+
+
+class FakeModel(object):
+  """Stands in for a model graph, naming its inputs and outputs."""
+  pianorolls = 'pianorolls'
+  masks = 'masks'
+  predictions = 'predictions'
+
+
+class FakeSession(object):
+  """Computes predictions that depend on the unmasked context."""
+
+  def __init__(self):
+    self.batch_sizes = []
+
+  def run(self, fetches, feed_dict):
+    assert fetches == FakeModel.predictions
+    pianorolls = feed_dict[FakeModel.pianorolls]
+    self.batch_sizes.append(len(pianorolls))
+    masks = feed_dict[FakeModel.masks]
+    context = pianorolls * (1 - masks)
+    logits = (0.3 * np.cumsum(context, axis=1) +
+              0.5 * np.roll(context, 1, axis=3) -
+              0.2 * np.roll(masks, 1, axis=2) +
+              0.05 * np.arange(pianorolls.shape[2])[None, None, :, None])
+    probs = np.exp(logits - logits.max(axis=2, keepdims=True))
+    return (probs / probs.sum(axis=2, keepdims=True)).astype(np.float32)
+
+
+class FakeWrappedModel(object):
+
+  def __init__(self):
+    self.hparams = lib_hparams.Hyperparameters(num_filters=8)
+    self.model = FakeModel()
+    self.sess = FakeSession()
+
+
+def make_evaluator(unit='note', memory_budget=None):
+  return lib_evaluation.BaseEvaluator.make(
+      unit, wmodel=FakeWrappedModel(), chronological=False,
+      memory_budget=memory_budget)
+
+
+def tiled_note_lls(predictor, pianoroll, ts, ds):
+  """Evaluate notes with one tiled batch per pianoroll, as originally done."""
+  tt, pp, ii = pianoroll.shape
+  bb = tt * ii
+  xs = np.tile(pianoroll[None], [bb, 1, 1, 1])
+  mask = []
+  mask_scratch = np.ones([tt, pp, ii], dtype=np.float32)
+  for t, d in zip(ts, ds):
+    mask.append(mask_scratch.copy())
+    mask_scratch[t, :, d] = 0
+  pxhats = predictor(xs, np.array(mask))
+  lls = np.zeros([tt, ii], dtype=np.float32)
+  index = (np.arange(bb), ts, slice(None), ds)
+  lls[ts, ds] = np.log(np.where(xs[index], pxhats[index], 1)).sum(axis=1)
+  return lls
+
+
+def tiled_frame_lls(predictor, pianoroll, ts, ds):
+  """Evaluate frames with one tiled batch per pianoroll, as originally done."""
+  tt, pp, ii = pianoroll.shape
+  bb = tt
+  xs = np.tile(pianoroll[None], [bb, 1, 1, 1])
+  mask = []
+  mask_scratch = np.ones([tt, pp, ii], dtype=np.float32)
+  for j, t in enumerate(ts):
+    if j % ii == 0:
+      mask.append(mask_scratch.copy())
+      mask_scratch[t, :, :] = 0
+  mask = np.array(mask)
+  lls = np.zeros([tt, ii], dtype=np.float32)
+  xs_scratch = xs.copy()
+  for d_idx in range(ii):
+    pxhats = predictor(xs_scratch, mask)
+    t, d = ts[d_idx::ii], ds[d_idx::ii]
+    xs_scratch[np.arange(bb), t, :, d] = np.eye(pp)[np.argmax(
+        pxhats[np.arange(bb), t, :, d], axis=1)]
+    mask[np.arange(bb), t, :, d] = 0
+    index = (np.arange(bb), t, slice(None), d)
+    lls[t, d] = np.log(np.where(xs[index], pxhats[index], 1)).sum(axis=1)
+  return lls.sum(axis=1)
+
+
+class EvaluationTest(tf.test.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.pianorolls = []
+    for tt in [6, 8, 6]:
+      pianoroll = np.zeros([tt, 5, 3], dtype=np.float32)
+      pianoroll[np.arange(tt)[:, None], rng.randint(5, size=[tt, 3]),
+                np.arange(3)[None, :]] = 1.
+      self.pianorolls.append(pianoroll)
+
+  def testChunkingDoesNotChangeLikelihoods(self):
+    seeds = [1, 2, 3]
+    for unit in ['frame', 'note']:
+      expected = make_evaluator(unit).evaluate_many(self.pianorolls, seeds)
+      # A budget this small evaluates one example per model call.
+      chunked_evaluator = make_evaluator(unit, memory_budget=1)
+      self.assertEqual(1, chunked_evaluator.chunk_size((6, 5, 3)))
+      lls = chunked_evaluator.evaluate_many(self.pianorolls, seeds)
+      for expected_ll, ll in zip(expected, lls):
+        self.assertAllClose(expected_ll, ll)
+
+  def testMatchesTiledEvaluation(self):
+    seeds = [1, 2, 3]
+    for unit, tiled_lls in [('frame', tiled_frame_lls),
+                            ('note', tiled_note_lls)]:
+      for memory_budget in [None, 1, 2**16]:
+        evaluator = make_evaluator(unit, memory_budget=memory_budget)
+        lls = evaluator.evaluate_many(self.pianorolls, seeds)
+        for pianoroll, seed, ll in zip(self.pianorolls, seeds, lls):
+          with lib_util.numpy_seed(seed):
+            ts, ds = evaluator.draw_ordering(len(pianoroll), 3)
+          self.assertAllClose(
+              tiled_lls(evaluator.predictor, pianoroll, ts, ds), ll,
+              atol=1e-5)
+
+  def testNoMemoryBudgetEvaluatesOnePieceAtATime(self):
+    evaluator = make_evaluator('note')
+    evaluator.evaluate_many(self.pianorolls)
+    # The largest pianoroll has 8 time steps and 3 instruments.
+    self.assertEqual(8 * 3, max(evaluator.wmodel.sess.batch_sizes))
+
+  def testEvaluateManyMatchesSinglePianorolls(self):
+    for unit in ['frame', 'note']:
+      evaluator = make_evaluator(unit, memory_budget=2**16)
+      lls = evaluator.evaluate_many(self.pianorolls, seeds=[1, 2, 3])
+      for pianoroll, seed, ll in zip(self.pianorolls, [1, 2, 3], lls):
+        self.assertAllClose(
+            evaluator.evaluate_many([pianoroll], seeds=[seed])[0], ll)
+
+  def testEnsemblingEvaluatorReusesWorkers(self):
+    expected = lib_evaluation.EnsemblingEvaluator(
+        make_evaluator(), ensemble_size=2, seed=1).evaluate_many(
+            self.pianorolls)
+
+    evaluator = lib_evaluation.EnsemblingEvaluator(
+        make_evaluator(), ensemble_size=2, seed=1, num_workers=2,
+        evaluator_factory=make_evaluator)
+    try:
+      lls = evaluator.evaluate_many(self.pianorolls)
+      pool = evaluator._pool
+      more_lls = evaluator.evaluate_many(self.pianorolls)
+      self.assertIs(pool, evaluator._pool)
+    finally:
+      evaluator.close()
+    self.assertIsNone(evaluator._pool)
+
+    for expected_ll, ll, more_ll in zip(expected, lls, more_lls):
+      self.assertAllClose(expected_ll, ll)
+      self.assertAllClose(expected_ll, more_ll)
+
+
+if __name__ == '__main__':
+  tf.test.main()
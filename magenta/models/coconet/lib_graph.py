@@ -60,6 +60,10 @@ class CoconetGraph(object):
   def pianorolls(self):
     return self.inputs['pianorolls']
 
+  @property
+  def temporal_receptive_field(self):
+    return get_temporal_receptive_field(self.hparams)
+
   @property
   def masks(self):
     return self.inputs['masks']
@@ -335,6 +339,43 @@ class CoconetGraph(object):
         padding=layer['pool_pad'])
 
 
+def get_temporal_receptive_field(hparams):
+  """Returns how far the convnet output looks back and ahead in time.
+
+  The output at time t depends only on the input at times
+  [t - before, t + after], as convolutions are zero-padded the same way as in
+  `CoconetGraph.apply_convolution`.
+
+  Args:
+    hparams: Hyperparameters object.
+
+  Returns:
+    A tuple `(before, after)` of numbers of time steps.
+
+  Raises:
+    ValueError: if the architecture has layers that change the temporal
+        resolution or do not use SAME padding.
+  """
+  before, after = 0, 0
+  for i, layer in enumerate(hparams.get_conv_arch().layers):
+    if 'pooling' in layer or layer.get('conv_stride', 1) != 1:
+      raise ValueError('Layer %d changes the temporal resolution.' % i)
+    if 'filters' not in layer:
+      continue
+    if layer.get('conv_pad', 'SAME') != 'SAME':
+      raise ValueError('Layer %d does not use SAME padding.' % i)
+    regular_convs = (not hparams.use_sep_conv or
+                     i < hparams.num_initial_regular_conv_layers)
+    # Only the separable convolutions take the dilation rate into account.
+    rate = 1 if regular_convs else layer.get('dilation_rate', 1)
+    if isinstance(rate, (list, tuple)):
+      rate = rate[0]
+    total_padding = (layer['filters'][0] - 1) * rate
+    before += total_padding // 2
+    after += total_padding - total_padding // 2
+  return before, after
+
+
 def get_placeholders(hparams):
   return dict(
       pianorolls=tf.placeholder(
@@ -2,7 +2,10 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import collections
 import contextlib
+import json
+import mmap
 import os
 # internal imports
 import numpy as np
@@ -16,7 +19,7 @@ class NoLogger(object):
 
   @contextlib.contextmanager
   def section(self, *args, **kwargs):
-    pass
+    yield
 
 
 class Logger(object):
@@ -105,3 +108,280 @@ class _Section(object):
     else:
       self.items[-1] = item
     self.i += 1
+
+
+class StreamingLogger(object):
+  """Logger that writes records to disk as they arrive.
+
+  Follows the same sectioning and subsampling rules as Logger, and retains the
+  same records, but instead of keeping the log in memory it appends each record
+  to a data file as soon as it is known to be retained. Nested sections are
+  subsampled along with the records of their parent section. Only the most
+  recent item of each open section is held in memory, and only if it is not
+  yet known whether it will be retained.
+
+  Binary arrays such as pianorolls and masks are bit-packed, arrays under the
+  keys in `quantized_keys` (predictions by default) are quantized to
+  `quantization_bits` bits, and everything else is stored as is. The log is a
+  directory holding the data file and a line-per-array index, and can be read
+  back with LogReader.
+  """
+
+  def __init__(self, path, quantization_bits=8,
+               quantized_keys=("predictions",)):
+    """Initialize a StreamingLogger instance.
+
+    Args:
+      path: the directory in which to write the log.
+      quantization_bits: the precision of quantized arrays, 8 or 16.
+      quantized_keys: the keys of arrays with values in [0, 1] to quantize.
+
+    Raises:
+      ValueError: if `quantization_bits` is not supported.
+    """
+    if quantization_bits not in _QUANTIZED_DTYPES:
+      raise ValueError("Unsupported quantization_bits: %r" % quantization_bits)
+    self.path = path
+    self.quantization_bits = quantization_bits
+    self.quantized_keys = set(quantized_keys)
+    if not os.path.exists(path):
+      os.makedirs(path)
+    self._data_file = open(os.path.join(path, _DATA_FILENAME), "wb")
+    self._index_file = open(os.path.join(path, _INDEX_FILENAME), "w")
+    self._offset = 0
+    self.root = _StreamingSection("0_root", self._write, subsample_factor=1)
+    self.stack = [self.root]
+
+  @contextlib.contextmanager
+  def section(self, label, subsample_factor=None):
+    """Context manager that logs to a section nested one level deeper.
+
+    Args:
+      label: A short name for the section.
+      subsample_factor: Rate at which to subsample logging in this section.
+
+    Yields:
+      yields to caller.
+    """
+    parent = self.stack[-1]
+    i, write = parent.add()
+    new_section = _StreamingSection(
+        os.path.join(parent.path, "%s_%s" % (i, label)), write,
+        subsample_factor=subsample_factor)
+    self.stack.append(new_section)
+    yield
+    self.stack.pop()
+    new_section.flush()
+
+  def log(self, **kwargs):
+    """Add a record to the log.
+
+    Values must be numeric arrays or scalars.
+
+    Args:
+      **kwargs: dictionary of key-value pairs to log.
+    """
+    self.stack[-1].log(kwargs)
+
+  def close(self):
+    """Write any pending records and close the log."""
+    for section in reversed(self.stack):
+      section.flush()
+    self._data_file.close()
+    self._index_file.close()
+
+  def _write(self, record):
+    section_path, i, kwargs = record
+    for key, value in sorted(kwargs.items()):
+      value = np.asarray(value)
+      entry = dict(key=os.path.join(section_path, "%s_%s" % (i, key)),
+                   section=section_path, step=i, name=key,
+                   dtype=value.dtype.str, shape=list(value.shape))
+      if value.dtype.kind not in "biuf":
+        raise ValueError("Cannot stream non-numeric value for %r" % key)
+      if np.all((value == 0) | (value == 1)):
+        entry["encoding"] = "bits"
+        data = np.packbits(value.astype(np.bool_).ravel()).tobytes()
+      elif key in self.quantized_keys:
+        entry["encoding"] = "quantized"
+        entry["bits"] = self.quantization_bits
+        levels = 2**self.quantization_bits - 1
+        data = np.round(np.clip(value, 0, 1) * levels).astype(
+            _QUANTIZED_DTYPES[self.quantization_bits]).tobytes()
+      else:
+        entry["encoding"] = "raw"
+        data = np.ascontiguousarray(value).tobytes()
+      entry["offset"] = self._offset
+      entry["nbytes"] = len(data)
+      self._data_file.write(data)
+      self._offset += len(data)
+      self._index_file.write(json.dumps(entry) + "\n")
+
+
+class _StreamingSection(object):
+  """A section in the StreamingLogger structure."""
+
+  def __init__(self, path, write, subsample_factor=None):
+    """Initialize a _StreamingSection instance.
+
+    Args:
+      path: The path of the section in the log.
+      write: Callable that writes a retained record of this section.
+      subsample_factor: Rate at which to subsample logging in this section.
+    """
+    self.path = path
+    self.write = write
+    self.subsample_factor = 1 if subsample_factor is None else subsample_factor
+    self.pending = None
+    self.i = 0
+
+  def add(self):
+    """Add an item, i.e. a record or a nested section, to this section.
+
+    Under the rule of _Section.log, the `i`th item is retained if `i` is a
+    multiple of `subsample_factor` or if it is the last item. Records of items
+    that are retained in any case are written right away. Records of other
+    items are held back until the next item supersedes them or the section is
+    flushed.
+
+    Returns:
+      The index of the item and a callable that writes its records.
+    """
+    # A new item supersedes the pending one.
+    self.pending = None
+    i = self.i
+    self.i += 1
+    if self.subsample_factor == 1 or i % self.subsample_factor == 0:
+      return i, self.write
+    self.pending = []
+    return i, self.pending.append
+
+  def log(self, x):
+    """Add a record."""
+    i, write = self.add()
+    write((self.path, i, x))
+
+  def flush(self):
+    """Write the records of the last item, which is retained."""
+    if self.pending is not None:
+      for record in self.pending:
+        self.write(record)
+    self.pending = None
+
+
+class LogReader(object):
+  """Reads logs written by StreamingLogger one array at a time.
+
+  Arrays are keyed by the same paths as the entries of the npz files written
+  by Logger.dump, e.g. "0_root/0_gibbs_sampler/0_sequence/3_pianorolls".
+  """
+
+  def __init__(self, path):
+    """Initialize a LogReader instance.
+
+    Args:
+      path: the directory of a log written by StreamingLogger.
+    """
+    self.path = path
+    with open(os.path.join(path, _INDEX_FILENAME)) as index_file:
+      self.entries = [json.loads(line) for line in index_file]
+    self._entries_by_key = dict((entry["key"], entry)
+                                for entry in self.entries)
+    # The records of each section, in the order written.
+    self._entries_by_step = collections.OrderedDict()
+    self._steps_by_section = collections.OrderedDict()
+    for entry in self.entries:
+      section, step = entry["section"], entry["step"]
+      if (section, step) not in self._entries_by_step:
+        self._entries_by_step[section, step] = []
+        self._steps_by_section.setdefault(section, []).append(step)
+      self._entries_by_step[section, step].append(entry)
+    data_path = os.path.join(path, _DATA_FILENAME)
+    self._data = None
+    if os.path.getsize(data_path):
+      with open(data_path, "rb") as data_file:
+        self._data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def close(self):
+    """Release the data file."""
+    if self._data is not None:
+      self._data.close()
+      self._data = None
+
+  def keys(self):
+    """Return the keys of all arrays in the log, in the order written."""
+    return [entry["key"] for entry in self.entries]
+
+  def sections(self):
+    """Return the paths of all sections that contain records."""
+    return list(self._steps_by_section)
+
+  def __getitem__(self, key):
+    return self._read(self._entries_by_key[key])
+
+  def read_step(self, section, step):
+    """Read the record logged at the given step of a section.
+
+    Args:
+      section: the path of the section.
+      step: the step at which the record was logged.
+
+    Returns:
+      A dictionary of the arrays in the record, keyed by name.
+    """
+    return dict((entry["name"], self._read(entry))
+                for entry in self._entries_by_step.get((section, step), []))
+
+  def iter_steps(self, section):
+    """Iterate over the records of a section, reading one at a time.
+
+    Args:
+      section: the path of the section.
+
+    Yields:
+      Tuples of the step and a dictionary of the arrays in the record.
+    """
+    for step in self._steps_by_section.get(section, []):
+      yield step, self.read_step(section, step)
+
+  def read_section(self, section):
+    """Read all arrays logged in a section and its subsections.
+
+    Args:
+      section: the path of the section.
+
+    Returns:
+      A dictionary of arrays keyed by path, like the npz written by Logger.
+    """
+    prefix = section.rstrip("/") + "/"
+    return dict((entry["key"], self._read(entry))
+                for entry in self.entries
+                if entry["key"].startswith(prefix))
+
+  def _read(self, entry):
+    dtype = np.dtype(str(entry["dtype"]))
+    shape = tuple(entry["shape"])
+    if entry["encoding"] == "bits":
+      size = int(np.prod(shape))
+      bits = np.unpackbits(self._frombuffer(entry, np.uint8))[:size]
+      return bits.astype(dtype).reshape(shape)
+    elif entry["encoding"] == "quantized":
+      levels = 2**entry["bits"] - 1
+      values = self._frombuffer(entry, _QUANTIZED_DTYPES[entry["bits"]])
+      return (values / levels).astype(dtype).reshape(shape)
+    else:
+      return self._frombuffer(entry, dtype).reshape(shape).copy()
+
+  def _frombuffer(self, entry, dtype):
+    """Return a view of the bytes of an entry in the data file."""
+    dtype = np.dtype(dtype)
+    count = entry["nbytes"] // dtype.itemsize
+    if not count:
+      return np.zeros(0, dtype=dtype)
+    return np.frombuffer(self._data, dtype=dtype, count=count,
+                         offset=entry["offset"])
+
+
+_DATA_FILENAME = "data.bin"
+_INDEX_FILENAME = "index.jsonl"
+_QUANTIZED_DTYPES = {8: np.uint8, 16: np.uint16}
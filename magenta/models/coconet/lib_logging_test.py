@@ -0,0 +1,76 @@
+"""Tests for lib_logging."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.models.coconet import lib_logging
+
+
+def _log_sampling(logger, rng):
+  """Log like a sampler that runs a subsampled sequence of steps."""
+  logger.log(pianorolls=rng.random_sample([2, 4, 3, 2]) < 0.5)
+  with logger.section('sampler'):
+    with logger.section('sequence', subsample_factor=10):
+      for step in range(33):
+        if step % 3 == 0:
+          with logger.section('context'):
+            logger.log(step=np.int64(step))
+            with logger.section('nested', subsample_factor=2):
+              for _ in range(3):
+                logger.log(values=rng.randn(3))
+        logger.log(
+            pianorolls=rng.random_sample([2, 4, 3, 2]) < 0.5,
+            predictions=rng.random_sample([2, 4, 3, 2]),
+            step=np.int64(step))
+    logger.log(result=rng.randn(2, 3))
+
+
+class StreamingLoggerTest(tf.test.TestCase):
+
+  def setUp(self):
+    temp_dir = self.get_temp_dir()
+    self.npz_path = os.path.join(temp_dir, 'steps.npz')
+    self.stream_path = os.path.join(temp_dir, 'steps')
+
+    logger = lib_logging.Logger()
+    _log_sampling(logger, np.random.RandomState(0))
+    logger.dump(self.npz_path)
+
+    streaming_logger = lib_logging.StreamingLogger(
+        self.stream_path, quantization_bits=16)
+    _log_sampling(streaming_logger, np.random.RandomState(0))
+    streaming_logger.close()
+
+  def testRetainsSameRecordsAsLogger(self):
+    reader = lib_logging.LogReader(self.stream_path)
+    with np.load(self.npz_path) as expected:
+      self.assertEqual(sorted(expected.keys()), sorted(reader.keys()))
+      for key in expected.keys():
+        atol = 2.**-16 if key.endswith('predictions') else 0
+        self.assertAllClose(expected[key], reader[key], atol=atol)
+    reader.close()
+
+  def testReadSteps(self):
+    reader = lib_logging.LogReader(self.stream_path)
+    section = '0_root/1_sampler/0_sequence'
+    self.assertIn(section, reader.sections())
+    steps = [step for step, _ in reader.iter_steps(section)]
+    # Every tenth item and the last item of the sequence are retained. Items
+    # 0, 20 and 40 are context sections.
+    self.assertEqual([10, 30, 43], steps)
+    record = reader.read_step(section, 43)
+    self.assertEqual(set(['pianorolls', 'predictions', 'step']), set(record))
+    self.assertEqual(32, record['step'])
+    self.assertEqual({}, reader.read_step(section, 11))
+    reader.close()
+
+
+if __name__ == '__main__':
+  tf.test.main()
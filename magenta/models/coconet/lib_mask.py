@@ -42,9 +42,29 @@ def get_mask(maskout_method, *args, **kwargs):
   return mm(*args, **kwargs)
 
 
+def get_batch_masks(maskout_method, *args, **kwargs):
+  mm = MaskoutMethod.make(maskout_method)
+  return mm.sample_batch(*args, **kwargs)
+
+
 class MaskoutMethod(lib_util.Factory):
   """Base class for mask distributions used during training."""
-  pass
+
+  def sample_batch(self, shape, lengths, separate_instruments=True, rng=None,
+                   **kwargs):
+    """Sample a batch of masks for padded pianorolls at once.
+
+    Args:
+      shape: shape of the padded batch (batch, time, pitch, instrument)
+      lengths: length of each example before padding
+      separate_instruments: whether instruments are separated
+      rng: optional seed or numpy RandomState
+      **kwargs: passed on to the masking distribution
+
+    Returns:
+      A float32 mask of shape `shape`, zero in the padding.
+    """
+    raise NotImplementedError()
 
 
 class BernoulliMaskoutMethod(MaskoutMethod):
@@ -56,6 +76,7 @@ class BernoulliMaskoutMethod(MaskoutMethod):
                pianoroll_shape,
                separate_instruments=True,
                blankout_ratio=0.5,
+               rng=None,
                **unused_kwargs):
     """Sample a mask.
 
@@ -63,6 +84,7 @@ class BernoulliMaskoutMethod(MaskoutMethod):
       pianoroll_shape: shape of pianoroll (time, pitch, instrument)
       separate_instruments: whether instruments are separated
       blankout_ratio: bernoulli inclusion probability
+      rng: optional seed or numpy RandomState
 
     Returns:
       A mask of shape `shape`.
@@ -73,32 +95,53 @@ class BernoulliMaskoutMethod(MaskoutMethod):
     if len(pianoroll_shape) != 3:
       raise ValueError(
           "Shape needs to of 3 dimensional, time, pitch, and instrument.")
+    rng = lib_util.get_rng(rng)
     tt, pp, ii = pianoroll_shape
     if separate_instruments:
-      mask = np.random.random([tt, 1, ii]) < blankout_ratio
+      mask = rng.random_sample([tt, 1, ii]) < blankout_ratio
       mask = mask.astype(np.float32)
       mask = np.tile(mask, [1, pianoroll_shape[1], 1])
     else:
-      mask = np.random.random([tt, pp, ii]) < blankout_ratio
+      mask = rng.random_sample([tt, pp, ii]) < blankout_ratio
       mask = mask.astype(np.float32)
     return mask
 
+  def sample_batch(self,
+                   shape,
+                   lengths,
+                   separate_instruments=True,
+                   rng=None,
+                   blankout_ratio=0.5,
+                   **unused_kwargs):
+    rng = lib_util.get_rng(rng)
+    bb, tt, pp, ii = shape
+    if separate_instruments:
+      mask = rng.random_sample([bb, tt, 1, ii]) < blankout_ratio
+      mask = np.tile(mask, [1, 1, pp, 1])
+    else:
+      mask = rng.random_sample([bb, tt, pp, ii]) < blankout_ratio
+    mask &= np.arange(tt)[None, :, None, None] < lengths[:, None, None, None]
+    return mask.astype(np.float32)
+
 
 class OrderlessMaskoutMethod(MaskoutMethod):
   """Masking distribution for orderless nade training."""
 
   key = "orderless"
 
-  def __call__(self, shape, separate_instruments=True, **unused_kwargs):
+  def __call__(self, shape, separate_instruments=True, rng=None,
+               **unused_kwargs):
     """Sample a mask.
 
     Args:
       shape: shape of pianoroll (time, pitch, instrument)
       separate_instruments: whether instruments are separated
+      rng: optional seed or numpy RandomState
 
     Returns:
       A mask of shape `shape`.
     """
+    rng = lib_util.get_rng(rng)
     tt, pp, ii = shape
 
     if separate_instruments:
@@ -107,9 +150,9 @@ class OrderlessMaskoutMethod(MaskoutMethod):
       assert ii == 1
       d = tt * pp
     # sample a mask size
-    k = np.random.choice(d) + 1
+    k = rng.choice(d) + 1
     # sample a mask of size k
-    i = np.random.choice(d, size=k, replace=False)
+    i = rng.choice(d, size=k, replace=False)
 
     mask = np.zeros(d, dtype=np.float32)
     mask[i] = 1.
@@ -119,3 +162,29 @@ class OrderlessMaskoutMethod(MaskoutMethod):
     else:
       mask = mask.reshape((tt, pp, 1))
     return mask
+
+  def sample_batch(self, shape, lengths, separate_instruments=True, rng=None,
+                   **unused_kwargs):
+    rng = lib_util.get_rng(rng)
+    bb, tt, pp, ii = shape
+    lengths = np.asarray(lengths)
+    if separate_instruments:
+      dd = ii
+    else:
+      assert ii == 1
+      dd = pp
+    # sample a mask size for each example
+    d = lengths * dd
+    k = (rng.random_sample(bb) * d).astype(np.int64) + 1
+    # sample a mask of size k for each example by ranking random keys; keys
+    # of variables in the padding are ranked last.
+    keys = rng.random_sample([bb, tt * dd])
+    keys[np.arange(tt * dd)[None, :] >= d[:, None]] = 2.
+    ranks = np.argsort(np.argsort(keys, axis=1), axis=1)
+    mask = (ranks < k[:, None]).astype(np.float32)
+    if separate_instruments:
+      mask = mask.reshape((bb, tt, 1, ii))
+      mask = np.tile(mask, [1, 1, pp, 1])
+    else:
+      mask = mask.reshape((bb, tt, pp, 1))
+    return mask
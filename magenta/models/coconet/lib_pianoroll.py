@@ -61,6 +61,15 @@ class PianorollEncoderDecoder(object):
         raise ValueError('Last dim of sequence should equal num_instruments.')
       if isinstance(sequence, np.ndarray) and not self.separate_instruments:
         raise ValueError('Only use numpy array if instruments are separated.')
+      if self.separate_instruments:
+        try:
+          array = np.asarray(sequence, dtype=np.float64)
+        except ValueError:
+          # Ragged list of lists.
+          array = None
+        if (array is not None and array.ndim == 2 and
+            array.shape[1] >= self.num_instruments):
+          return self.encode_array(array)
       sequence = list(sequence)
       return self.encode_list_of_lists(sequence)
     else:
@@ -69,12 +78,7 @@ class PianorollEncoderDecoder(object):
   def encode_list_of_lists(self, sequence):
     """Encode 2d array or list of lists of midi note numbers into pianoroll."""
     # step_size larger than 1 means some notes will be skipped over.
-    step_size = self.quantization_level / self.shortest_duration
-    if not step_size.is_integer():
-      raise ValueError(
-          'quantization %r should be multiple of shortest_duration %r.' %
-          (self.quantization_level, self.shortest_duration))
-    step_size = int(step_size)
+    step_size = self._get_step_size()
 
     if not (len(sequence) / step_size).is_integer():
       raise ValueError('step_size %r should fully divide length of seq %r.' %
@@ -115,8 +119,127 @@ class PianorollEncoderDecoder(object):
           roll[t, p, 0] = 0
     return roll
 
+  def _get_step_size(self):
+    step_size = self.quantization_level / self.shortest_duration
+    if not step_size.is_integer():
+      raise ValueError(
+          'quantization %r should be multiple of shortest_duration %r.' %
+          (self.quantization_level, self.shortest_duration))
+    return int(step_size)
+
+  def encode_array(self, sequence):
+    """Encode 2d array of midi note numbers into pianoroll.
+
+    Equivalent to `encode_list_of_lists` for separated instruments, but fills
+    the pianoroll by scattering all notes at once.
+
+    Args:
+      sequence: array of shape (time, num_instruments) of midi note numbers,
+          with NaN indicating silence.
+
+    Returns:
+      A pianoroll of shape (time, pitch, num_instruments).
+    """
+    return self.encode_batch(np.asarray(sequence)[None])[0]
+
+  def encode_batch(self, sequences):
+    """Encode a batch of equally long sequences into pianorolls in one go.
+
+    Args:
+      sequences: array of shape (batch, time, num_instruments) of midi note
+          numbers, with NaN indicating silence.
+
+    Returns:
+      Pianorolls of shape (batch, time, pitch, num_instruments).
+
+    Raises:
+      ValueError: if instruments are not separated, if the sequences are not
+          on the quantization grid or if pitches are not integer.
+      PitchOutOfEncodeRangeError: if a pitch is out of the encoding range.
+    """
+    if not self.separate_instruments:
+      raise ValueError('Only use numpy array if instruments are separated.')
+    sequences = np.asarray(sequences, dtype=np.float64)
+    step_size = self._get_step_size()
+    bb, raw_tt = sequences.shape[:2]
+    if not (raw_tt / step_size).is_integer():
+      raise ValueError('step_size %r should fully divide length of seq %r.' %
+                       (step_size, raw_tt))
+    tt = int(raw_tt / step_size)
+    pp = self.max_pitch - self.min_pitch + 1
+    # Only takes time steps that are on the quantization grid.
+    pitches = sequences[:, ::step_size, :self.num_instruments]
+
+    # Silences are sometimes encoded as NaN when instruments are separated.
+    sounding = ~np.isnan(pitches)
+    with np.errstate(invalid='ignore'):
+      out_of_range = sounding & ((pitches > self.max_pitch) |
+                                 (pitches < self.min_pitch))
+      non_integer = sounding & (pitches != np.floor(pitches))
+    invalid = out_of_range | non_integer
+    if invalid.any():
+      # Report the first offending note, as encode_list_of_lists would.
+      b = np.flatnonzero(invalid.any(axis=(1, 2)))[0]
+      t, i = np.argwhere(invalid[b])[0]
+      if out_of_range[b, t, i]:
+        raise PitchOutOfEncodeRangeError(
+            '%r is out of specified range [%r, %r].' %
+            (float(pitches[b, t, i]), self.min_pitch, self.max_pitch))
+      raise ValueError('Non integer pitches not yet supported.')
+
+    rolls = np.zeros((bb, tt, pp, self.num_instruments))
+    b, t, i = np.nonzero(sounding)
+    p = pitches[b, t, i].astype(np.int64) - self.min_pitch
+    rolls[b, t, p, i] = 1
+    return rolls
+
   def decode_to_midi(self, pianoroll):
     """Decodes pianoroll into midi."""
+    return self.decode_batch_to_midi(np.asarray(pianoroll)[None])[0]
+
+  def decode_batch_to_midi(self, pianorolls):
+    """Decodes a batch of pianorolls into midi in one go.
+
+    Held notes are found by run-length encoding the whole batch at once, which
+    gives the same notes in the same order as `decode_to_midi_loop`.
+
+    Args:
+      pianorolls: array of shape (batch, time, pitch, instrument).
+
+    Returns:
+      A list of PrettyMIDI instances, one for each pianoroll.
+    """
+    # NOTE: Assumes four separate instruments ordered from high to low.
+    duration = self.qpm / 60 * self.shortest_duration
+    bb, unused_tt, unused_pp, ii = pianorolls.shape
+    # Lay out as (batch, instrument, pitch, time) so that the runs come out in
+    # the order in which decode_to_midi_loop creates the notes.
+    onsets = np.transpose(pianorolls != 0, [0, 3, 2, 1]).astype(np.int8)
+    onsets = np.diff(
+        np.pad(onsets, [(0, 0), (0, 0), (0, 0), (1, 1)], 'constant'), axis=3)
+    starts = np.argwhere(onsets == 1)
+    ends = np.argwhere(onsets == -1)[:, 3]
+
+    midi_datas = []
+    notes_by_instrument = {}
+    for (b, i, p, start), end in zip(starts.tolist(), ends.tolist()):
+      notes_by_instrument.setdefault((b, i), []).append(
+          pretty_midi.Note(
+              velocity=100,
+              pitch=self.min_pitch + p,
+              start=start * duration,
+              end=end * duration))
+    for b in range(bb):
+      midi_data = pretty_midi.PrettyMIDI()
+      for i in range(ii):
+        instrument = pretty_midi.Instrument(program=self.programs[i] - 1)
+        instrument.notes.extend(notes_by_instrument.get((b, i), []))
+        midi_data.instruments.append(instrument)
+      midi_datas.append(midi_data)
+    return midi_datas
+
+  def decode_to_midi_loop(self, pianoroll):
+    """Decodes pianoroll into midi one cell at a time."""
     # NOTE: Assumes four separate instruments ordered from high to low.
     midi_data = pretty_midi.PrettyMIDI()
     duration = self.qpm / 60 * self.shortest_duration
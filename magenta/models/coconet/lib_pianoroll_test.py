@@ -0,0 +1,59 @@
+"""Tests for lib_pianoroll."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.models.coconet import lib_pianoroll
+
+
+class PianorollEncoderDecoderTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.encoder_decoder = lib_pianoroll.PianorollEncoderDecoder(
+        min_pitch=36, max_pitch=81, num_instruments=4,
+        quantization_level=0.125)
+    rng = np.random.RandomState(0)
+    # Pitches held for a random number of steps, with some silences.
+    self.sequences = np.repeat(
+        rng.randint(36, 82, size=[3, 12, 4]).astype(np.float64),
+        rng.randint(1, 3, size=12), axis=1)
+    self.sequences[rng.random_sample(self.sequences.shape) < 0.2] = np.nan
+
+  def testEncodeBatchMatchesListOfLists(self):
+    pianorolls = self.encoder_decoder.encode_batch(self.sequences)
+    self.assertEqual(
+        (3, self.sequences.shape[1], 46, 4), pianorolls.shape)
+    for sequence, pianoroll in zip(self.sequences, pianorolls):
+      self.assertAllEqual(
+          self.encoder_decoder.encode_list_of_lists(sequence.tolist()),
+          pianoroll)
+      self.assertAllEqual(self.encoder_decoder.encode(sequence), pianoroll)
+
+  def testEncodeBatchRaisesOnPitchOutOfRange(self):
+    self.sequences[1, 3, 2] = 90
+    with self.assertRaises(lib_pianoroll.PitchOutOfEncodeRangeError):
+      self.encoder_decoder.encode_batch(self.sequences)
+
+  def testDecodeBatchToMidiMatchesLoop(self):
+    pianorolls = self.encoder_decoder.encode_batch(self.sequences)
+    midi_datas = self.encoder_decoder.decode_batch_to_midi(pianorolls)
+    self.assertEqual(len(pianorolls), len(midi_datas))
+    for pianoroll, midi_data in zip(pianorolls, midi_datas):
+      expected = self.encoder_decoder.decode_to_midi_loop(pianoroll)
+      self.assertEqual(len(expected.instruments), len(midi_data.instruments))
+      for expected_instrument, instrument in zip(expected.instruments,
+                                                 midi_data.instruments):
+        self.assertEqual(expected_instrument.program, instrument.program)
+        self.assertEqual(
+            [(note.pitch, note.start, note.end)
+             for note in expected_instrument.notes],
+            [(note.pitch, note.start, note.end) for note in instrument.notes])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -3,6 +3,8 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import collections
+import threading
 # internal imports
 import numpy as np
 from magenta.models.coconet import lib_data
@@ -24,13 +26,16 @@ class BaseSampler(lib_util.Factory):
   masked-out portion of the pianorolls.
   """
 
-  def __init__(self, wmodel, temperature=1, logger=None, **unused_kwargs):
+  def __init__(self, wmodel, temperature=1, logger=None, incremental=False,
+               **unused_kwargs):
     """Initialize a BaseSampler instance.
 
     Args:
       wmodel: a WrappedModel instance
       temperature: sampling temperature
       logger: Logger instance
+      incremental: if True, reuse model outputs from the previous step and only
+          recompute those within reach of the time steps that changed.
     """
     self.wmodel = wmodel
     self.temperature = temperature
@@ -44,6 +49,9 @@ class BaseSampler(lib_util.Factory):
       return predictions
 
     self.predictor = lib_tfutil.RobustPredictor(predictor)
+    if incremental:
+      self.predictor = lib_tfutil.IncrementalPredictor(
+          self.predictor, self.wmodel.model.temporal_receptive_field)
 
   @property
   def separate_instruments(self):
@@ -168,7 +176,7 @@ class AncestralSampler(BaseSampler):
     assert self.separate_instruments or ii == 1
 
     # determine how many model evaluations we need to make
-    mask_size = np.max(_numbers_of_masked_variables(masks))
+    mask_size = int(np.max(_numbers_of_masked_variables(masks)))
 
     with self.logger.section("sequence", subsample_factor=10):
       for _ in range(mask_size):
@@ -187,6 +195,152 @@ class AncestralSampler(BaseSampler):
     return pianorolls
 
 
+class SpeculativeAncestralSampler(BaseSampler):
+  """Samples blocks of variables per model evaluation like NADE.
+
+  Each round proposes `block_size` variables, in the order given by the
+  selector, by sampling them independently from the current predictions.
+  The model is then evaluated once on a batch that contains, for every prefix
+  of the block, the pianorolls with that prefix of proposals revealed. This
+  gives the exact ancestral conditional of each proposal, against which the
+  proposals are checked in order: a proposal is accepted with probability
+  min(1, p/q), where q is the proposal probability and p the conditional
+  probability. At the first rejection the variable is resampled from the
+  normalized residual max(0, p - q) and the rest of the block is discarded.
+  As in speculative decoding, the result is distributed exactly as under
+  AncestralSampler, but needs far fewer model evaluations when proposals
+  agree with the conditionals.
+  """
+  key = "speculative_ancestral"
+
+  def __init__(self, **kwargs):
+    """Initialize a SpeculativeAncestralSampler instance.
+
+    Args:
+      **kwargs: selector: an instance of BaseSelector; determines the causal
+          order in which variables are to be sampled. block_size: the maximum
+          number of variables to propose per model evaluation.
+    """
+    self.selector = kwargs.pop("selector")
+    self.block_size = kwargs.pop("block_size", 8)
+    super(SpeculativeAncestralSampler, self).__init__(**kwargs)
+
+  def _run(self, pianorolls, masks):
+    ii = pianorolls.shape[-1]
+    assert self.separate_instruments or ii == 1
+    pianorolls = np.array(pianorolls, dtype=np.float32)
+    masks = np.array(masks, dtype=np.float32)
+
+    predictions = self.predictor(pianorolls, masks)
+    with self.logger.section("sequence", subsample_factor=10):
+      while np.max(_numbers_of_masked_variables(
+          masks, separate_instruments=self.separate_instruments)) > 0:
+        # Propose a block of variables from the current predictions.
+        samples = self.sample_predictions(predictions.copy())
+        selections = []
+        block_masks = masks
+        for _ in range(self.block_size):
+          selection = self.selector(
+              predictions,
+              block_masks,
+              separate_instruments=self.separate_instruments)
+          if not selection.any():
+            break
+          selections.append(selection)
+          block_masks = np.where(selection, 0., block_masks)
+        proposals = np.where(masks - block_masks, samples, pianorolls)
+
+        # Compute the conditional of every proposal in a single evaluation.
+        # Row j reveals the first j proposals; the last row predicts the
+        # variables that follow a fully accepted block.
+        prefix_masks = [masks]
+        for selection in selections:
+          prefix_masks.append(np.where(selection, 0., prefix_masks[-1]))
+        num_rows = len(prefix_masks)
+        conditionals = self.predictor(
+            np.concatenate([proposals] * num_rows),
+            np.concatenate(prefix_masks)).reshape(
+                (num_rows,) + pianorolls.shape)
+
+        for b in range(len(pianorolls)):
+          num_accepted = 0
+          for j, selection in enumerate(selections):
+            if not selection[b].any():
+              break
+            index = self._variable_index(selection[b])
+            accepted, value = self._verify(
+                predictions[b], conditionals[j, b], proposals[b], index)
+            self._assign(pianorolls[b], index, value)
+            masks[b] = np.where(selection[b], 0., masks[b])
+            if not accepted:
+              break
+            num_accepted += 1
+          # The conditionals given the accepted prefix are the best available
+          # proposal distribution for the next round.
+          predictions[b] = conditionals[num_accepted, b]
+        self.logger.log(
+            pianorolls=pianorolls, masks=masks, predictions=predictions)
+
+    self.logger.log(pianorolls=pianorolls, masks=masks)
+    assert masks.sum() == 0
+    return pianorolls
+
+  def _variable_index(self, selection):
+    if self.separate_instruments:
+      t, i = np.argwhere(selection.max(axis=1))[0]
+      return t, i
+    t, p = np.argwhere(selection[:, :, 0])[0]
+    return t, p
+
+  def _distribution(self, predictions, index):
+    """Tempered distribution of a variable, as used by sample_predictions."""
+    t, d = index
+    if self.separate_instruments:
+      p = predictions[t, :, d].astype(np.float64)
+    else:
+      on = 0.5 * float(predictions[t, d, 0])
+      p = np.array([on, 1. - on])
+    return lib_util.softmax(p, temperature=self.temperature)
+
+  def _get_value(self, pianoroll, index):
+    t, d = index
+    if self.separate_instruments:
+      return np.argmax(pianoroll[t, :, d])
+    # Category 0 is "on", category 1 is "off".
+    return 0 if pianoroll[t, d, 0] else 1
+
+  def _assign(self, pianoroll, index, value):
+    t, d = index
+    if self.separate_instruments:
+      pianoroll[t, :, d] = 0.
+      pianoroll[t, value, d] = 1.
+    else:
+      pianoroll[t, d, 0] = float(value == 0)
+
+  def _verify(self, predictions, conditionals, proposal, index):
+    """Accepts or corrects a proposal.
+
+    Args:
+      predictions: model outputs the proposal was sampled from.
+      conditionals: model outputs given all previously sampled variables.
+      proposal: the pianoroll holding the proposed value.
+      index: the (time, instrument) or (time, pitch) index of the variable.
+
+    Returns:
+      A tuple `(accepted, value)` where `value` is the category index to
+      assign to the variable.
+    """
+    q = self._distribution(predictions, index)
+    p = self._distribution(conditionals, index)
+    value = self._get_value(proposal, index)
+    if q[value] > 0 and np.random.random() * q[value] < p[value]:
+      return True, value
+    residual = np.maximum(p - q, 0.)
+    if residual.sum() <= 0:
+      residual = p
+    return False, np.random.choice(len(residual), p=residual / residual.sum())
+
+
 class GibbsSampler(BaseSampler):
   """Repeatedly resamples subsets of variables using an inner sampler."""
   key = "gibbs"
@@ -200,6 +354,10 @@ class GibbsSampler(BaseSampler):
     schedule: an instance of BaseSchedule; determines the subset size.
     num_steps: number of gibbs steps to perform. If not given, defaults to
         the number of masked-out variables.
+    mask_seed: seed or rng with which to plan the inner masks. If not given,
+        the global numpy random state is used.
+    check_samples: whether to check after each step that the inner sampler
+        sampled every masked-out variable. Defaults to True.
 
     Args:
       **kwargs: Possible keyword arguments listed above.
@@ -209,6 +367,8 @@ class GibbsSampler(BaseSampler):
     self.sampler = kwargs.pop("sampler")
     self.schedule = kwargs.pop("schedule")
     self.num_steps = kwargs.pop("num_steps", None)
+    self.mask_seed = kwargs.pop("mask_seed", None)
+    self.check_samples = kwargs.pop("check_samples", True)
     super(GibbsSampler, self).__init__(**kwargs)
 
   def _run(self, pianorolls, masks):
@@ -218,18 +378,21 @@ class GibbsSampler(BaseSampler):
         if self.num_steps is None else self.num_steps)
     print("num_steps", num_steps)
 
+    mask_plan = GibbsMaskPlan(
+        self.masker,
+        self.schedule,
+        pianorolls.shape,
+        num_steps,
+        outer_masks=masks,
+        separate_instruments=self.separate_instruments,
+        rng=self.mask_seed)
     with self.logger.section("sequence", subsample_factor=10):
-      for s in range(int(num_steps)):
+      for s in range(len(mask_plan)):
         # with lib_util.timing("gibbs step %d" % s):
         print(".", end="")
-        pm = self.schedule(s, num_steps)
-        inner_masks = self.masker(
-            pianorolls.shape,
-            pm=pm,
-            outer_masks=masks,
-            separate_instruments=self.separate_instruments)
+        inner_masks = mask_plan[s]
         pianorolls = self.sampler.run_nonverbose(pianorolls, inner_masks)
-        if self.separate_instruments:
+        if self.check_samples and self.separate_instruments:
           # Ensure sampler did actually sample everything under inner_masks.
           assert np.all(
               np.where(
@@ -246,6 +409,269 @@ class GibbsSampler(BaseSampler):
     return "samplers.gibbs(masker=%r, sampler=%r)" % (self.masker, self.sampler)
 
 
+class SamplingRequest(object):
+  """A single piece queued for sampling by a BatchedGibbsSampler."""
+
+  def __init__(self, pianoroll, mask, num_steps, temperature):
+    """Initialize a SamplingRequest instance.
+
+    Args:
+      pianoroll: pianoroll to populate, shaped (tt, pp, ii)
+      mask: binary indicator of area to populate, same shape as `pianoroll`
+      num_steps: number of gibbs steps to perform on this piece
+      temperature: sampling temperature for this piece
+    """
+    self.pianoroll = pianoroll
+    self.mask = mask
+    self.num_steps = int(num_steps)
+    self.temperature = temperature
+    self.step = 0
+    self.error = None
+    self._done = threading.Event()
+
+  @property
+  def length(self):
+    return self.pianoroll.shape[0]
+
+  @property
+  def done(self):
+    return self._done.is_set()
+
+  def finish(self):
+    self._done.set()
+
+  def fail(self, error):
+    """Finish the request unsuccessfully; `wait` will raise `error`."""
+    self.error = error
+    self._done.set()
+
+  def wait(self, timeout=None):
+    """Block until the request has been served.
+
+    Args:
+      timeout: optional number of seconds to wait.
+
+    Returns:
+      The populated pianoroll, or None if the timeout expired first.
+
+    Raises:
+      Exception: the error that prevented the request from being served, if
+          any.
+    """
+    if not self._done.wait(timeout):
+      return None
+    if self.error is not None:
+      raise self.error
+    return self.pianoroll
+
+
+class BatchedGibbsSampler(BaseSampler):
+  """Gibbs sampler that serves many pieces in one packed batch.
+
+  Pieces are queued through `submit` and each Gibbs step packs all active
+  pieces into a single padded batch, so that the cost of a model evaluation is
+  shared between them. Pieces of different lengths, masks, temperatures and
+  numbers of steps can be mixed freely; a piece leaves the batch as soon as it
+  has taken all of its steps and a queued piece takes its place.
+
+  The sampler can be driven synchronously through `__call__` (like the other
+  samplers) or `run_until_idle`, or by a background thread through `start` and
+  `stop`, in which case requests are served while they come in. Steps are
+  taken one at a time, whichever thread takes them. If a step fails, all
+  active and queued requests fail with the same error, which their `wait`
+  methods raise.
+  """
+  key = "batched_gibbs"
+
+  def __init__(self, **kwargs):
+    """Initialize a BatchedGibbsSampler instance.
+
+    Possible keyword arguments.
+    masker: an instance of BaseMasker; controls how subsets are chosen.
+        Defaults to BernoulliMasker.
+    schedule: an instance of BaseSchedule; determines the subset size.
+        Defaults to YaoSchedule.
+    max_batch_size: maximum number of pieces to pack into one batch.
+
+    Args:
+      **kwargs: Possible keyword arguments listed above.
+    """
+    self.masker = kwargs.pop("masker", None) or BernoulliMasker()
+    self.schedule = kwargs.pop("schedule", None) or YaoSchedule()
+    self.max_batch_size = kwargs.pop("max_batch_size", 16)
+    super(BatchedGibbsSampler, self).__init__(**kwargs)
+    self.pending = collections.deque()
+    self.active = []
+    self._condition = threading.Condition()
+    self._step_lock = threading.Lock()
+    self._thread = None
+    self._stopping = False
+
+  def submit(self, pianoroll, mask=None, temperature=None, num_steps=None):
+    """Queue a piece for sampling.
+
+    Args:
+      pianoroll: pianoroll to populate, shaped (tt, pp, ii)
+      mask: binary indicator of area to populate. If not given, the silences
+          in `pianoroll` are populated.
+      temperature: sampling temperature. Defaults to the sampler's temperature.
+      num_steps: number of gibbs steps to perform. If not given, defaults to
+          the number of masked-out variables.
+
+    Returns:
+      A SamplingRequest whose `wait` method returns the populated pianoroll.
+    """
+    pianoroll = np.asarray(pianoroll, dtype=np.float32)
+    if mask is None:
+      mask = CompletionMasker()(pianoroll[None])[0]
+    mask = np.asarray(mask, dtype=np.float32)
+    if pianoroll.shape != mask.shape:
+      raise ValueError("Shape mismatch in pianoroll %r and mask %r." %
+                       (pianoroll.shape, mask.shape))
+    if num_steps is None:
+      num_steps = _numbers_of_masked_variables(mask[None])[0]
+    request = SamplingRequest(
+        pianoroll, mask, num_steps,
+        self.temperature if temperature is None else temperature)
+    with self._condition:
+      self.pending.append(request)
+      self._condition.notify()
+    return request
+
+  def step(self):
+    """Take one gibbs step on every active piece.
+
+    Returns:
+      The number of pieces that were in the batch.
+
+    Raises:
+      Exception: any error raised while taking the step. The active and
+          queued requests are failed with it.
+    """
+    with self._step_lock:
+      try:
+        return self._step()
+      except Exception as e:  # pylint: disable=broad-except
+        self._fail(e)
+        raise
+
+  def _step(self):
+    self._admit()
+    if not self.active:
+      return 0
+
+    pianorolls, outer_masks, inner_masks = [], [], []
+    for request in self.active:
+      pm = self.schedule(request.step, request.num_steps)
+      inner_mask = self.masker(
+          (1,) + request.pianoroll.shape,
+          pm=pm,
+          outer_masks=request.mask[None],
+          separate_instruments=self.separate_instruments)[0]
+      pianorolls.append(request.pianoroll)
+      outer_masks.append(request.mask)
+      inner_masks.append(inner_mask.astype(np.float32))
+    # Padding is filled with zeros as during training, i.e. it is presented to
+    # the model as silent context.
+    (pianorolls, inner_masks), lengths = lib_util.pad_and_stack(
+        pianorolls, inner_masks)
+
+    predictions = self.predictor(pianorolls, inner_masks)
+
+    for i, request in enumerate(self.active):
+      tt = lengths[i]
+      samples = self.sample_predictions(
+          predictions[i:i + 1, :tt], temperature=request.temperature)[0]
+      request.pianoroll = np.where(
+          inner_masks[i, :tt], samples, request.pianoroll).astype(np.float32)
+      request.step += 1
+    self.logger.log(
+        pianorolls=pianorolls, masks=inner_masks, predictions=predictions)
+
+    batch_size = len(self.active)
+    self._retire()
+    return batch_size
+
+  def run_until_idle(self):
+    """Take gibbs steps until no pieces are active or queued."""
+    num_steps = 0
+    while self.step():
+      num_steps += 1
+    return num_steps
+
+  def start(self):
+    """Start serving requests on a background thread."""
+    if self._thread is not None:
+      return
+    self._stopping = False
+    self._thread = threading.Thread(target=self._serve)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """Stop the background thread after the current step."""
+    if self._thread is None:
+      return
+    with self._condition:
+      self._stopping = True
+      self._condition.notify()
+    self._thread.join()
+    self._thread = None
+
+  def _serve(self):
+    while True:
+      with self._condition:
+        while not (self._stopping or self.pending or self.active):
+          self._condition.wait()
+        if self._stopping:
+          return
+      try:
+        self.step()
+      except Exception:  # pylint: disable=broad-except
+        # The error has been passed on to the requests it affected; keep
+        # serving new requests.
+        pass
+
+  def _admit(self):
+    with self._condition:
+      while self.pending and len(self.active) < self.max_batch_size:
+        request = self.pending.popleft()
+        if request.num_steps <= 0:
+          request.finish()
+        else:
+          self.active.append(request)
+
+  def _retire(self):
+    remaining = []
+    for request in self.active:
+      if request.step >= request.num_steps:
+        request.finish()
+      else:
+        remaining.append(request)
+    with self._condition:
+      self.active = remaining
+
+  def _fail(self, error):
+    with self._condition:
+      requests = self.active + list(self.pending)
+      self.active = []
+      self.pending.clear()
+    for request in requests:
+      request.fail(error)
+
+  def _run(self, pianorolls, masks):
+    requests = [
+        self.submit(pianoroll, mask) for pianoroll, mask in zip(pianorolls,
+                                                                masks)
+    ]
+    with self.logger.section("sequence", subsample_factor=10):
+      if self._thread is None:
+        self.run_until_idle()
+      pianorolls = np.array([request.wait() for request in requests])
+    self.logger.log(pianorolls=pianorolls, masks=masks, predictions=pianorolls)
+    return pianorolls
+
+
 class UpsamplingSampler(BaseSampler):
   """Alternates temporal upsampling and populating the gaps."""
   key = "upsampling"
@@ -308,7 +734,8 @@ class BernoulliMasker(BaseMasker):
   """Samples each element iid from a Bernoulli distribution."""
   key = "bernoulli"
 
-  def __call__(self, shape, pm=None, outer_masks=1., separate_instruments=True):
+  def __call__(self, shape, pm=None, outer_masks=1., separate_instruments=True,
+               rng=None):
     """Sample a batch of masks.
 
     Args:
@@ -316,19 +743,110 @@ class BernoulliMasker(BaseMasker):
       pm: Bernoulli success probability
       outer_masks: indicator of area within which to mask out
       separate_instruments: whether instruments are separated
+      rng: optional seed or numpy RandomState
 
     Returns:
       A batch of masks.
     """
     assert pm is not None
+    selections = self.select(shape, [pm], separate_instruments, rng=rng)[0]
+    return np.broadcast_to(selections, shape) * outer_masks
+
+  def select(self, shape, pms, separate_instruments=True, rng=None):
+    """Sample the variables to mask out for several steps at once.
+
+    Args:
+      shape: sequence of length 4 specifying the shape of the masks
+      pms: Bernoulli success probability for each step
+      separate_instruments: whether instruments are separated
+      rng: optional seed or numpy RandomState
+
+    Returns:
+      A boolean array shaped (len(pms), bb, tt, 1, ii) if instruments are
+      separated, else (len(pms), bb, tt, pp, 1). It broadcasts against the
+      masks of each step.
+    """
+    rng = lib_util.get_rng(rng)
     bb, tt, pp, ii = shape
+    pms = np.asarray(pms).reshape([-1, 1, 1, 1, 1])
     if separate_instruments:
-      probs = np.tile(np.random.random([bb, tt, 1, ii]), [1, 1, pp, 1])
+      probs = rng.random_sample([len(pms), bb, tt, 1, ii])
     else:
       assert ii == 1
-      probs = np.random.random([bb, tt, pp, ii]).astype(np.float32)
-    masks = probs < pm
-    return masks * outer_masks
+      probs = rng.random_sample([len(pms), bb, tt, pp, ii]).astype(np.float32)
+    return probs < pms
+
+
+class GibbsMaskPlan(object):
+  """The inner masks for all steps of a Gibbs sampling run.
+
+  The subset size of each step is determined up front. Steps are grouped into
+  chunks, each with a random seed of its own. When a step is requested, the
+  selections of its chunk are sampled in one go and held as compact booleans
+  that omit the pitch (or instrument) axis; the masks of the step are then
+  obtained by broadcasting its selection against `outer_masks`. The masks are
+  thus determined by `rng` and `chunk_size` alone, regardless of the order in
+  which the steps are requested.
+
+  Maskers without a `select` method are invoked once per step instead, with a
+  seed of the step's own.
+  """
+
+  def __init__(self, masker, schedule, shape, num_steps, outer_masks=1.,
+               separate_instruments=True, rng=None, chunk_size=None):
+    """Initialize a GibbsMaskPlan instance.
+
+    Args:
+      masker: an instance of BaseMasker.
+      schedule: an instance of BaseSchedule; determines the subset size.
+      shape: sequence of length 4 specifying the shape of the masks
+      num_steps: number of gibbs steps to plan for.
+      outer_masks: indicator of area within which to mask out
+      separate_instruments: whether instruments are separated
+      rng: seed or rng from which to draw the seeds of the chunks. If not
+          given, the global numpy random state is used.
+      chunk_size: number of steps whose selections are sampled and held in
+          memory at once. Defaults to as many as can be sampled in 16MB.
+    """
+    self.masker = masker
+    self.shape = tuple(shape)
+    self.num_steps = int(num_steps)
+    self.outer_masks = outer_masks
+    self.separate_instruments = separate_instruments
+    self.pms = np.array(
+        [schedule(s, num_steps) for s in range(self.num_steps)])
+    if chunk_size is None:
+      # The selections are sampled from float64 draws.
+      chunk_size = 2**21 // max(1, np.prod(self.shape) // (
+          self.shape[2] if separate_instruments else self.shape[3]))
+    self.chunk_size = max(1, int(chunk_size))
+    self.seeds = lib_util.get_rng(rng).randint(2**31, size=self.num_steps)
+    self._chunk_index = None
+    self._selections = None
+
+  def __len__(self):
+    return self.num_steps
+
+  def __getitem__(self, s):
+    """Return the inner masks for step `s`."""
+    if not hasattr(self.masker, "select"):
+      return self.masker(
+          self.shape,
+          pm=self.pms[s],
+          outer_masks=self.outer_masks,
+          separate_instruments=self.separate_instruments,
+          rng=self.seeds[s])
+    chunk_index, offset = divmod(s, self.chunk_size)
+    if chunk_index != self._chunk_index:
+      start = chunk_index * self.chunk_size
+      self._selections = self.masker.select(
+          self.shape,
+          self.pms[start:start + self.chunk_size],
+          separate_instruments=self.separate_instruments,
+          rng=self.seeds[start])
+      self._chunk_index = chunk_index
+    return np.broadcast_to(self._selections[offset],
+                           self.shape) * self.outer_masks
 
 
 class HarmonizationMasker(BaseMasker):
@@ -0,0 +1,308 @@
+"""Tests for lib_sampling."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.models.coconet import lib_hparams
+from magenta.models.coconet import lib_sampling
+
+
+class FakeModel(object):
+  """Stands in for a model graph, naming its inputs and outputs."""
+  pianorolls = 'pianorolls'
+  masks = 'masks'
+  predictions = 'predictions'
+
+
+def predict_modes(pianorolls, unused_masks):
+  """Predict pitch (t + i) % P with probability 1/2 and the rest uniformly."""
+  bb, tt, pp, ii = pianorolls.shape
+  predictions = np.ones([bb, tt, pp, ii]) * 0.5 / (pp - 1)
+  modes = (np.arange(tt)[:, None] + np.arange(ii)[None, :]) % pp
+  predictions[:, np.arange(tt)[:, None], modes, np.arange(ii)[None, :]] = 0.5
+  return predictions
+
+
+class TwoVariablePredictor(object):
+  """Predicts the conditionals of two time steps with a joint distribution.
+
+  The pianorolls hold one instrument at two time steps, whose pitches are
+  distributed according to `joint`. Each time step is predicted from its
+  conditional given the other if that is revealed, and from its marginal
+  otherwise.
+  """
+
+  def __init__(self, joint):
+    self.joint = joint
+
+  def __call__(self, pianorolls, masks):
+    revealed = masks.max(axis=2) == 0
+    pitches = pianorolls.argmax(axis=2)
+    predictions = np.zeros(pianorolls.shape)
+    for b in range(len(pianorolls)):
+      for t, joint in enumerate([self.joint, self.joint.T]):
+        if revealed[b, 1 - t, 0]:
+          p = joint[:, pitches[b, 1 - t, 0]]
+        else:
+          p = joint.sum(axis=1)
+        predictions[b, t, :, 0] = p / p.sum()
+    return predictions
+
+
+class FakeSession(object):
+  """Computes predictions through `predict`.
+
+  Records the shape of every batch, and raises `error` if it is set.
+  """
+
+  def __init__(self, predict):
+    self.predict = predict
+    self.shapes = []
+    self.error = None
+
+  def run(self, fetches, feed_dict):
+    assert fetches == FakeModel.predictions
+    pianorolls = feed_dict[FakeModel.pianorolls]
+    self.shapes.append(pianorolls.shape)
+    if self.error is not None:
+      raise self.error
+    return self.predict(pianorolls, feed_dict[FakeModel.masks])
+
+
+class FakeWrappedModel(object):
+
+  def __init__(self, num_pitches=5, num_instruments=2, predict=predict_modes):
+    self.hparams = lib_hparams.Hyperparameters(
+        num_pitches=num_pitches, num_instruments=num_instruments)
+    self.model = FakeModel()
+    self.sess = FakeSession(predict)
+
+
+def modes(tt, pp, ii):
+  """Return the most likely pianoroll under FakeSession."""
+  pianoroll = np.zeros([tt, pp, ii], dtype=np.float32)
+  pianoroll[np.arange(tt)[:, None],
+            (np.arange(tt)[:, None] + np.arange(ii)[None, :]) % pp,
+            np.arange(ii)[None, :]] = 1.
+  return pianoroll
+
+
+class SpeculativeAncestralSamplerTest(tf.test.TestCase):
+
+  def sample_pitches(self, sampler_class, joint, seeds, **kwargs):
+    """Return the pitches of the two time steps sampled with each seed."""
+    wmodel = FakeWrappedModel(
+        num_pitches=3, num_instruments=1, predict=TwoVariablePredictor(joint))
+    sampler = sampler_class(
+        wmodel=wmodel, selector=lib_sampling.OrderlessSelector(), **kwargs)
+    pianorolls = np.zeros([1, 2, 3, 1], dtype=np.float32)
+    samples = []
+    for seed in seeds:
+      np.random.seed(seed)
+      samples.append(sampler(pianorolls, np.ones_like(pianorolls)))
+    return np.concatenate(samples).argmax(axis=2)[:, :, 0]
+
+  def testMatchesAncestralSampler(self):
+    joint = np.array([[0.30, 0.05, 0.05],
+                      [0.02, 0.03, 0.15],
+                      [0.10, 0.20, 0.10]])
+    seeds = range(2000)
+    frequencies = []
+    for sampler_class, kwargs in [
+        (lib_sampling.AncestralSampler, {}),
+        (lib_sampling.SpeculativeAncestralSampler, {'block_size': 2})]:
+      pitches = self.sample_pitches(sampler_class, joint, seeds, **kwargs)
+      counts = np.zeros_like(joint)
+      np.add.at(counts, (pitches[:, 0], pitches[:, 1]), 1)
+      frequencies.append(counts / len(seeds))
+    ancestral_frequencies, speculative_frequencies = frequencies
+    self.assertAllClose(joint, ancestral_frequencies, atol=0.03)
+    self.assertAllClose(joint, speculative_frequencies, atol=0.03)
+    self.assertAllClose(ancestral_frequencies, speculative_frequencies,
+                        atol=0.04)
+
+  def testFewerEvaluationsWhenProposalsAgree(self):
+    wmodel = FakeWrappedModel()
+    sampler = lib_sampling.SpeculativeAncestralSampler(
+        wmodel=wmodel, selector=lib_sampling.ChronologicalSelector(),
+        block_size=8)
+    pianorolls = np.zeros([3, 8, 5, 2], dtype=np.float32)
+    masks = np.ones_like(pianorolls)
+    np.random.seed(0)
+    pianorolls = sampler(pianorolls, masks)
+    self.assertAllEqual(np.ones([3, 8, 2]), pianorolls.sum(axis=2))
+
+    # The predictions do not depend on the context, so every proposal is
+    # accepted: one evaluation for the first proposals and one per block of
+    # eight out of the sixteen variables, against sixteen for AncestralSampler.
+    mask_size = 8 * 2
+    self.assertEqual(3, len(wmodel.sess.shapes))
+    self.assertLess(len(wmodel.sess.shapes), mask_size)
+
+
+class GibbsMaskPlanTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.shape = (2, 8, 5, 4)
+    self.outer_masks = np.ones(self.shape, dtype=np.float32)
+    self.outer_masks[:, :3] = 0.
+
+  def get_plan(self, rng, chunk_size=None):
+    return lib_sampling.GibbsMaskPlan(
+        lib_sampling.BernoulliMasker(),
+        lib_sampling.YaoSchedule(),
+        self.shape,
+        num_steps=6,
+        outer_masks=self.outer_masks,
+        rng=rng,
+        chunk_size=chunk_size)
+
+  def testSeededPlanIsDeterministic(self):
+    for chunk_size in [None, 1, 4]:
+      plan = self.get_plan(rng=123, chunk_size=chunk_size)
+      masks = [plan[s] for s in range(len(plan))]
+      self.assertEqual(6, len(masks))
+
+      # The masks do not depend on the order in which steps are requested, on
+      # how often they are requested, nor on the global numpy random state.
+      np.random.seed(0)
+      other_plan = self.get_plan(rng=123, chunk_size=chunk_size)
+      for s in reversed(range(len(other_plan))):
+        self.assertAllEqual(masks[s], other_plan[s])
+      self.assertAllEqual(masks[2], other_plan[2])
+
+    different_plan = self.get_plan(rng=456)
+    self.assertFalse(all(np.array_equal(mask, different_mask)
+                         for mask, different_mask in zip(masks,
+                                                         different_plan)))
+
+  def testMasksWithinOuterMasks(self):
+    plan = self.get_plan(rng=123)
+    for s in range(len(plan)):
+      masks = plan[s]
+      self.assertEqual(self.shape, masks.shape)
+      self.assertAllEqual(np.zeros_like(masks[:, :3]), masks[:, :3])
+      # Instruments are masked out at all pitches at once.
+      self.assertAllEqual(np.broadcast_to(masks[:, :, :1], self.shape), masks)
+
+  def testHoldsCompactSelectionsOfOneChunk(self):
+    plan = self.get_plan(rng=123, chunk_size=4)
+    masks = plan[5]
+    # Only the selections of the second chunk, steps 4 and 5, are held, and
+    # without the pitch axis.
+    self.assertEqual(np.bool_, plan._selections.dtype)
+    self.assertEqual((2, 2, 8, 1, 4), plan._selections.shape)
+    self.assertAllEqual(
+        np.broadcast_to(plan._selections[1], self.shape) * self.outer_masks,
+        masks)
+
+  def testMaskedFractionFollowsSchedule(self):
+    shape = (4, 64, 5, 4)
+    plan = lib_sampling.GibbsMaskPlan(
+        lib_sampling.BernoulliMasker(), lib_sampling.YaoSchedule(), shape,
+        num_steps=10, rng=123, chunk_size=3)
+    for s in range(len(plan)):
+      self.assertAlmostEqual(plan.pms[s], plan[s].mean(), delta=0.05)
+
+
+class BatchedGibbsSamplerTest(tf.test.TestCase):
+
+  def setUp(self):
+    np.random.seed(0)
+    self.wmodel = FakeWrappedModel()
+    self.sampler = lib_sampling.BatchedGibbsSampler(
+        wmodel=self.wmodel, max_batch_size=2)
+
+  def initial_pianoroll(self, tt):
+    # Pitch 1 everywhere except at the first time step, which is given as
+    # context with pitch 0.
+    pianoroll = np.zeros([tt, 5, 2], dtype=np.float32)
+    pianoroll[1:, 1, :] = 1.
+    pianoroll[0, 0, :] = 1.
+    return pianoroll
+
+  def submit(self, tt, **kwargs):
+    pianoroll = self.initial_pianoroll(tt)
+    mask = np.ones_like(pianoroll)
+    mask[0] = 0.
+    return self.sampler.submit(pianoroll, mask, **kwargs)
+
+  def assertValidSample(self, request, tt):
+    pianoroll = request.wait(timeout=10)
+    self.assertEqual((tt, 5, 2), pianoroll.shape)
+    self.assertAllEqual(np.ones([tt, 2]), pianoroll.sum(axis=1))
+    self.assertAllEqual([1., 1.], pianoroll[0, 0, :])
+    self.assertEqual(request.num_steps, request.step)
+
+  def testMixedLengthsTemperaturesAndSteps(self):
+    requests = [
+        self.submit(7, num_steps=2, temperature=1.),
+        self.submit(4, num_steps=5, temperature=0.01),
+        self.submit(5, num_steps=3, temperature=1.),
+    ]
+    self.assertEqual(5, self.sampler.run_until_idle())
+
+    # The first piece leaves after two steps and the queued third piece joins
+    # the batch, which is then padded to the length of the third piece.
+    self.assertEqual([(2, 7, 5, 2)] * 2 + [(2, 5, 5, 2)] * 3,
+                     self.wmodel.sess.shapes)
+    for request, tt in zip(requests, [7, 4, 5]):
+      self.assertTrue(request.done)
+      self.assertValidSample(request, tt)
+
+    # At a low temperature, resampled variables take the mode of the
+    # predictions; at a high temperature, some of them do not.
+    for request, tt, expected in [(requests[1], 4, True),
+                                  (requests[0], 7, False)]:
+      pianoroll = request.wait()
+      changed = np.any(pianoroll != self.initial_pianoroll(tt), axis=1)
+      self.assertTrue(changed.any())
+      at_mode = np.all(pianoroll == modes(tt, 5, 2), axis=1)
+      self.assertEqual(expected, np.all(at_mode[changed]))
+
+  def testBackgroundThreadServesRequests(self):
+    self.sampler.start()
+    try:
+      requests = [self.submit(tt, num_steps=3) for tt in [3, 6, 4, 5]]
+      for request, tt in zip(requests, [3, 6, 4, 5]):
+        self.assertValidSample(request, tt)
+      # Requests submitted later join while the thread keeps running.
+      request = self.submit(4, num_steps=2)
+      self.assertValidSample(request, 4)
+    finally:
+      self.sampler.stop()
+    self.assertLessEqual(max(shape[0] for shape in self.wmodel.sess.shapes), 2)
+
+  def testErrorsArePassedToRequests(self):
+    self.wmodel.sess.error = ValueError('model failed')
+    requests = [self.submit(4, num_steps=2) for _ in range(3)]
+    with self.assertRaises(ValueError):
+      self.sampler.step()
+    # Active and queued requests alike fail with the error.
+    for request in requests:
+      self.assertTrue(request.done)
+      with self.assertRaises(ValueError):
+        request.wait()
+    self.assertEqual(0, self.sampler.step())
+
+  def testErrorsInBackgroundThreadArePassedToRequests(self):
+    self.wmodel.sess.error = ValueError('model failed')
+    self.sampler.start()
+    try:
+      request = self.submit(4, num_steps=2)
+      with self.assertRaises(ValueError):
+        request.wait(timeout=10)
+      # The thread keeps serving requests after an error.
+      self.wmodel.sess.error = None
+      self.assertValidSample(self.submit(4, num_steps=2), 4)
+    finally:
+      self.sampler.stop()
+
+
+if __name__ == '__main__':
+  tf.test.main()
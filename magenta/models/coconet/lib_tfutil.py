@@ -45,6 +45,87 @@ class RobustPredictor(object):
          self(pianoroll[i:], mask[i:])], axis=0)
 
 
+class IncrementalPredictor(object):
+  """A wrapper for predictor functions that reuses earlier predictions.
+
+  The convnet output at time t only depends on the input within its temporal
+  receptive field. IncrementalPredictor keeps the inputs and outputs of the
+  previous call and, when called again on inputs of the same shape, only
+  recomputes the outputs whose receptive field covers a time step that changed.
+  This is done by running the wrapped predictor on crops that extend the stale
+  regions of each pianoroll by the receptive field on both sides, so results
+  are identical to evaluating the whole pianoroll. Crops of the same length
+  are batched together, whichever pianoroll and time steps they come from.
+  When only a few time steps change per call, as in ancestral sampling, the
+  cost of a call no longer grows with the length of the piece.
+  """
+
+  def __init__(self, predictor, receptive_field):
+    """Initialize an IncrementalPredictor instance.
+
+    Args:
+      predictor: the predictor function to wrap.
+      receptive_field: tuple `(before, after)` of numbers of time steps the
+          model output looks back and ahead.
+    """
+    self.predictor = predictor
+    self.before, self.after = receptive_field
+    self.reset()
+
+  def reset(self):
+    """Forget the cached inputs and outputs."""
+    self._contexts = None
+    self._masks = None
+    self._predictions = None
+
+  def __call__(self, pianoroll, mask):
+    """Call the wrapped predictor where needed and return its output."""
+    # The model only sees the pianoroll outside of the mask.
+    context = pianoroll * (1. - mask)
+    if self._predictions is None or self._predictions.shape != pianoroll.shape:
+      predictions = self.predictor(pianoroll, mask)
+    else:
+      changed = np.logical_or(
+          (mask != self._masks).any(axis=(2, 3)),
+          (context != self._contexts).any(axis=(2, 3)))
+      predictions = self._predictions.copy()
+      # Group the crops of all pianorolls by length.
+      crops_by_length = {}
+      for b in np.flatnonzero(changed.any(axis=1)):
+        for start, stop in self._stale_spans(changed[b]):
+          crop_start = max(0, start - self.before)
+          crop_stop = min(pianoroll.shape[1], stop + self.after)
+          crops_by_length.setdefault(crop_stop - crop_start, []).append(
+              (b, crop_start, start, stop))
+      for length, crops in sorted(crops_by_length.items()):
+        rows, crop_starts = [np.array(x) for x in list(zip(*crops))[:2]]
+        times = crop_starts[:, None] + np.arange(length)[None, :]
+        crop_predictions = self.predictor(pianoroll[rows[:, None], times],
+                                          mask[rows[:, None], times])
+        for crop_prediction, (b, crop_start, start, stop) in zip(
+            crop_predictions, crops):
+          predictions[b, start:stop] = crop_prediction[
+              start - crop_start:stop - crop_start]
+    self._contexts = context
+    self._masks = mask.copy()
+    self._predictions = predictions
+    return predictions.copy()
+
+  def _stale_spans(self, changed):
+    """Returns disjoint [start, stop) spans of outputs affected by changes."""
+    tt = len(changed)
+    spans = []
+    for t in np.flatnonzero(changed):
+      # A change at time t affects outputs in [t - after, t + before].
+      start, stop = max(0, t - self.after), min(tt, t + self.before + 1)
+      # Merge spans whose crops would overlap anyway.
+      if spans and start - self.before <= spans[-1][1] + self.after:
+        spans[-1][1] = stop
+      else:
+        spans.append([start, stop])
+    return spans
+
+
 class WrappedModel(object):
   """A data structure that holds model, graph and hparams."""
 
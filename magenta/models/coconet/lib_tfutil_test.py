@@ -0,0 +1,83 @@
+"""Tests for lib_tfutil."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.models.coconet import lib_tfutil
+
+
+class LocalWindowPredictor(object):
+  """Stands in for a convnet with a temporal receptive field.
+
+  The output at time t depends on the masks and the context within
+  [t - before, t + after], zero-padded at the borders.
+  """
+
+  def __init__(self, before, after):
+    self.before = before
+    self.after = after
+    self.num_elements = 0
+
+  def __call__(self, pianorolls, masks):
+    self.num_elements += masks.size
+    bb, tt, pp, ii = pianorolls.shape
+    features = np.concatenate([pianorolls * (1. - masks), masks], axis=3)
+    weights = np.random.RandomState(0).randn(
+        self.before + self.after + 1, 2 * ii, ii)
+    padded = np.pad(features, [(0, 0), (self.before, self.after), (0, 0),
+                               (0, 0)], 'constant')
+    logits = np.zeros([bb, tt, pp, ii])
+    for k, weight in enumerate(weights):
+      logits += np.dot(padded[:, k:k + tt], weight)
+    return 1. / (1. + np.exp(-logits))
+
+
+class IncrementalPredictorTest(tf.test.TestCase):
+
+  def testMatchesFullEvaluation(self):
+    rng = np.random.RandomState(1)
+    bb, tt, pp, ii = 6, 40, 5, 2
+    predictor = LocalWindowPredictor(before=3, after=2)
+    incremental_predictor = lib_tfutil.IncrementalPredictor(
+        predictor, receptive_field=(3, 2))
+
+    pianorolls = (rng.random_sample([bb, tt, pp, ii]) < 0.3).astype(
+        np.float32)
+    masks = np.ones([bb, tt, pp, ii], dtype=np.float32)
+    self.assertAllClose(predictor(pianorolls, masks),
+                        incremental_predictor(pianorolls, masks))
+
+    for step in range(20):
+      # Each pianoroll reveals a different time step, as in ancestral
+      # sampling; some also change a second, distant time step.
+      for b in range(bb):
+        t = rng.randint(tt)
+        masks[b, t] = 0.
+        pianorolls[b, t] = rng.random_sample([pp, ii]) < 0.3
+        if step % 3 == b % 3:
+          masks[b, (t + tt // 2) % tt, :, 0] = 1.
+      predictor.num_elements = 0
+      predictions = incremental_predictor(pianorolls, masks)
+      # Only crops around the changed time steps are evaluated.
+      self.assertLess(predictor.num_elements, masks.size)
+      self.assertAllClose(predictor(pianorolls, masks), predictions)
+
+  def testUnchangedInputsAreNotEvaluated(self):
+    predictor = LocalWindowPredictor(before=1, after=1)
+    incremental_predictor = lib_tfutil.IncrementalPredictor(
+        predictor, receptive_field=(1, 1))
+    pianorolls = np.zeros([2, 8, 3, 1], dtype=np.float32)
+    masks = np.ones_like(pianorolls)
+    expected = incremental_predictor(pianorolls, masks)
+    predictor.num_elements = 0
+    self.assertAllClose(expected, incremental_predictor(pianorolls, masks))
+    self.assertEqual(0, predictor.num_elements)
+
+
+if __name__ == '__main__':
+  tf.test.main()
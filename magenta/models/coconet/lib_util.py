@@ -247,9 +247,10 @@ def numpy_seed(seed):
     np.random.set_state(prev_rng_state)
 
 
-def random_crop(x, length):
+def random_crop(x, length, rng=None):
+  rng = get_rng(rng)
   leeway = len(x) - length
-  start = np.random.randint(1 + max(0, leeway))
+  start = rng.randint(1 + max(0, leeway))
   x = x[start:start + length]
   return x
 
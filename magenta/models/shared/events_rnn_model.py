@@ -16,14 +16,19 @@
 import collections
 import copy
 import functools
+import sys
+import threading
 
 # internal imports
 
 import numpy as np
+import six
 from six.moves import range  # pylint: disable=redefined-builtin
 import tensorflow as tf
 
+from magenta.common import batched_beam_search
 from magenta.common import beam_search
+from magenta.common import PrefixSequence
 from magenta.common import state_util
 from magenta.models.shared import events_rnn_graph
 import magenta.music as mm
@@ -35,6 +40,12 @@ import magenta.music as mm
 ModelState = collections.namedtuple(
     'ModelState', ['inputs', 'rnn_state', 'control_events', 'control_state'])
 
+# Model state for a whole beam when generating event sequences without control
+# sequences, consisting of the batched next inputs to feed the model and the
+# batched RNN state. The first dimension of each array indexes the beam.
+BatchedModelState = collections.namedtuple(
+    'BatchedModelState', ['inputs', 'rnn_state'])
+
 
 class EventSequenceRnnModelException(Exception):
   pass
@@ -61,6 +72,175 @@ def _extend_control_events_default(control_events, events, state):
   return state
 
 
+class _GenerationStep(object):
+  """A single generation step requested by one caller of GenerationEngine."""
+
+  def __init__(self, event_sequences, inputs, rnn_state, temperature):
+    self.event_sequences = event_sequences
+    self.inputs = inputs
+    self.rnn_state = rnn_state
+    self.temperature = temperature
+    self.final_state = None
+    self.loglik = np.zeros(len(event_sequences))
+    self.exc_info = None
+    self.done = False
+
+  def input_lengths(self):
+    """Returns the number of input steps for each event sequence."""
+    if isinstance(self.inputs, np.ndarray):
+      return np.repeat(self.inputs.shape[1], len(self.inputs))
+    return np.array([len(inputs) for inputs in self.inputs])
+
+  def gather_inputs(self, indices):
+    """Returns the inputs for the event sequences at `indices` as an array."""
+    if isinstance(self.inputs, np.ndarray):
+      return self.inputs[indices]
+    return np.array([self.inputs[i] for i in indices], dtype=np.float32)
+
+
+class GenerationEngine(object):
+  """Packs generation steps from concurrent callers into shared batches.
+
+  Each call to `generate_step` extends a list of event sequences by a single
+  step. Steps requested concurrently from different threads (e.g. concurrent
+  `generate` calls on a sequence generator) are packed together, so that every
+  `sess.run` is filled with as many active event sequences as possible. A caller
+  that has finished generating simply stops requesting steps, and its sequences
+  leave the shared batches.
+
+  The engine does not use a thread of its own: whichever waiting caller finds no
+  step in progress runs all pending steps, and the others wait for it. With a
+  single caller, each step therefore runs immediately.
+  """
+
+  def __init__(self, model):
+    """Construct a GenerationEngine.
+
+    Args:
+      model: The EventSequenceRnnModel whose `_generate_step_for_batch` method
+          will be used to generate each batch.
+    """
+    self._model = model
+    self._condition = threading.Condition()
+    self._pending_steps = []
+    self._running = False
+
+  def generate_step(self, event_sequences, inputs, rnn_state, temperature):
+    """Extends event sequences by a single step, batched with other callers.
+
+    This method modifies the event sequences in place.
+
+    Args:
+      event_sequences: A list of event sequences, each of which is a Python
+          list-like object.
+      inputs: The model inputs for each event sequence, either a Python list or
+          a numpy array whose first dimension indexes `event_sequences`.
+      rnn_state: A state_util.BatchedState containing the RNN state for each
+          event sequence.
+      temperature: The softmax temperature.
+
+    Returns:
+      final_state: A state_util.BatchedState containing the RNN state for each
+          event sequence after the step.
+      loglik: A 1-D numpy array containing the log-likelihood of the step for
+          each event sequence, as returned by `_generate_step_for_batch`.
+    """
+    step = _GenerationStep(event_sequences, inputs, rnn_state, temperature)
+    with self._condition:
+      self._pending_steps.append(step)
+
+    while True:
+      with self._condition:
+        while self._running and not step.done:
+          self._condition.wait()
+        if step.done:
+          break
+        self._running = True
+        steps, self._pending_steps = self._pending_steps, []
+      try:
+        self._run_steps(steps)
+      finally:
+        with self._condition:
+          self._running = False
+          self._condition.notify_all()
+
+    if step.exc_info is not None:
+      six.reraise(*step.exc_info)
+    return step.final_state, step.loglik
+
+  def _run_steps(self, steps):
+    """Runs a list of pending steps, packing their event sequences together."""
+    try:
+      # Event sequences can only share a batch if they have the same number of
+      # input steps and temperature.
+      groups = collections.OrderedDict()
+      for step in steps:
+        lengths = step.input_lengths()
+        for length in np.unique(lengths):
+          groups.setdefault((step.temperature, length), []).append(
+              (step, np.flatnonzero(lengths == length)))
+      for (temperature, _), members in groups.items():
+        self._run_group(members, temperature)
+    except Exception:  # pylint: disable=broad-except
+      exc_info = sys.exc_info()
+      for step in steps:
+        step.exc_info = exc_info
+    finally:
+      for step in steps:
+        step.done = True
+
+  def _run_group(self, members, temperature):
+    """Generates a step for event sequences with inputs of the same length.
+
+    Args:
+      members: A list of (step, indices) tuples, the event sequences at
+          `indices` in each step.
+      temperature: The softmax temperature.
+    """
+    batch_size = self._model._batch_size()  # pylint: disable=protected-access
+
+    event_sequences = [step.event_sequences[i]
+                       for step, indices in members for i in indices]
+    inputs = np.concatenate(
+        [step.gather_inputs(indices) for step, indices in members])
+    rnn_state = state_util.BatchedState.concatenate(
+        [step.rnn_state.gather(indices) for step, indices in members])
+
+    # Add padding to fill the final batch. The padding sequences share the
+    # final sequence's events rather than copying them.
+    num_seqs = len(event_sequences)
+    pad_amt = -num_seqs % batch_size
+    padding = np.append(np.arange(num_seqs), np.repeat(num_seqs - 1, pad_amt))
+    event_sequences += [
+        PrefixSequence(event_sequences[-1]) for _ in range(pad_amt)]
+    inputs = inputs[padding]
+    rnn_state.reorder(padding)
+
+    final_states = []
+    logliks = []
+    for i in range(0, num_seqs, batch_size):
+      j = i + batch_size
+      # pylint: disable=protected-access
+      batch_final_state, batch_loglik = self._model._generate_step_for_batch(
+          event_sequences[i:j], inputs[i:j],
+          rnn_state.gather(slice(i, j)).states, temperature)
+      # pylint: enable=protected-access
+      final_states.append(state_util.BatchedState(batch_final_state))
+      logliks.append(batch_loglik)
+    final_state = state_util.BatchedState.concatenate(final_states)
+    loglik = np.concatenate(logliks)
+
+    # Scatter the results back into each step's own batch.
+    offset = 0
+    for step, indices in members:
+      batch_slice = slice(offset, offset + len(indices))
+      if step.final_state is None:
+        step.final_state = final_state.empty_like(len(step.event_sequences))
+      step.final_state.scatter(indices, final_state.gather(batch_slice))
+      step.loglik[indices] = loglik[batch_slice]
+      offset += len(indices)
+
+
 class EventSequenceRnnModel(mm.BaseModel):
   """Class for RNN event sequence generation models.
 
@@ -78,6 +258,7 @@ class EventSequenceRnnModel(mm.BaseModel):
     """
     super(EventSequenceRnnModel, self).__init__()
     self._config = config
+    self._generation_engine = GenerationEngine(self)
 
   def _build_graph_for_generation(self):
     events_rnn_graph.get_build_graph_fn('generate', self._config)()
@@ -179,11 +360,6 @@ class EventSequenceRnnModel(mm.BaseModel):
       logliks: A list containing the updated log-likelihood for each event
           sequence.
     """
-    # Split the sequences to extend into batches matching the model batch size.
-    batch_size = self._batch_size()
-    num_seqs = len(event_sequences)
-    num_batches = int(np.ceil(num_seqs / float(batch_size)))
-
     # Extract inputs and RNN states from the model states.
     inputs = [model_state.inputs for model_state in model_states]
     initial_states = [model_state.rnn_state for model_state in model_states]
@@ -194,28 +370,14 @@ class EventSequenceRnnModel(mm.BaseModel):
     control_states = [
         model_state.control_state for model_state in model_states]
 
-    final_states = []
+    # Generate a single step for all event sequences, in batches shared with
+    # any concurrent generation requests.
+    final_state, step_logliks = self._generation_engine.generate_step(
+        event_sequences, inputs,
+        state_util.BatchedState.from_states(initial_states), temperature)
+    final_states = final_state.unbatch()
     logliks = np.array(logliks, dtype=np.float32)
-
-    # Add padding to fill the final batch.
-    pad_amt = -len(event_sequences) % batch_size
-    padded_event_sequences = event_sequences + [
-        copy.deepcopy(event_sequences[-1]) for _ in range(pad_amt)]
-    padded_inputs = inputs + [inputs[-1]] * pad_amt
-    padded_initial_states = initial_states + [initial_states[-1]] * pad_amt
-
-    for b in range(num_batches):
-      i, j = b * batch_size, (b + 1) * batch_size
-      pad_amt = max(0, j - num_seqs)
-      # Generate a single step for one batch of event sequences.
-      batch_final_state, batch_loglik = self._generate_step_for_batch(
-          padded_event_sequences[i:j],
-          padded_inputs[i:j],
-          state_util.batch(padded_initial_states[i:j], batch_size),
-          temperature)
-      final_states += state_util.unbatch(
-          batch_final_state, batch_size)[:j - i - pad_amt]
-      logliks[i:j - pad_amt] += batch_loglik[:j - i - pad_amt]
+    logliks += step_logliks
 
     # Construct inputs for next step.
     if extend_control_events_callback is not None:
@@ -245,6 +407,49 @@ class EventSequenceRnnModel(mm.BaseModel):
 
     return event_sequences, model_states, logliks
 
+  def _generate_batched_step(self, event_sequences, model_state, logliks,
+                             temperature):
+    """Extends a list of event sequences with batched model state by one step.
+
+    This is the step function for `batched_beam_search`. It modifies the event
+    sequences in place, and also returns them along with the updated batched
+    model state and log-likelihoods.
+
+    Args:
+      event_sequences: A list of PrefixSequence objects, which are extended by
+          this method.
+      model_state: A state_util.BatchedState containing a BatchedModelState,
+          whose batch indexes `event_sequences`.
+      logliks: A 1-D numpy array containing the current log-likelihood for each
+          event sequence.
+      temperature: The softmax temperature.
+
+    Returns:
+      event_sequences: A list of extended event sequences. These are modified in
+          place but also returned.
+      model_state: The resulting state_util.BatchedState, containing model
+          inputs for the next step along with RNN states for each event
+          sequence.
+      logliks: A 1-D numpy array containing the updated log-likelihood for each
+          event sequence.
+    """
+    # Generate a single step for all event sequences, in batches shared with
+    # any concurrent generation requests.
+    final_state, step_logliks = self._generation_engine.generate_step(
+        event_sequences, model_state.states.inputs,
+        state_util.BatchedState(model_state.states.rnn_state), temperature)
+    logliks = np.array(logliks, dtype=np.float32)
+    logliks += step_logliks
+
+    # Construct inputs for next step.
+    next_inputs = self._config.encoder_decoder.get_inputs_batch_array(
+        event_sequences)
+
+    model_state = state_util.BatchedState(
+        BatchedModelState(inputs=next_inputs, rnn_state=final_state.states))
+
+    return event_sequences, model_state, logliks
+
   def _generate_events(self, num_steps, primer_events, temperature=1.0,
                        beam_size=1, branch_factor=1, steps_per_iteration=1,
                        control_events=None, control_state=None,
@@ -337,6 +542,26 @@ class EventSequenceRnnModel(mm.BaseModel):
     graph_initial_state = self._session.graph.get_collection('initial_state')
     initial_states = state_util.unbatch(self._session.run(graph_initial_state))
 
+    if control_events is None and not modify_events_callback:
+      # Without control sequences or event modification, the beam can share
+      # event sequence prefixes and keep a single batched model state.
+      events, _, loglik = batched_beam_search(
+          initial_sequence=event_sequences[0],
+          initial_state=state_util.BatchedState(BatchedModelState(
+              inputs=np.array(inputs[:1], dtype=np.float32),
+              rnn_state=state_util.batch(initial_states[:1]))),
+          generate_step_fn=functools.partial(
+              self._generate_batched_step, temperature=temperature),
+          num_steps=num_steps - len(primer_events),
+          beam_size=beam_size,
+          branch_factor=branch_factor,
+          steps_per_iteration=steps_per_iteration)
+
+      tf.logging.info('Beam search yields sequence with log-likelihood: %f ',
+                      loglik)
+
+      return events
+
     # Beam search will maintain a state for each sequence consisting of the next
     # inputs to feed the model, and the current RNN state. We start out with the
     # initial full inputs batch and the zero state.
@@ -365,22 +590,18 @@ class EventSequenceRnnModel(mm.BaseModel):
 
     return events
 
-  def _evaluate_batch_log_likelihood(self, event_sequences, inputs,
-                                     initial_state):
-    """Evaluates the log likelihood of a batch of event sequences.
+  def _compute_softmax_for_batch(self, inputs, initial_state):
+    """Computes the softmax output for a full-length inputs batch.
 
     Args:
-      event_sequences: A list of event sequences, each of which is a Python
-          list-like object. The list of event sequences should have length equal
-          to `self._batch_size()`.
       inputs: A Python list of model inputs, with length equal to
           `self._batch_size()`.
       initial_state: A numpy array containing the initial RNN state, where
           `initial_state.shape[0]` is equal to `self._batch_size()`.
 
     Returns:
-      A Python list containing the log likelihood of each sequence in
-      `event_sequences`.
+      The softmax output, a numpy array with shape
+      [self._batch_size(), num_steps, num_classes].
     """
     graph_inputs = self._session.graph.get_collection('inputs')[0]
     graph_initial_state = self._session.graph.get_collection('initial_state')
@@ -393,14 +614,14 @@ class EventSequenceRnnModel(mm.BaseModel):
     # placeholder exists in the graph.
     if graph_temperature:
       feed_dict[graph_temperature[0]] = 1.0
-    softmax = self._session.run(graph_softmax, feed_dict)
-
-    return self._config.encoder_decoder.evaluate_log_likelihood(
-        event_sequences, softmax)
+    return self._session.run(graph_softmax, feed_dict)
 
   def _evaluate_log_likelihood(self, event_sequences, control_events=None):
     """Evaluate log likelihood for a list of event sequences of the same length.
 
+    The model is run one batch at a time, after which the log likelihood of
+    all sequences is scored at once from the collected softmax.
+
     Args:
       event_sequences: A list of event sequences for which to evaluate the log
           likelihood.
@@ -428,9 +649,6 @@ class EventSequenceRnnModel(mm.BaseModel):
           'control sequence must be at least as long as the event sequences')
 
     batch_size = self._batch_size()
-    num_full_batches = len(event_sequences) / batch_size
-
-    loglik = np.empty(len(event_sequences))
 
     # Since we're computing log-likelihood and not generating, the inputs batch
     # doesn't need to include the final event in each sequence.
@@ -445,35 +663,20 @@ class EventSequenceRnnModel(mm.BaseModel):
           [events[:-1] for events in event_sequences], full_length=True)
 
     graph_initial_state = self._session.graph.get_collection('initial_state')
-    initial_state = [
-        self._session.run(graph_initial_state)] * len(event_sequences)
-    offset = 0
-    for _ in range(num_full_batches):
-      # Evaluate a single step for one batch of event sequences.
-      batch_indices = range(offset, offset + batch_size)
-      batch_loglik = self._evaluate_batch_log_likelihood(
-          [event_sequences[i] for i in batch_indices],
-          [inputs[i] for i in batch_indices],
-          initial_state[batch_indices])
-      loglik[batch_indices] = batch_loglik
-      offset += batch_size
-
-    if offset < len(event_sequences):
-      # There's an extra non-full batch. Pad it with a bunch of copies of the
-      # final sequence.
-      num_extra = len(event_sequences) - offset
-      pad_size = batch_size - num_extra
-      batch_indices = range(offset, len(event_sequences))
-      batch_loglik = self._evaluate_batch_log_likelihood(
-          [event_sequences[i] for i in batch_indices] + [
-              copy.deepcopy(event_sequences[-1]) for _ in range(pad_size)],
-          [inputs[i] for i in batch_indices] + inputs[-1] * pad_size,
-          np.append(initial_state[batch_indices],
-                    np.tile(inputs[-1, :], (pad_size, 1)),
-                    axis=0))
-      loglik[batch_indices] = batch_loglik[0:num_extra]
-
-    return loglik
+    initial_state = self._session.run(graph_initial_state)
+
+    softmax = []
+    for offset in range(0, len(event_sequences), batch_size):
+      batch_inputs = inputs[offset:offset + batch_size]
+      num_sequences = len(batch_inputs)
+      # Pad a non-full final batch with copies of the final inputs.
+      batch_inputs += [batch_inputs[-1]] * (batch_size - num_sequences)
+      batch_softmax = self._compute_softmax_for_batch(
+          batch_inputs, initial_state)
+      softmax.append(batch_softmax[:num_sequences])
+
+    return np.array(self._config.encoder_decoder.evaluate_log_likelihood(
+        event_sequences, np.concatenate(softmax)))
 
 
 class EventSequenceRnnConfig(object):
@@ -0,0 +1,174 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for events_rnn_model."""
+
+import threading
+import time
+
+# internal imports
+import numpy as np
+import tensorflow as tf
+
+from magenta.common import state_util
+from magenta.models.shared import events_rnn_model
+
+
+class FakeModel(object):
+  """Fake model that records the batches it is asked to generate.
+
+  Each event sequence is extended with its (integer) input value, the RNN state
+  is incremented by one, and the log-likelihood is a tenth of the input value.
+  The first batch blocks until `release` is set, so that tests can queue up
+  concurrent steps behind it.
+  """
+
+  def __init__(self, batch_size):
+    self.batch_size = batch_size
+    self.batches = []
+    self.started = threading.Event()
+    self.release = threading.Event()
+    self.error = None
+
+  def _batch_size(self):
+    return self.batch_size
+
+  def _generate_step_for_batch(self, event_sequences, inputs, initial_state,
+                               temperature):
+    self.batches.append((inputs[:, -1, 0].tolist(), temperature))
+    if len(self.batches) == 1:
+      self.started.set()
+      self.release.wait()
+    elif self.error is not None:
+      raise self.error
+    for events, value in zip(event_sequences, inputs[:, -1, 0].tolist()):
+      events.append(int(value))
+    return initial_state + 1, inputs[:, -1, 0] / 10.0
+
+
+class GenerationEngineTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.model = FakeModel(batch_size=8)
+    self.engine = events_rnn_model.GenerationEngine(self.model)
+
+  def _generate_step(self, values, states, temperature=1.0):
+    """Requests a generation step for new event sequences with given inputs."""
+    event_sequences = [[] for _ in values]
+    inputs = np.array(values, dtype=np.float32).reshape(-1, 1, 1)
+    rnn_state = state_util.BatchedState(np.array(states, dtype=np.float64))
+    try:
+      final_state, loglik = self.engine.generate_step(
+          event_sequences, inputs, rnn_state, temperature)
+    except ValueError as e:
+      return e
+    return event_sequences, final_state.states, loglik
+
+  def _run_concurrently(self, requests):
+    """Runs generation steps from concurrent threads.
+
+    A first step is started and held inside the model, so that all requested
+    steps are pending by the time it finishes and can be packed together.
+
+    Args:
+      requests: A list of argument tuples for `_generate_step`.
+
+    Returns:
+      A list of the results of `_generate_step` for each request.
+    """
+    results = [None] * len(requests)
+
+    def run(i):
+      results[i] = self._generate_step(*requests[i])
+
+    warmup = threading.Thread(target=self._generate_step, args=([0], [[0.0]]))
+    warmup.start()
+    self.assertTrue(self.model.started.wait(10))
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(len(requests))]
+    for thread in threads:
+      thread.start()
+    deadline = time.time() + 10
+    # pylint: disable=protected-access
+    while len(self.engine._pending_steps) < len(requests):
+      self.assertLess(time.time(), deadline)
+      time.sleep(0.001)
+    # pylint: enable=protected-access
+
+    self.model.release.set()
+    for thread in [warmup] + threads:
+      thread.join()
+    return results
+
+  def testSingleCaller(self):
+    self.model.release.set()
+    event_sequences, final_state, loglik = self._generate_step(
+        [1, 2], [[10.0], [20.0]])
+    self.assertEqual([[1], [2]], event_sequences)
+    self.assertAllEqual([[11.0], [21.0]], final_state)
+    self.assertAllClose([0.1, 0.2], loglik)
+    # The batch is padded with the final event sequence.
+    self.assertEqual([([1, 2, 2, 2, 2, 2, 2, 2], 1.0)], self.model.batches)
+
+  def testConcurrentStepsShareBatch(self):
+    results = self._run_concurrently([
+        ([1, 2, 3], [[10.0], [20.0], [30.0]]),
+        ([4, 5], [[40.0], [50.0]])])
+
+    # Apart from the warmup step, both callers' sequences share a single batch.
+    self.assertEqual(2, len(self.model.batches))
+    values, temperature = self.model.batches[1]
+    self.assertEqual(8, len(values))
+    self.assertEqual([1, 2, 3, 4, 5], sorted(set(values)))
+    self.assertEqual(1.0, temperature)
+
+    # Each caller gets back its own event sequences, states and logliks.
+    event_sequences, final_state, loglik = results[0]
+    self.assertEqual([[1], [2], [3]], event_sequences)
+    self.assertAllEqual([[11.0], [21.0], [31.0]], final_state)
+    self.assertAllClose([0.1, 0.2, 0.3], loglik)
+
+    event_sequences, final_state, loglik = results[1]
+    self.assertEqual([[4], [5]], event_sequences)
+    self.assertAllEqual([[41.0], [51.0]], final_state)
+    self.assertAllClose([0.4, 0.5], loglik)
+
+  def testConcurrentStepsGroupedByTemperature(self):
+    results = self._run_concurrently([
+        ([1, 2], [[10.0], [20.0]], 1.0),
+        ([3], [[30.0]], 0.5),
+        ([4], [[40.0]], 1.0)])
+
+    self.assertEqual(3, len(self.model.batches))
+    batches = sorted((temperature, sorted(set(values)))
+                     for values, temperature in self.model.batches[1:])
+    self.assertEqual([(0.5, [3]), (1.0, [1, 2, 4])], batches)
+
+    self.assertEqual([[1], [2]], results[0][0])
+    self.assertAllEqual([[31.0]], results[1][1])
+    self.assertAllClose([0.4], results[2][2])
+
+  def testErrorPropagatesToAllCallers(self):
+    self.model.error = ValueError('generation failed')
+    results = self._run_concurrently([
+        ([1, 2], [[10.0], [20.0]]),
+        ([3], [[30.0]])])
+
+    self.assertEqual(2, len(self.model.batches))
+    for result in results:
+      self.assertIsInstance(result, ValueError)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -19,6 +19,7 @@ from magenta.music.abc_parser import parse_abc_tunebook_file
 
 from magenta.music.chord_inference import ChordInferenceException
 from magenta.music.chord_inference import infer_chords_for_sequence
+from magenta.music.chord_inference import infer_chords_for_sequences
 
 from magenta.music.chord_symbols_lib import chord_symbol_bass
 from magenta.music.chord_symbols_lib import chord_symbol_pitches
@@ -121,6 +122,7 @@ from magenta.music.sequences_lib import infer_dense_chords_for_sequence
 from magenta.music.sequences_lib import MultipleTempoException
 from magenta.music.sequences_lib import MultipleTimeSignatureException
 from magenta.music.sequences_lib import NegativeTimeException
+from magenta.music.sequences_lib import NoteArray
 from magenta.music.sequences_lib import quantize_note_sequence
 from magenta.music.sequences_lib import quantize_note_sequence_absolute
 from magenta.music.sequences_lib import quantize_to_step
@@ -99,39 +99,34 @@ def _key_chord_distribution(chord_pitch_out_of_key_prob):
 def _key_chord_transition_distribution(
     key_chord_distribution, key_change_prob, chord_change_prob):
   """Transition distribution between key-chord pairs."""
-  mat = np.zeros([len(_KEY_CHORDS), len(_KEY_CHORDS)])
-
-  for i, key_chord_1 in enumerate(_KEY_CHORDS):
-    key_1, chord_1 = key_chord_1
-    chord_index_1 = i % len(_CHORDS)
-
-    for j, key_chord_2 in enumerate(_KEY_CHORDS):
-      key_2, chord_2 = key_chord_2
-      chord_index_2 = j % len(_CHORDS)
-
-      if key_1 != key_2:
-        # Key change. Chord probability depends only on key and not previous
-        # chord.
-        mat[i, j] = (key_change_prob / 11)
-        mat[i, j] *= key_chord_distribution[key_2, chord_index_2]
-
-      else:
-        # No key change.
-        mat[i, j] = 1 - key_change_prob
-        if chord_1 != chord_2:
-          # Chord probability depends on key, but we have to redistribute the
-          # probability mass on the previous chord since we know the chord
-          # changed.
-          mat[i, j] *= (
-              chord_change_prob * (
-                  key_chord_distribution[key_2, chord_index_2] +
-                  key_chord_distribution[key_2, chord_index_1] / (len(_CHORDS) -
-                                                                  1)))
-        else:
-          # No chord change.
-          mat[i, j] *= 1 - chord_change_prob
+  num_chords = len(_CHORDS)
+  keys = np.arange(len(_KEY_CHORDS)) // num_chords
+  chord_indices = np.arange(len(_KEY_CHORDS)) % num_chords
 
-  return mat
+  key_1 = keys[:, np.newaxis]
+  key_2 = keys[np.newaxis, :]
+  chord_index_1 = chord_indices[:, np.newaxis]
+  chord_index_2 = chord_indices[np.newaxis, :]
+
+  # Key change. Chord probability depends only on key and not previous chord.
+  key_change_mat = (
+      (key_change_prob / 11) * key_chord_distribution[key_2, chord_index_2])
+
+  # No key change, but chord change. Chord probability depends on key, but we
+  # have to redistribute the probability mass on the previous chord since we
+  # know the chord changed.
+  chord_change_mat = (1 - key_change_prob) * (
+      chord_change_prob * (
+          key_chord_distribution[key_2, chord_index_2] +
+          key_chord_distribution[key_2, chord_index_1] / (num_chords - 1)))
+
+  # No key change and no chord change.
+  no_change_prob = (1 - key_change_prob) * (1 - chord_change_prob)
+
+  return np.where(
+      key_1 != key_2, key_change_mat,
+      np.where(chord_index_1 != chord_index_2, chord_change_mat,
+               no_change_prob))
 
 
 def _chord_pitch_vectors():
@@ -160,27 +155,39 @@ def sequence_note_pitch_vectors(sequence, seconds_per_frame):
   num_frames = int(math.ceil(sequence.total_time / seconds_per_frame))
   x = np.zeros([num_frames, 12])
 
-  for note in sequence.notes:
-    if note.is_drum:
-      continue
-    if note.program in _UNPITCHED_PROGRAMS:
-      continue
-
-    start_frame = int(math.floor(note.start_time / seconds_per_frame))
-    end_frame = int(math.ceil(note.end_time / seconds_per_frame)) - 1
-    pitch_class = note.pitch % 12
-
-    start_frame = min(start_frame, num_frames - 1)
-    end_frame = max(end_frame, 0)
-
-    if start_frame >= end_frame:
-      x[start_frame, pitch_class] += note.end_time - note.start_time
-    else:
-      x[start_frame, pitch_class] += (
-          (start_frame + 1) * seconds_per_frame - note.start_time)
-      for frame in range(start_frame + 1, end_frame):
-        x[frame, pitch_class] += seconds_per_frame
-      x[end_frame, pitch_class] += note.end_time - end_frame * seconds_per_frame
+  notes = sequences_lib.NoteArray.from_sequence(sequence)
+  pitched = ~notes.is_drum & ~np.isin(notes.program, _UNPITCHED_PROGRAMS)
+  start_times = notes.start_time[pitched]
+  end_times = notes.end_time[pitched]
+  pitch_classes = notes.pitch[pitched] % 12
+
+  start_frames = np.floor(start_times / seconds_per_frame).astype(np.int64)
+  end_frames = np.ceil(end_times / seconds_per_frame).astype(np.int64) - 1
+
+  start_frames = np.minimum(start_frames, num_frames - 1)
+  end_frames = np.maximum(end_frames, 0)
+
+  # Notes contained in a single frame.
+  single = start_frames >= end_frames
+  np.add.at(x, (start_frames[single], pitch_classes[single]),
+            end_times[single] - start_times[single])
+
+  # Notes spanning multiple frames contribute partial frames at their start and
+  # end...
+  multi = ~single
+  start_frames = start_frames[multi]
+  end_frames = end_frames[multi]
+  pitch_classes = pitch_classes[multi]
+  np.add.at(x, (start_frames, pitch_classes),
+            (start_frames + 1) * seconds_per_frame - start_times[multi])
+  np.add.at(x, (end_frames, pitch_classes),
+            end_times[multi] - end_frames * seconds_per_frame)
+
+  # ...and full frames in between, which are accumulated as interval counts.
+  counts = np.zeros([num_frames + 1, 12])
+  np.add.at(counts, (start_frames + 1, pitch_classes), 1)
+  np.add.at(counts, (end_frames, pitch_classes), -1)
+  x += np.cumsum(counts[:-1], axis=0) * seconds_per_frame
 
   x_norm = np.linalg.norm(x, axis=1)
   nonzero_frames = x_norm > 0
@@ -205,25 +212,30 @@ def _key_chord_viterbi(chord_frame_loglik,
   loglik_matrix = np.zeros([num_frames, num_key_chords])
   path_matrix = np.zeros([num_frames, num_key_chords], dtype=np.int32)
 
+  # Log-likelihood of each frame under the chord of each key-chord pair.
+  key_chord_frame_loglik = np.tile(chord_frame_loglik, [1, 12])
+
   # Initialize with a uniform distribution over keys.
-  for i, key_chord in enumerate(_KEY_CHORDS):
-    key, unused_chord = key_chord
-    chord_index = i % len(_CHORDS)
-    loglik_matrix[0, i] = (
-        -np.log(12) + key_chord_loglik[key, chord_index] +
-        chord_frame_loglik[0, chord_index])
+  loglik_matrix[0, :] = (
+      -np.log(12) + key_chord_loglik.ravel() + key_chord_frame_loglik[0])
+
+  # Transposed transition log-likelihoods, so that the maximization over
+  # parent key-chord pairs runs along contiguous rows.
+  transition_loglik_t = np.ascontiguousarray(key_chord_transition_loglik.T)
+
+  # Buffer for the log-likelihood of each transition, reused across frames.
+  mat = np.empty([num_key_chords, num_key_chords])
+  key_chord_indices = np.arange(num_key_chords)
 
   for frame in range(1, num_frames):
     # At each frame, store the log-likelihood of the best sequence ending in
     # each key-chord pair, along with the index of the parent key-chord pair
     # from the previous frame.
-    mat = (np.tile(loglik_matrix[frame - 1][:, np.newaxis],
-                   [1, num_key_chords]) +
-           key_chord_transition_loglik)
-    path_matrix[frame, :] = mat.argmax(axis=0)
-    loglik_matrix[frame, :] = (
-        mat[path_matrix[frame, :], range(num_key_chords)] +
-        np.tile(chord_frame_loglik[frame], 12))
+    np.add(loglik_matrix[frame - 1][np.newaxis, :], transition_loglik_t,
+           out=mat)
+    path_matrix[frame, :] = mat.argmax(axis=1)
+    np.add(mat[key_chord_indices, path_matrix[frame]],
+           key_chord_frame_loglik[frame], out=loglik_matrix[frame])
 
   # Reconstruct the most likely sequence of key-chord pairs.
   path = [np.argmax(loglik_matrix[-1])]
@@ -258,33 +270,18 @@ class SequenceTooLongException(ChordInferenceException):
   pass
 
 
-def infer_chords_for_sequence(quantized_sequence,
-                              chords_per_bar=None,
-                              key_change_prob=0.001,
-                              chord_change_prob=0.5,
-                              chord_pitch_out_of_key_prob=0.01,
-                              chord_note_concentration=100.0):
-  """Infer chords for a quantized NoteSequence using the Viterbi algorithm.
-
-  This uses some heuristics to infer chords for a quantized NoteSequence. At
-  each chord position a key and chord will be inferred, and the chords will be
-  added (as text annotations) to the sequence.
+def _chord_frames(quantized_sequence, chords_per_bar):
+  """Determines the chord frames for a quantized NoteSequence.
 
   Args:
     quantized_sequence: The quantized NoteSequence for which to infer chords.
-        This NoteSequence will be modified in place.
     chords_per_bar: The number of chords per bar to infer. If None, use a
         default number of chords based on the time signature of
         `quantized_sequence`.
-    key_change_prob: Probability of a key change between two adjacent frames.
-    chord_change_prob: Probability of a chord change between two adjacent
-        frames.
-    chord_pitch_out_of_key_prob: Probability of a pitch in a chord not belonging
-        to the current key.
-    chord_note_concentration: Concentration parameter for the distribution of
-        observed pitches played over a chord. At zero, all pitches are equally
-        likely. As concentration increases, observed pitches must match the
-        chord pitches more closely.
+
+  Returns:
+    A tuple containing the number of steps per chord and the number of seconds
+    per chord.
 
   Raises:
     SequenceAlreadyHasChordsException: If `quantized_sequence` already has
@@ -332,28 +329,12 @@ def infer_chords_for_sequence(quantized_sequence,
     raise SequenceTooLongException(
         'NoteSequence too long for chord inference: %d frames' % num_chords)
 
-  # Compute pitch vectors for each chord frame, then compute log-likelihood of
-  # observing those pitch vectors under each possible chord.
-  note_pitch_vectors = sequence_note_pitch_vectors(
-      quantized_sequence, seconds_per_frame=seconds_per_chord)
-  chord_frame_loglik = _chord_frame_log_likelihood(
-      note_pitch_vectors, chord_note_concentration)
-
-  # Compute distribution over chords for each key, and transition distribution
-  # between key-chord pairs.
-  key_chord_distribution = _key_chord_distribution(
-      chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
-  key_chord_transition_distribution = _key_chord_transition_distribution(
-      key_chord_distribution,
-      key_change_prob=key_change_prob,
-      chord_change_prob=chord_change_prob)
-  key_chord_loglik = np.log(key_chord_distribution)
-  key_chord_transition_loglik = np.log(key_chord_transition_distribution)
+  return steps_per_chord, seconds_per_chord
 
-  key_chords = _key_chord_viterbi(
-      chord_frame_loglik, key_chord_loglik, key_chord_transition_loglik)
 
-  # Add the inferred chord changes to the sequence, logging any key changes.
+def _add_chords_to_sequence(quantized_sequence, key_chords, steps_per_chord,
+                            seconds_per_chord):
+  """Adds inferred chord changes to a sequence, logging any key changes."""
   current_key_name = None
   current_chord_name = None
   for frame, (key, chord) in enumerate(key_chords):
@@ -377,3 +358,119 @@ def infer_chords_for_sequence(quantized_sequence,
       ta.text = figure
       ta.annotation_type = music_pb2.NoteSequence.TextAnnotation.CHORD_SYMBOL
       current_chord_name = figure
+
+
+def infer_chords_for_sequences(quantized_sequences,
+                               chords_per_bar=None,
+                               key_change_prob=0.001,
+                               chord_change_prob=0.5,
+                               chord_pitch_out_of_key_prob=0.01,
+                               chord_note_concentration=100.0):
+  """Infer chords for multiple quantized NoteSequences.
+
+  This is equivalent to calling `infer_chords_for_sequence` on each sequence,
+  but the key-chord distributions are only computed once and shared across all
+  sequences. All sequences are checked before any chords are added, so if an
+  exception is raised none of the sequences will have been modified.
+
+  Args:
+    quantized_sequences: A list of quantized NoteSequences for which to infer
+        chords. These NoteSequences will be modified in place.
+    chords_per_bar: The number of chords per bar to infer. If None, use a
+        default number of chords based on the time signature of each sequence.
+    key_change_prob: Probability of a key change between two adjacent frames.
+    chord_change_prob: Probability of a chord change between two adjacent
+        frames.
+    chord_pitch_out_of_key_prob: Probability of a pitch in a chord not belonging
+        to the current key.
+    chord_note_concentration: Concentration parameter for the distribution of
+        observed pitches played over a chord. At zero, all pitches are equally
+        likely. As concentration increases, observed pitches must match the
+        chord pitches more closely.
+
+  Raises:
+    SequenceAlreadyHasChordsException: If any sequence already has chords.
+    UncommonTimeSignatureException: If `chords_per_bar` is not specified and
+        any sequence has an uncommon time signature.
+    NonIntegerStepsPerChordException: If the number of quantized steps per chord
+        is not an integer for any sequence.
+    EmptySequenceException: If any sequence is empty.
+    SequenceTooLongException: If the number of chords to be inferred is too
+        large for any sequence.
+  """
+  chord_frames = [_chord_frames(quantized_sequence, chords_per_bar)
+                  for quantized_sequence in quantized_sequences]
+
+  # Compute distribution over chords for each key, and transition distribution
+  # between key-chord pairs.
+  key_chord_distribution = _key_chord_distribution(
+      chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob)
+  key_chord_transition_distribution = _key_chord_transition_distribution(
+      key_chord_distribution,
+      key_change_prob=key_change_prob,
+      chord_change_prob=chord_change_prob)
+  key_chord_loglik = np.log(key_chord_distribution)
+  key_chord_transition_loglik = np.log(key_chord_transition_distribution)
+
+  for quantized_sequence, (steps_per_chord, seconds_per_chord) in zip(
+      quantized_sequences, chord_frames):
+    # Compute pitch vectors for each chord frame, then compute log-likelihood
+    # of observing those pitch vectors under each possible chord.
+    note_pitch_vectors = sequence_note_pitch_vectors(
+        quantized_sequence, seconds_per_frame=seconds_per_chord)
+    chord_frame_loglik = _chord_frame_log_likelihood(
+        note_pitch_vectors, chord_note_concentration)
+
+    key_chords = _key_chord_viterbi(
+        chord_frame_loglik, key_chord_loglik, key_chord_transition_loglik)
+
+    _add_chords_to_sequence(
+        quantized_sequence, key_chords, steps_per_chord, seconds_per_chord)
+
+
+def infer_chords_for_sequence(quantized_sequence,
+                              chords_per_bar=None,
+                              key_change_prob=0.001,
+                              chord_change_prob=0.5,
+                              chord_pitch_out_of_key_prob=0.01,
+                              chord_note_concentration=100.0):
+  """Infer chords for a quantized NoteSequence using the Viterbi algorithm.
+
+  This uses some heuristics to infer chords for a quantized NoteSequence. At
+  each chord position a key and chord will be inferred, and the chords will be
+  added (as text annotations) to the sequence.
+
+  Args:
+    quantized_sequence: The quantized NoteSequence for which to infer chords.
+        This NoteSequence will be modified in place.
+    chords_per_bar: The number of chords per bar to infer. If None, use a
+        default number of chords based on the time signature of
+        `quantized_sequence`.
+    key_change_prob: Probability of a key change between two adjacent frames.
+    chord_change_prob: Probability of a chord change between two adjacent
+        frames.
+    chord_pitch_out_of_key_prob: Probability of a pitch in a chord not belonging
+        to the current key.
+    chord_note_concentration: Concentration parameter for the distribution of
+        observed pitches played over a chord. At zero, all pitches are equally
+        likely. As concentration increases, observed pitches must match the
+        chord pitches more closely.
+
+  Raises:
+    SequenceAlreadyHasChordsException: If `quantized_sequence` already has
+        chords.
+    UncommonTimeSignatureException: If `chords_per_bar` is not specified and
+        `quantized_sequence` has an uncommon time signature.
+    NonIntegerStepsPerChordException: If the number of quantized steps per chord
+        is not an integer.
+    EmptySequenceException: If `quantized_sequence` is empty.
+    SequenceTooLongException: If the number of chords to be inferred is too
+        large.
+  """
+  infer_chords_for_sequences(
+      [quantized_sequence],
+      chords_per_bar=chords_per_bar,
+      key_change_prob=key_change_prob,
+      chord_change_prob=chord_change_prob,
+      chord_pitch_out_of_key_prob=chord_pitch_out_of_key_prob,
+      chord_note_concentration=chord_note_concentration)
@@ -69,6 +69,61 @@ class ChordInferenceTest(tf.test.TestCase):
 
     self.assertEqual(expected_chords, chords)
 
+  def testSequenceNotePitchVectorsIgnoresUnpitchedNotes(self):
+    sequence = music_pb2.NoteSequence()
+    testing_lib.add_track_to_sequence(
+        sequence, 0, [(60, 100, 0.0, 2.0)])
+    testing_lib.add_track_to_sequence(
+        sequence, 1, [(62, 100, 0.0, 2.0)], is_drum=True)
+    testing_lib.add_track_to_sequence(
+        sequence, 2, [(64, 100, 0.0, 2.0)], program=100)
+    note_pitch_vectors = chord_inference.sequence_note_pitch_vectors(
+        sequence, seconds_per_frame=0.5)
+
+    expected_note_pitch_vectors = [
+        [1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+    ] * 4
+
+    self.assertEqual(expected_note_pitch_vectors, note_pitch_vectors.tolist())
+
+  def testInferChordsForSequences(self):
+    sequence_1 = music_pb2.NoteSequence()
+    testing_lib.add_track_to_sequence(
+        sequence_1, 0,
+        [(60, 100, 0.0, 1.0), (64, 100, 0.0, 1.0), (67, 100, 0.0, 1.0),   # C
+         (62, 100, 1.0, 2.0), (65, 100, 1.0, 2.0), (69, 100, 1.0, 2.0)])  # Dm
+    sequence_2 = music_pb2.NoteSequence()
+    testing_lib.add_track_to_sequence(
+        sequence_2, 0,
+        [(60, 100, 0.0, 1.0), (65, 100, 0.0, 1.0), (69, 100, 0.0, 1.0),   # F
+         (59, 100, 1.0, 2.0), (62, 100, 1.0, 2.0), (67, 100, 1.0, 2.0)])  # G
+    quantized_sequences = [
+        sequences_lib.quantize_note_sequence(sequence, steps_per_quarter=4)
+        for sequence in [sequence_1, sequence_2]]
+    chord_inference.infer_chords_for_sequences(
+        quantized_sequences, chords_per_bar=2)
+
+    expected_chords = [[('C', 0.0), ('Dm', 1.0)], [('F', 0.0), ('G', 1.0)]]
+    chords = [[(ta.text, ta.time) for ta in sequence.text_annotations]
+              for sequence in quantized_sequences]
+
+    self.assertEqual(expected_chords, chords)
+
+  def testInferChordsForSequencesNoPartialModification(self):
+    sequence = music_pb2.NoteSequence()
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(60, 100, 0.0, 1.0), (64, 100, 0.0, 1.0), (67, 100, 0.0, 1.0)])
+    quantized_sequence = sequences_lib.quantize_note_sequence(
+        sequence, steps_per_quarter=4)
+    empty_sequence = sequences_lib.quantize_note_sequence(
+        music_pb2.NoteSequence(), steps_per_quarter=4)
+
+    with self.assertRaises(chord_inference.EmptySequenceException):
+      chord_inference.infer_chords_for_sequences(
+          [quantized_sequence, empty_sequence], chords_per_bar=2)
+    self.assertFalse(quantized_sequence.text_annotations)
+
 
 if __name__ == '__main__':
   tf.test.main()
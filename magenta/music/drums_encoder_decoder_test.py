@@ -21,6 +21,7 @@ from __future__ import print_function
 import tensorflow as tf
 
 from magenta.music import drums_encoder_decoder
+from magenta.music import encoder_decoder
 
 DRUMS = lambda *args: frozenset(args)
 NO_DRUMS = frozenset()
@@ -78,5 +79,27 @@ class MultiDrumOneHotEncodingTest(tf.test.TestCase):
     self.assertEquals(3, len(event))
 
 
+class LookbackMultiDrumEncoderDecoderTest(tf.test.TestCase):
+
+  def setUp(self):
+    self.enc = encoder_decoder.LookbackEventSequenceEncoderDecoder(
+        drums_encoder_decoder.MultiDrumOneHotEncoding(),
+        lookback_distances=[16], binary_counter_bits=6)
+
+  def testInputsArrayMatchesEventsToInput(self):
+    # Bass drums 35 and 36 share a class, and pitch 0 is not a known drum, so
+    # these events repeat in their encoding but not as raw events.
+    events = [DRUMS(36)] * 16 + [DRUMS(35)] * 16 + [DRUMS(0)] * 8 + [NO_DRUMS]
+    expected_inputs = [self.enc.events_to_input(events, i)
+                       for i in range(len(events))]
+    self.assertListEqual(
+        expected_inputs, self.enc.events_to_inputs_array(events).tolist())
+    self.assertListEqual(
+        [expected_inputs[16], expected_inputs[-1]],
+        self.enc.events_to_inputs_array(events, [16, 40]).tolist())
+    self.assertListEqual(
+        [[expected_inputs[-1]]], self.enc.get_inputs_batch([events]))
+
+
 if __name__ == '__main__':
   tf.test.main()
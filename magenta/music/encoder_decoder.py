@@ -285,6 +285,45 @@ class EventSequenceEncoderDecoder(object):
       inputs_batch.append(inputs)
     return inputs_batch
 
+  def get_inputs_batch_array(self, event_sequences, full_length=False):
+    """Returns an inputs batch for the given event sequences as a NumPy array.
+
+    Args:
+      event_sequences: A list of list-like event sequences.
+      full_length: If True, the inputs batch will be for the full length of
+          each event sequence, which must all be the same length. If False,
+          the inputs batch will only be for the last event of each event
+          sequence.
+
+    Returns:
+      A float32 NumPy array. If `full_length` is True, the shape will be
+      [len(event_sequences), len(event_sequences[0]), self.input_size]. If
+      `full_length` is False, the shape will be
+      [len(event_sequences), 1, self.input_size].
+    """
+    return np.array(self.get_inputs_batch(event_sequences, full_length),
+                    dtype=np.float32)
+
+  def sample_classes(self, softmax):
+    """Samples one class index from each of a batch of softmax vectors.
+
+    All vectors are sampled with a single uniform draw, consuming the NumPy
+    random state exactly as one `np.random.choice` call per vector would.
+
+    Args:
+      softmax: A 2-D array-like of probability vectors, with shape
+          [batch_size, num_classes].
+
+    Returns:
+      A 1-D integer NumPy array of chosen class indices, of length batch_size.
+    """
+    softmax = np.asarray(softmax, dtype=np.float64)
+    cdf = np.cumsum(softmax, axis=1)
+    cdf /= cdf[:, -1:]
+    uniform_samples = np.random.random_sample(len(softmax))
+    chosen_classes = np.sum(cdf <= uniform_samples[:, np.newaxis], axis=1)
+    return np.minimum(chosen_classes, softmax.shape[1] - 1)
+
   def extend_event_sequences(self, event_sequences, softmax):
     """Extends the event sequences by sampling the softmax probabilities.
 
@@ -296,15 +335,45 @@ class EventSequenceEncoderDecoder(object):
     Returns:
       A Python list of chosen class indices, one for each event sequence.
     """
-    num_classes = len(softmax[0][0])
-    chosen_classes = []
-    for i in range(len(event_sequences)):
-      chosen_class = np.random.choice(num_classes, p=softmax[i][-1])
-      event = self.class_index_to_event(chosen_class, event_sequences[i])
-      event_sequences[i].append(event)
-      chosen_classes.append(chosen_class)
+    chosen_classes = self.sample_classes(
+        [softmax[i][-1] for i in range(len(event_sequences))]).tolist()
+    for events, chosen_class in zip(event_sequences, chosen_classes):
+      events.append(self.class_index_to_event(chosen_class, events))
     return chosen_classes
 
+  def labels_log_likelihood(self, labels, softmax):
+    """Sums the log probability of each label sequence under its softmax.
+
+    Args:
+      labels: A list of integer label sequences, one per softmax.
+      softmax: A list of softmax probability vectors. Each label sequence is
+          scored against the same number of vectors at the end of its softmax.
+
+    Returns:
+      A 1-D NumPy array containing the log likelihood of each label sequence.
+    """
+    lengths = set(len(sequence_labels) for sequence_labels in labels)
+    if len(lengths) == 1 and isinstance(softmax, np.ndarray):
+      # Gather every label probability from the softmax tensor at once.
+      num_steps = lengths.pop()
+      labels = np.asarray(labels, dtype=np.int64).reshape(
+          len(labels), num_steps)
+      probs = softmax[np.arange(len(labels))[:, np.newaxis],
+                      np.arange(softmax.shape[1] - num_steps,
+                                softmax.shape[1]),
+                      labels]
+      return np.log(probs).astype(np.float64).sum(axis=1)
+
+    loglik = np.zeros(len(labels))
+    for i, sequence_labels in enumerate(labels):
+      if not sequence_labels:
+        continue
+      sequence_softmax = np.asarray(softmax[i])[-len(sequence_labels):]
+      probs = sequence_softmax[np.arange(len(sequence_labels)),
+                               sequence_labels]
+      loglik[i] = np.log(probs).astype(np.float64).sum()
+    return loglik
+
   def evaluate_log_likelihood(self, event_sequences, softmax):
     """Evaluate the log likelihood of multiple event sequences.
 
@@ -326,7 +395,7 @@ class EventSequenceEncoderDecoder(object):
       ValueError: If one of the event sequences is too long with respect to the
           corresponding softmax vectors.
     """
-    all_loglik = []
+    labels = []
     for i in range(len(event_sequences)):
       if len(softmax[i]) >= len(event_sequences[i]):
         raise ValueError(
@@ -335,12 +404,9 @@ class EventSequenceEncoderDecoder(object):
                                                len(softmax[i])))
       end_pos = len(event_sequences[i])
       start_pos = end_pos - len(softmax[i])
-      loglik = 0.0
-      for softmax_pos, position in enumerate(range(start_pos, end_pos)):
-        index = self.events_to_label(event_sequences[i], position)
-        loglik += np.log(softmax[i][softmax_pos][index])
-      all_loglik.append(loglik)
-    return all_loglik
+      labels.append([self.events_to_label(event_sequences[i], position)
+                     for position in range(start_pos, end_pos)])
+    return self.labels_log_likelihood(labels, softmax).tolist()
 
 
 class OneHotEventSequenceEncoderDecoder(EventSequenceEncoderDecoder):
@@ -537,6 +603,191 @@ class LookbackEventSequenceEncoderDecoder(EventSequenceEncoderDecoder):
 
     return input_
 
+  def _encode_positions(self, events, positions):
+    """Encodes only the events needed to build inputs at the given positions.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A 1-D integer NumPy array of positions in the event sequence.
+
+    Returns:
+      A tuple (current, next_events, repeats) of NumPy arrays: the one-hot
+      index of the event at each position, with shape [len(positions)]; the
+      one-hot index of the next event for each lookback, with shape
+      [len(positions), num_lookbacks]; and whether the event at each position
+      repeats each lookback, with shape [len(positions), num_lookbacks].
+    """
+    lookbacks = np.array(self._lookback_distances, dtype=np.int64)
+    next_positions = positions[:, np.newaxis] - lookbacks + 1
+    repeat_positions = next_positions - 1
+
+    # Encode each event referenced by the inputs exactly once. For a full
+    # sequence this is every event; for a single step it is only the current
+    # event and the next events at the lookback distances.
+    if len(positions) == len(events):
+      needed = np.arange(len(events))
+    else:
+      needed = np.unique(np.concatenate([positions, next_positions.ravel()]))
+      needed = needed[needed >= 0]
+    encoded = np.zeros(len(events), dtype=np.int64)
+    for position in needed.tolist():
+      encoded[position] = self._one_hot_encoding.encode_event(events[position])
+
+    current = encoded[positions]
+    next_events = np.where(
+        next_positions >= 0, encoded[np.maximum(next_positions, 0)],
+        self.default_event_label)
+
+    # Repeats compare the raw events rather than their one-hot indices, since
+    # the one-hot encoding need not be injective (e.g. drum encodings that map
+    # several drums to the same class).
+    repeats = np.zeros(repeat_positions.shape, dtype=np.bool_)
+    for i, position in enumerate(positions.tolist()):
+      for j, repeat_position in enumerate(repeat_positions[i].tolist()):
+        if (repeat_position >= 0 and
+            events[position] == events[repeat_position]):
+          repeats[i, j] = True
+    return current, next_events, repeats
+
+  def _build_inputs(self, current, next_events, repeats, positions):
+    """Builds input vectors from encoded events using NumPy indexing.
+
+    Args:
+      current: An integer array of one-hot event indices with any shape S.
+      next_events: An integer array of one-hot event indices for the next
+          event at each lookback, with shape S + [num_lookbacks].
+      repeats: A boolean array with shape S + [num_lookbacks] indicating
+          whether the current event repeats each lookback.
+      positions: An integer array with shape S of positions in the event
+          sequences.
+
+    Returns:
+      A float32 array with shape S + [self.input_size], where each vector
+      equals the one returned by `events_to_input` for the same position.
+    """
+    num_classes = self._one_hot_encoding.num_classes
+    num_lookbacks = len(self._lookback_distances)
+    inputs = np.zeros(current.shape + (self.input_size,), dtype=np.float32)
+    flat_inputs = inputs.reshape(-1, self.input_size)
+    rows = np.arange(flat_inputs.shape[0])
+
+    # Current event and next event for each lookback.
+    flat_inputs[rows, current.ravel()] = 1.0
+    offsets = num_classes * np.arange(1, num_lookbacks + 1)
+    flat_next_events = next_events.reshape(len(rows), num_lookbacks) + offsets
+    flat_inputs[rows[:, np.newaxis], flat_next_events] = 1.0
+    offset = num_classes * (num_lookbacks + 1)
+
+    # Binary time counter giving the metric location of the *next* event.
+    bits = ((positions[..., np.newaxis] + 1) >>
+            np.arange(self._binary_counter_bits)) & 1
+    inputs[..., offset:offset + self._binary_counter_bits] = np.where(
+        bits, 1.0, -1.0)
+    offset += self._binary_counter_bits
+
+    # Current event is repeating N steps ago.
+    inputs[..., offset:] = repeats
+    return inputs
+
+  def events_to_inputs_array(self, events, positions=None):
+    """Returns an array of input vectors for positions in an event sequence.
+
+    This is an array-based equivalent of calling `events_to_input` for each
+    position. Each event is encoded at most once, and only the events needed
+    for the requested positions are encoded, so a single trailing position can
+    be updated cheaply as a sequence is extended.
+
+    Args:
+      events: A list-like sequence of events.
+      positions: A list-like sequence of integer positions in the event
+          sequence. If None, inputs are returned for every position.
+
+    Returns:
+      A float32 NumPy array with shape [len(positions), self.input_size].
+    """
+    if positions is None:
+      positions = np.arange(len(events), dtype=np.int64)
+    else:
+      positions = np.asarray(positions, dtype=np.int64).reshape(-1)
+    current, next_events, repeats = self._encode_positions(events, positions)
+    return self._build_inputs(current, next_events, repeats, positions)
+
+  def get_inputs_batch_array(self, event_sequences, full_length=False):
+    """Returns an inputs batch for the given event sequences as a NumPy array.
+
+    Args:
+      event_sequences: A list of list-like event sequences.
+      full_length: If True, the inputs batch will be for the full length of
+          each event sequence, which must all be the same length. If False,
+          the inputs batch will only be for the last event of each event
+          sequence.
+
+    Returns:
+      A float32 NumPy array. If `full_length` is True, the shape will be
+      [len(event_sequences), len(event_sequences[0]), self.input_size]. If
+      `full_length` is False, the shape will be
+      [len(event_sequences), 1, self.input_size].
+
+    Raises:
+      ValueError: If `full_length` is True and the event sequences are not all
+          the same length.
+    """
+    if not event_sequences:
+      return np.zeros((0, 0 if full_length else 1, self.input_size),
+                      dtype=np.float32)
+
+    if full_length:
+      lengths = set(len(events) for events in event_sequences)
+      if len(lengths) > 1:
+        raise ValueError(
+            'full-length inputs batch requires event sequences of equal '
+            'length, got lengths %s' % sorted(lengths))
+      num_steps = lengths.pop() if lengths else 0
+      positions = np.arange(num_steps, dtype=np.int64)
+      encoded = [self._encode_positions(events, positions)
+                 for events in event_sequences]
+      positions = np.tile(positions, (len(event_sequences), 1))
+    else:
+      encoded = [
+          self._encode_positions(
+              events, np.array([len(events) - 1], dtype=np.int64))
+          for events in event_sequences]
+      positions = np.array(
+          [[len(events) - 1] for events in event_sequences], dtype=np.int64)
+
+    num_lookbacks = len(self._lookback_distances)
+    current, next_events, repeats = [np.stack(arrays) for arrays in
+                                     zip(*encoded)]
+    return self._build_inputs(
+        current.reshape(positions.shape),
+        next_events.reshape(positions.shape + (num_lookbacks,)),
+        repeats.reshape(positions.shape + (num_lookbacks,)),
+        positions)
+
+  def get_inputs_batch(self, event_sequences, full_length=False):
+    """Returns an inputs batch for the given event sequences.
+
+    Uses the array-based encoder, but returns nested lists like
+    EventSequenceEncoderDecoder.get_inputs_batch so that callers can keep
+    modifying inputs in place.
+
+    Args:
+      event_sequences: A list of list-like event sequences.
+      full_length: If True, the inputs batch will be for the full length of
+          each event sequence. If False, the inputs batch will only be for the
+          last event of each event sequence.
+
+    Returns:
+      An inputs batch. If `full_length` is True, the shape will be
+      [len(event_sequences), len(event_sequences[0]), INPUT_SIZE]. If
+      `full_length` is False, the shape will be
+      [len(event_sequences), 1, INPUT_SIZE].
+    """
+    if full_length:
+      return [self.events_to_inputs_array(events).tolist()
+              for events in event_sequences]
+    return self.get_inputs_batch_array(event_sequences).tolist()
+
   def events_to_label(self, events, position):
     """Returns the label for the given position in the event sequence.
 
@@ -117,6 +117,24 @@ class OneHotEventSequenceEncoderDecoderTest(tf.test.TestCase):
     self.assertListEqual([np.log(0.5) + np.log(0.3),
                           np.log(0.4) + np.log(0.6)], p)
 
+  def testSampleClasses(self):
+    softmax = [[0.2, 0.3, 0.5], [0.0, 1.0, 0.0], [0.6, 0.0, 0.4]]
+    np.random.seed(0)
+    expected_classes = [np.random.choice(3, p=p) for p in softmax]
+    np.random.seed(0)
+    self.assertListEqual(
+        expected_classes, self.enc.sample_classes(softmax).tolist())
+
+  def testEvaluateLogLikelihoodArray(self):
+    event_sequences = [[0, 1, 0], [1, 2, 2]]
+    softmax = np.array([[[0.0, 0.5, 0.5], [0.3, 0.4, 0.3]],
+                        [[0.0, 0.6, 0.4], [0.0, 0.4, 0.6]]])
+    p = self.enc.evaluate_log_likelihood(event_sequences, softmax)
+    self.assertAllClose([np.log(0.5) + np.log(0.3),
+                         np.log(0.4) + np.log(0.6)], p)
+    p = self.enc.evaluate_log_likelihood(event_sequences, softmax[:, 1:])
+    self.assertAllClose([np.log(0.3), np.log(0.6)], p)
+
 
 class LookbackEventSequenceEncoderDecoderTest(tf.test.TestCase):
 
@@ -191,6 +209,54 @@ class LookbackEventSequenceEncoderDecoderTest(tf.test.TestCase):
     labels = [0, 1, 3, 2, 4]
     self.assertEqual(5, self.enc.labels_to_num_steps(labels))
 
+  def testEventsToInputsArray(self):
+    events = [0, 1, 0, 2, 0, 0, 1]
+    expected_inputs = [self.enc.events_to_input(events, i)
+                       for i in range(len(events))]
+    self.assertListEqual(
+        expected_inputs, self.enc.events_to_inputs_array(events).tolist())
+    self.assertListEqual(
+        [expected_inputs[3], expected_inputs[6]],
+        self.enc.events_to_inputs_array(events, [3, 6]).tolist())
+
+  def testGetInputsBatch(self):
+    event_sequences = [[0, 1, 0, 2, 0], [2, 2, 1]]
+    expected_full_length_inputs_batch = [
+        [self.enc.events_to_input(events, i) for i in range(len(events))]
+        for events in event_sequences]
+    expected_last_event_inputs_batch = [
+        [self.enc.events_to_input(events, len(events) - 1)]
+        for events in event_sequences]
+    self.assertListEqual(
+        expected_full_length_inputs_batch,
+        self.enc.get_inputs_batch(event_sequences, True))
+    self.assertListEqual(
+        expected_last_event_inputs_batch,
+        self.enc.get_inputs_batch(event_sequences))
+
+  def testGetInputsBatchArray(self):
+    event_sequences = [[0, 1, 0, 2, 0], [2, 2, 1, 1, 1]]
+    inputs_batch = self.enc.get_inputs_batch_array(event_sequences, True)
+    self.assertEqual((2, 5, 13), inputs_batch.shape)
+    for events, inputs in zip(event_sequences, inputs_batch):
+      self.assertListEqual(
+          [self.enc.events_to_input(events, i) for i in range(len(events))],
+          inputs.tolist())
+
+    # Extend each sequence one step at a time, updating only the last input.
+    for event in [1, 0, 2]:
+      for events in event_sequences:
+        events.append(event)
+      inputs_batch = self.enc.get_inputs_batch_array(event_sequences)
+      self.assertEqual((2, 1, 13), inputs_batch.shape)
+      for events, inputs in zip(event_sequences, inputs_batch):
+        self.assertListEqual(
+            [self.enc.events_to_input(events, len(events) - 1)],
+            inputs.tolist())
+
+    with self.assertRaises(ValueError):
+      self.enc.get_inputs_batch_array([[0, 1], [0]], True)
+
   def testEmptyLookback(self):
     enc = encoder_decoder.LookbackEventSequenceEncoderDecoder(
         testing_lib.TrivialOneHotEncoding(3), [], 2)
@@ -209,6 +275,9 @@ class LookbackEventSequenceEncoderDecoderTest(tf.test.TestCase):
                      enc.events_to_input(events, 3))
     self.assertEqual([1.0, 0.0, 0.0, 1.0, -1.0],
                      enc.events_to_input(events, 4))
+    self.assertListEqual(
+        [enc.events_to_input(events, i) for i in range(len(events))],
+        enc.events_to_inputs_array(events).tolist())
 
     self.assertEqual(0, enc.events_to_label(events, 0))
     self.assertEqual(1, enc.events_to_label(events, 1))
@@ -19,11 +19,13 @@ Provides a uniform interface for interacting with generators for any model.
 import abc
 import os
 import tempfile
+import threading
 
 # internal imports
 
 import tensorflow as tf
 
+from magenta.common import concurrency
 from magenta.protobuf import generator_pb2
 
 
@@ -79,6 +81,7 @@ class BaseSequenceGenerator(object):
                       self._details.id))
 
     self._initialized = False
+    self._lock = threading.RLock()
 
   @property
   def details(self):
@@ -108,10 +111,12 @@ class BaseSequenceGenerator(object):
     """
     pass
 
+  @concurrency.serialized
   def initialize(self):
     """Builds the TF graph and loads the checkpoint.
 
-    If the graph has already been initialized, this is a no-op.
+    If the graph has already been initialized, this is a no-op. This method is
+    threadsafe, so `generate` may be called concurrently from multiple threads.
 
     Raises:
       SequenceGeneratorException: If the checkpoint cannot be found.
@@ -161,6 +166,7 @@ class BaseSequenceGenerator(object):
           tf.gfile.DeleteRecursively(tempdir)
     self._initialized = True
 
+  @concurrency.serialized
   def close(self):
     """Closes the TF session.
 
@@ -16,7 +16,7 @@
 import collections
 import copy
 import itertools
-from operator import itemgetter
+from operator import attrgetter
 
 # internal imports
 import numpy as np
@@ -67,6 +67,248 @@ class QuantizationStatusException(Exception):
   """
   pass
 
+class NoteArray(object):
+  """Columnar representation of the notes in a NoteSequence.
+
+  Each note attribute is stored as a NumPy array, which allows transformations
+  to be applied to all notes at once rather than one protobuf field at a time.
+  This is considerably faster for long sequences like piano performances.
+
+  The `index` array holds the position of each note in the NoteSequence it was
+  created from. It is used by `to_sequence` to carry over note fields that are
+  not represented here (e.g. `numerator` or `voice`).
+  """
+
+  _COLUMNS = ('pitch', 'velocity', 'start_time', 'end_time', 'instrument',
+              'program', 'is_drum')
+
+  def __init__(self, pitch, velocity, start_time, end_time, instrument,
+               program, is_drum, index=None):
+    """Construct a NoteArray.
+
+    Args:
+      pitch: A 1-D array of note pitches.
+      velocity: A 1-D array of note velocities.
+      start_time: A 1-D array of note start times in seconds.
+      end_time: A 1-D array of note end times in seconds.
+      instrument: A 1-D array of note instruments.
+      program: A 1-D array of note programs.
+      is_drum: A 1-D array of booleans indicating whether each note is a drum.
+      index: An optional 1-D array of note indices into the source
+          NoteSequence. If None, notes are assumed to be in source order.
+
+    Raises:
+      ValueError: If the arrays do not all have the same length.
+    """
+    self.pitch = np.asarray(pitch, dtype=np.int32)
+    self.velocity = np.asarray(velocity, dtype=np.int32)
+    self.start_time = np.asarray(start_time, dtype=np.float64)
+    self.end_time = np.asarray(end_time, dtype=np.float64)
+    self.instrument = np.asarray(instrument, dtype=np.int32)
+    self.program = np.asarray(program, dtype=np.int32)
+    self.is_drum = np.asarray(is_drum, dtype=np.bool_)
+    if index is None:
+      index = np.arange(len(self.pitch))
+    self.index = np.asarray(index, dtype=np.int64)
+
+    if any(len(getattr(self, column)) != len(self.index)
+           for column in self._COLUMNS):
+      raise ValueError('All note arrays must have the same length.')
+
+  @classmethod
+  def from_sequence(cls, sequence):
+    """Creates a NoteArray from the notes of a NoteSequence.
+
+    Args:
+      sequence: The NoteSequence whose notes to convert.
+
+    Returns:
+      A NoteArray containing the notes of `sequence`, in order.
+    """
+    rows = list(map(attrgetter(*cls._COLUMNS), sequence.notes))
+    columns = np.array(rows, dtype=np.float64).reshape(
+        len(rows), len(cls._COLUMNS)).T
+    return cls(*columns)
+
+  def __len__(self):
+    return len(self.index)
+
+  def _take(self, indices):
+    """Returns a new NoteArray with only the notes at `indices`."""
+    return NoteArray(
+        *[getattr(self, column)[indices] for column in self._COLUMNS],
+        index=self.index[indices])
+
+  def _replace(self, **columns):
+    """Returns a new NoteArray with the specified columns replaced."""
+    values = [columns.get(column, getattr(self, column))
+              for column in self._COLUMNS]
+    return NoteArray(*values, index=self.index)
+
+  def write_notes(self, notes, source_notes=None):
+    """Appends these notes to a repeated field of Note protos.
+
+    Args:
+      notes: The repeated `notes` field of a NoteSequence to append to.
+      source_notes: The notes of the NoteSequence this NoteArray was created
+          from. If provided, each note is copied from its source note before
+          the columns are written, preserving fields not stored in the
+          NoteArray.
+    """
+    columns = [getattr(self, column).tolist() for column in self._COLUMNS]
+    for (index, pitch, velocity, start_time, end_time, instrument, program,
+         is_drum) in zip(self.index.tolist(), *columns):
+      note = notes.add()
+      if source_notes is not None:
+        note.CopyFrom(source_notes[index])
+      note.pitch = pitch
+      note.velocity = velocity
+      note.start_time = start_time
+      note.end_time = end_time
+      note.instrument = instrument
+      note.program = program
+      note.is_drum = is_drum
+
+  def to_sequence(self, source_sequence, total_time=None):
+    """Creates a copy of a NoteSequence with its notes replaced by these notes.
+
+    All fields of `source_sequence` other than its notes are copied unchanged.
+
+    Args:
+      source_sequence: The NoteSequence this NoteArray was created from.
+      total_time: If not None, the total time of the new NoteSequence.
+          Otherwise the total time of `source_sequence` is used.
+
+    Returns:
+      A new NoteSequence.
+    """
+    sequence = music_pb2.NoteSequence()
+    sequence.CopyFrom(source_sequence)
+    del sequence.notes[:]
+    self.write_notes(sequence.notes, source_notes=source_sequence.notes)
+    if total_time is not None:
+      sequence.total_time = total_time
+    return sequence
+
+  def max_end_time(self):
+    """Returns the latest note end time, or 0.0 if there are no notes."""
+    return float(self.end_time.max()) if len(self) else 0.0
+
+  def stretch(self, stretch_factor):
+    """Returns a new NoteArray with all note times scaled by `stretch_factor`.
+
+    See `stretch_note_sequence` for details.
+    """
+    return self._replace(start_time=self.start_time * stretch_factor,
+                         end_time=self.end_time * stretch_factor)
+
+  def trim(self, start_time, end_time):
+    """Returns a new NoteArray with notes trimmed to a time range.
+
+    Notes starting before `start_time` or at or after `end_time` are removed.
+    Notes ending after `end_time` are truncated. See `trim_note_sequence`.
+
+    Args:
+      start_time: The float time in seconds after which all notes should begin.
+      end_time: The float time in seconds before which all notes should end.
+
+    Returns:
+      A new NoteArray.
+    """
+    keep = np.flatnonzero((self.start_time >= start_time) &
+                          (self.start_time < end_time))
+    trimmed = self._take(keep)
+    return trimmed._replace(end_time=np.minimum(trimmed.end_time, end_time))
+
+  def extract_subsequences(self, split_times):
+    """Extracts the notes of each subsequence between consecutive split times.
+
+    Notes are assigned to the subsequence in which they start, truncated to
+    end no later than the end of that subsequence, and shifted so that the
+    subsequence starts at time zero. Within each subsequence notes are ordered
+    by start time. See `extract_subsequence` for details.
+
+    Args:
+      split_times: A sorted list of times in seconds at which to split.
+
+    Returns:
+      A list of `len(split_times) - 1` NoteArrays.
+    """
+    split_times = np.asarray(split_times, dtype=np.float64)
+    order = np.argsort(self.start_time, kind='mergesort')
+    start_times = self.start_time[order]
+    # Since the notes are sorted by start time, the notes in each subsequence
+    # form a contiguous range.
+    subsequence_indices = np.searchsorted(
+        split_times, start_times, side='right') - 1
+    bounds = np.searchsorted(
+        subsequence_indices, np.arange(len(split_times)), side='left')
+
+    subsequences = []
+    for i in range(len(split_times) - 1):
+      subsequence = self._take(order[bounds[i]:bounds[i + 1]])
+      subsequences.append(subsequence._replace(
+          start_time=subsequence.start_time - split_times[i],
+          end_time=(np.minimum(subsequence.end_time, split_times[i + 1]) -
+                    split_times[i])))
+    return subsequences
+
+  def extract(self, start_time, end_time):
+    """Extracts the notes between `start_time` and `end_time`.
+
+    Args:
+      start_time: The float time in seconds to start the subsequence.
+      end_time: The float time in seconds to end the subsequence.
+
+    Returns:
+      A new NoteArray with the notes starting within the time range, truncated
+      to end by `end_time` and shifted to start at time zero.
+    """
+    return self.extract_subsequences([start_time, end_time])[0]
+
+  def apply_sustain(self, sustain_times, sustain_instruments, sustain_on):
+    """Applies sustain pedal events to these notes.
+
+    See `apply_sustain_control_changes` for details.
+
+    Args:
+      sustain_times: A 1-D array of sustain pedal event times in seconds.
+      sustain_instruments: A 1-D array of sustain pedal event instruments.
+      sustain_on: A 1-D boolean array indicating whether each sustain pedal
+          event is an ON (True) or OFF (False) event.
+
+    Returns:
+      A new NoteArray with note end times extended to account for sustain.
+      Notes that end up with zero duration because another note of the same
+      pitch started at the same time are removed.
+    """
+    end_times, removed, _ = _sustain_sweep(
+        self, sustain_times, sustain_instruments, sustain_on, total_time=0.0)
+    result = self._replace(end_time=end_times)
+    return result._take(np.flatnonzero(~removed))
+
+  def quantized_steps(self, steps_per_second,
+                      quantize_cutoff=QUANTIZE_CUTOFF):
+    """Quantizes note start and end times to steps.
+
+    Notes that would have zero duration are extended by one step, as in
+    `quantize_note_sequence`.
+
+    Args:
+      steps_per_second: Quantizing resolution.
+      quantize_cutoff: Value to use for quantizing cutoff.
+
+    Returns:
+      A tuple of 1-D int64 arrays containing the quantized start and end step
+      of each note.
+    """
+    start_steps = _quantize_times_to_steps(
+        self.start_time, steps_per_second, quantize_cutoff)
+    end_steps = _quantize_times_to_steps(
+        self.end_time, steps_per_second, quantize_cutoff)
+    end_steps[end_steps == start_steps] += 1
+    return start_steps, end_steps
+
 
 def trim_note_sequence(sequence, start_time, end_time):
   """Trim notes from a NoteSequence to lie within a specified time range.
@@ -798,6 +1040,27 @@ def quantize_to_step(unquantized_seconds, steps_per_second,
   return int(unquantized_steps + (1 - quantize_cutoff))
 
 
+def _quantize_times_to_steps(unquantized_seconds, steps_per_second,
+                             quantize_cutoff=QUANTIZE_CUTOFF):
+  """Quantizes an array of times in seconds to steps.
+
+  This is the vectorized equivalent of `quantize_to_step`, and gives identical
+  results.
+
+  Args:
+    unquantized_seconds: A 1-D array of times in seconds.
+    steps_per_second: Quantizing resolution.
+    quantize_cutoff: Value to use for quantizing cutoff.
+
+  Returns:
+    A 1-D int64 array of quantized steps.
+  """
+  unquantized_steps = (
+      np.asarray(unquantized_seconds, dtype=np.float64) * steps_per_second)
+  # Casting to int truncates towards zero, just like `int`.
+  return (unquantized_steps + (1 - quantize_cutoff)).astype(np.int64)
+
+
 def steps_per_quarter_to_steps_per_second(steps_per_quarter, qpm):
   """Calculates steps per second given steps_per_quarter and a qpm."""
   return steps_per_quarter * qpm / 60.0
@@ -820,33 +1083,40 @@ def _quantize_notes(note_sequence, steps_per_second):
   Raises:
     NegativeTimeException: If a note or chord occurs at a negative time.
   """
-  for note in note_sequence.notes:
-    # Quantize the start and end times of the note.
-    note.quantized_start_step = quantize_to_step(
-        note.start_time, steps_per_second)
-    note.quantized_end_step = quantize_to_step(
-        note.end_time, steps_per_second)
-    if note.quantized_end_step == note.quantized_start_step:
-      note.quantized_end_step += 1
-
-    # Do not allow notes to start or end in negative time.
-    if note.quantized_start_step < 0 or note.quantized_end_step < 0:
-      raise NegativeTimeException(
-          'Got negative note time: start_step = %s, end_step = %s' %
-          (note.quantized_start_step, note.quantized_end_step))
-
-    # Extend quantized sequence if necessary.
-    if note.quantized_end_step > note_sequence.total_quantized_steps:
-      note_sequence.total_quantized_steps = note.quantized_end_step
+  # Quantize the start and end times of all notes at once.
+  start_steps, end_steps = NoteArray.from_sequence(
+      note_sequence).quantized_steps(steps_per_second)
+
+  # Do not allow notes to start or end in negative time.
+  negative = np.flatnonzero((start_steps < 0) | (end_steps < 0))
+  if negative.size:
+    raise NegativeTimeException(
+        'Got negative note time: start_step = %s, end_step = %s' %
+        (start_steps[negative[0]], end_steps[negative[0]]))
+
+  for note, start_step, end_step in zip(
+      note_sequence.notes, start_steps.tolist(), end_steps.tolist()):
+    note.quantized_start_step = start_step
+    note.quantized_end_step = end_step
+
+  # Extend quantized sequence if necessary.
+  if end_steps.size and end_steps.max() > note_sequence.total_quantized_steps:
+    note_sequence.total_quantized_steps = int(end_steps.max())
 
   # Also quantize control changes and text annotations.
-  for event in itertools.chain(
-      note_sequence.control_changes, note_sequence.text_annotations):
-    # Quantize the event time, disallowing negative time.
-    event.quantized_step = quantize_to_step(event.time, steps_per_second)
-    if event.quantized_step < 0:
-      raise NegativeTimeException(
-          'Got negative event time: step = %s' % event.quantized_step)
+  events = list(itertools.chain(
+      note_sequence.control_changes, note_sequence.text_annotations))
+  event_steps = _quantize_times_to_steps(
+      [event.time for event in events], steps_per_second)
+
+  # Disallow negative time.
+  negative = np.flatnonzero(event_steps < 0)
+  if negative.size:
+    raise NegativeTimeException(
+        'Got negative event time: step = %s' % event_steps[negative[0]])
+
+  for event, step in zip(events, event_steps.tolist()):
+    event.quantized_step = step
 
 
 def quantize_note_sequence(note_sequence, steps_per_quarter):
@@ -1057,6 +1327,111 @@ _NOTE_ON = 2
 _NOTE_OFF = 3
 
 
+def _sustain_sweep(notes, sustain_times, sustain_instruments, sustain_on,
+                   total_time):
+  """Computes note end times after applying sustain pedal events.
+
+  Note on/off and sustain on/off events are sorted by time once, and then
+  processed in a single sweep. Active notes are tracked per instrument and per
+  (instrument, pitch), so that starting a note under sustain only needs to
+  look at previous notes of the same pitch.
+
+  Events are ordered by time only. Simultaneous events keep their insertion
+  order: all note on events, then all note off events, then all sustain
+  events.
+
+  Args:
+    notes: A NoteArray.
+    sustain_times: A 1-D array of sustain pedal event times in seconds.
+    sustain_instruments: A 1-D array of sustain pedal event instruments.
+    sustain_on: A 1-D boolean array indicating whether each sustain pedal
+        event is an ON (True) or OFF (False) event.
+    total_time: The total time of the sequence before applying sustain.
+
+  Returns:
+    A tuple of the new 1-D array of note end times, a 1-D boolean array
+    indicating which notes should be removed, and the new total time.
+  """
+  num_notes = len(notes)
+  sustain_times = np.asarray(sustain_times, dtype=np.float64)
+  sustain_on = np.asarray(sustain_on, dtype=np.bool_)
+
+  times = np.concatenate([notes.start_time, notes.end_time, sustain_times])
+  event_types = np.concatenate([
+      np.full(num_notes, _NOTE_ON, dtype=np.int32),
+      np.full(num_notes, _NOTE_OFF, dtype=np.int32),
+      np.where(sustain_on, _SUSTAIN_ON, _SUSTAIN_OFF).astype(np.int32)])
+  event_indices = np.concatenate([
+      np.arange(num_notes), np.arange(num_notes),
+      np.arange(len(sustain_times))])
+  order = np.argsort(times, kind='mergesort')
+
+  start_times = notes.start_time.tolist()
+  end_times = notes.end_time.tolist()
+  pitches = notes.pitch.tolist()
+  instruments = notes.instrument.tolist()
+  sustain_instruments = np.asarray(
+      sustain_instruments, dtype=np.int32).tolist()
+  removed = np.zeros(num_notes, dtype=np.bool_)
+
+  # Active notes keyed by instrument, and keyed by (instrument, pitch).
+  active_notes = collections.defaultdict(set)
+  active_pitch_notes = collections.defaultdict(list)
+  # Instruments for which sustain is active.
+  sus_active = set()
+
+  time = 0
+  for time, event_type, i in zip(times[order].tolist(),
+                                 event_types[order].tolist(),
+                                 event_indices[order].tolist()):
+    if event_type == _SUSTAIN_ON:
+      sus_active.add(sustain_instruments[i])
+    elif event_type == _SUSTAIN_OFF:
+      instrument = sustain_instruments[i]
+      sus_active.discard(instrument)
+      # End all notes for the instrument that were being extended.
+      for j in [j for j in active_notes[instrument] if end_times[j] < time]:
+        end_times[j] = time
+        if time > total_time:
+          total_time = time
+        active_notes[instrument].remove(j)
+        active_pitch_notes[(instrument, pitches[j])].remove(j)
+    elif event_type == _NOTE_ON:
+      instrument = instruments[i]
+      key = (instrument, pitches[i])
+      if instrument in sus_active:
+        # If sustain is on, end all previous notes with the same pitch.
+        for j in active_pitch_notes[key]:
+          end_times[j] = time
+          if start_times[j] == time:
+            # This note now has no duration because another note of the same
+            # pitch started at the same time, so remove it.
+            removed[j] = True
+          active_notes[instrument].remove(j)
+        active_pitch_notes[key] = []
+      active_notes[instrument].add(i)
+      active_pitch_notes[key].append(i)
+    elif event_type == _NOTE_OFF:
+      instrument = instruments[i]
+      # If sustain is on, the note continues until another note of the same
+      # pitch or sustain ends. Otherwise remove it from the active notes,
+      # unless it was already removed by a note of the same pitch played while
+      # sustain was active.
+      if instrument not in sus_active and i in active_notes[instrument]:
+        active_notes[instrument].remove(i)
+        active_pitch_notes[(instrument, pitches[i])].remove(i)
+    else:
+      raise AssertionError('Invalid event_type: %s' % event_type)
+
+  # End any notes that were still active due to sustain.
+  for instrument_notes in active_notes.values():
+    for j in instrument_notes:
+      end_times[j] = time
+      total_time = time
+
+  return np.array(end_times, dtype=np.float64), removed, total_time
+
+
 def apply_sustain_control_changes(note_sequence, sustain_control_number=64):
   """Returns a new NoteSequence with sustain pedal control changes applied.
 
@@ -1085,95 +1460,30 @@ def apply_sustain_control_changes(note_sequence, sustain_control_number=64):
     raise QuantizationStatusException(
         'Can only apply sustain to unquantized NoteSequence.')
 
-  sequence = copy.deepcopy(note_sequence)
-
-  # Sort all note on/off and sustain on/off events.
-  events = []
-  events.extend([(note.start_time, _NOTE_ON, note)
-                 for note in sequence.notes])
-  events.extend([(note.end_time, _NOTE_OFF, note)
-                 for note in sequence.notes])
+  notes = NoteArray.from_sequence(note_sequence)
 
-  for cc in sequence.control_changes:
-    if cc.control_number != sustain_control_number:
-      continue
-    value = cc.control_value
-    if value < 0 or value > 127:
+  sustain_events = [cc for cc in note_sequence.control_changes
+                    if cc.control_number == sustain_control_number]
+  for cc in sustain_events:
+    if cc.control_value < 0 or cc.control_value > 127:
       tf.logging.warn(
-          'Sustain control change has out of range value: %d', value)
-    if value >= 64:
-      events.append((cc.time, _SUSTAIN_ON, cc))
-    elif value < 64:
-      events.append((cc.time, _SUSTAIN_OFF, cc))
-
-  # Sort, using the event type constants to ensure the order events are
-  # processed.
-  events.sort(key=itemgetter(0))
-
-  # Lists of active notes, keyed by instrument.
-  active_notes = collections.defaultdict(list)
-  # Whether sustain is active for a given instrument.
-  sus_active = collections.defaultdict(lambda: False)
-
-  # Iterate through all sustain on/off and note on/off events in order.
-  time = 0
-  for time, event_type, event in events:
-    if event_type == _SUSTAIN_ON:
-      sus_active[event.instrument] = True
-    elif event_type == _SUSTAIN_OFF:
-      sus_active[event.instrument] = False
-      # End all notes for the instrument that were being extended.
-      new_active_notes = []
-      for note in active_notes[event.instrument]:
-        if note.end_time < time:
-          # This note was being extended because of sustain.
-          # Update the end time and don't keep it in the list.
-          note.end_time = time
-          if time > sequence.total_time:
-            sequence.total_time = time
-        else:
-          # This note is actually still active, keep it.
-          new_active_notes.append(note)
-      active_notes[event.instrument] = new_active_notes
-    elif event_type == _NOTE_ON:
-      if sus_active[event.instrument]:
-        # If sustain is on, end all previous notes with the same pitch.
-        new_active_notes = []
-        for note in active_notes[event.instrument]:
-          if note.pitch == event.pitch:
-            note.end_time = time
-            if note.start_time == note.end_time:
-              # This note now has no duration because another note of the same
-              # pitch started at the same time. Only one of these notes should
-              # be preserved, so delete this one.
-              # TODO(fjord): A more correct solution would probably be to
-              # preserve both notes and make the same duration, but that is a
-              # little more complicated to implement. Will keep this solution
-              # until we find that we need the more complex one.
-              sequence.notes.remove(note)
-          else:
-            new_active_notes.append(note)
-        active_notes[event.instrument] = new_active_notes
-      # Add this new note to the list of active notes.
-      active_notes[event.instrument].append(event)
-    elif event_type == _NOTE_OFF:
-      if sus_active[event.instrument]:
-        # Note continues until another note of the same pitch or sustain ends.
-        pass
-      else:
-        # Remove this particular note from the active list.
-        # It may have already been removed if a note of the same pitch was
-        # played when sustain was active.
-        if event in active_notes[event.instrument]:
-          active_notes[event.instrument].remove(event)
-    else:
-      raise AssertionError('Invalid event_type: %s' % event_type)
+          'Sustain control change has out of range value: %d',
+          cc.control_value)
+  sustain_times = [cc.time for cc in sustain_events]
+  sustain_instruments = [cc.instrument for cc in sustain_events]
+  sustain_on = [cc.control_value >= 64 for cc in sustain_events]
 
-  # End any notes that were still active due to sustain.
-  for instrument in active_notes.values():
-    for note in instrument:
-      note.end_time = time
-      sequence.total_time = time
+  end_times, removed, total_time = _sustain_sweep(
+      notes, sustain_times, sustain_instruments, sustain_on,
+      note_sequence.total_time)
+
+  # Only write back the notes that were actually modified.
+  sequence = copy.deepcopy(note_sequence)
+  for i in np.flatnonzero(end_times != notes.end_time).tolist():
+    sequence.notes[i].end_time = float(end_times[i])
+  for i in reversed(np.flatnonzero(removed).tolist()):
+    del sequence.notes[i]
+  sequence.total_time = total_time
 
   return sequence
 
@@ -785,6 +785,47 @@ class SequencesLibTest(tf.test.TestCase):
     self.assertEqual(
         33, sequences_lib.quantize_to_step(8.4999, 4, quantize_cutoff=1.0))
 
+  def testQuantizeNoteSequenceMatchesQuantizeToStep(self):
+    times = [0.0, 0.01, 0.1249, 0.125, 0.1251, 0.37, 1.0 / 3, 2.0 / 3, 7.99,
+             8.0001, 8.4999, 123.456]
+    testing_lib.add_track_to_sequence(
+        self.note_sequence, 0,
+        [(60, 100, start_time, start_time + 0.03) for start_time in times])
+    testing_lib.add_chords_to_sequence(
+        self.note_sequence, [('C', time) for time in times])
+
+    quantized_sequence = sequences_lib.quantize_note_sequence(
+        self.note_sequence, steps_per_quarter=self.steps_per_quarter)
+
+    max_end_step = sequences_lib.quantize_to_step(
+        self.note_sequence.total_time, 4)
+    for note, expected_note in zip(quantized_sequence.notes,
+                                   self.note_sequence.notes):
+      start_step = sequences_lib.quantize_to_step(expected_note.start_time, 4)
+      end_step = sequences_lib.quantize_to_step(expected_note.end_time, 4)
+      if end_step == start_step:
+        end_step += 1
+      self.assertEqual(start_step, note.quantized_start_step)
+      self.assertEqual(end_step, note.quantized_end_step)
+      max_end_step = max(max_end_step, end_step)
+    for annotation, time in zip(quantized_sequence.text_annotations, times):
+      self.assertEqual(sequences_lib.quantize_to_step(time, 4),
+                       annotation.quantized_step)
+    self.assertEqual(max_end_step, quantized_sequence.total_quantized_steps)
+
+  def testQuantizeNoteSequenceNegativeTime(self):
+    sequence = copy.deepcopy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0, [(60, 100, 0.0, 1.0), (61, 100, -1.0, 1.0)])
+    with self.assertRaises(sequences_lib.NegativeTimeException):
+      sequences_lib.quantize_note_sequence(sequence, self.steps_per_quarter)
+
+    sequence = copy.deepcopy(self.note_sequence)
+    testing_lib.add_track_to_sequence(sequence, 0, [(60, 100, 0.0, 1.0)])
+    testing_lib.add_chords_to_sequence(sequence, [('C', -1.0)])
+    with self.assertRaises(sequences_lib.NegativeTimeException):
+      sequences_lib.quantize_note_sequence_absolute(sequence, 4)
+
   def testFromNoteSequence_TempoChange(self):
     testing_lib.add_track_to_sequence(
         self.note_sequence, 0,
@@ -1280,5 +1321,124 @@ class SequencesLibTest(tf.test.TestCase):
 
     self.assertEqual(sequence, expanded)
 
+  def testNoteArrayFromSequence(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0, [(60, 100, 0.0, 1.0), (72, 80, 0.5, 2.0)])
+    testing_lib.add_track_to_sequence(
+        sequence, 9, [(36, 127, 1.0, 1.1)], is_drum=True, program=3)
+    sequence.notes[0].voice = 2
+
+    notes = sequences_lib.NoteArray.from_sequence(sequence)
+    self.assertEqual(3, len(notes))
+    self.assertAllEqual([60, 72, 36], notes.pitch)
+    self.assertAllEqual([100, 80, 127], notes.velocity)
+    self.assertAllEqual([0.0, 0.5, 1.0], notes.start_time)
+    self.assertAllEqual([1.0, 2.0, 1.1], notes.end_time)
+    self.assertAllEqual([0, 0, 9], notes.instrument)
+    self.assertAllEqual([0, 0, 3], notes.program)
+    self.assertAllEqual([False, False, True], notes.is_drum)
+    self.assertAllEqual([0, 1, 2], notes.index)
+
+    self.assertProtoEquals(sequence, notes.to_sequence(sequence))
+
+  def testNoteArrayEmpty(self):
+    notes = sequences_lib.NoteArray.from_sequence(self.note_sequence)
+    self.assertEqual(0, len(notes))
+    self.assertEqual(0.0, notes.max_end_time())
+    self.assertProtoEquals(self.note_sequence,
+                           notes.to_sequence(self.note_sequence))
+
+  def testNoteArrayStretch(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(12, 100, 0.0, 10.0), (11, 55, 0.2, 0.5), (40, 45, 2.5, 3.5)])
+
+    stretched = sequences_lib.NoteArray.from_sequence(sequence).stretch(1.5)
+    expected = sequences_lib.stretch_note_sequence(sequence, 1.5)
+    self.assertAllEqual([note.start_time for note in expected.notes],
+                        stretched.start_time)
+    self.assertAllEqual([note.end_time for note in expected.notes],
+                        stretched.end_time)
+
+  def testNoteArrayTrim(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(12, 100, 0.01, 10.0), (11, 55, 0.22, 0.50), (40, 45, 2.50, 3.50),
+         (55, 120, 4.0, 4.01), (52, 99, 4.75, 5.0)])
+
+    trimmed = sequences_lib.NoteArray.from_sequence(sequence).trim(2.5, 4.75)
+    self.assertAllEqual([2, 3], trimmed.index)
+    self.assertProtoEquals(
+        sequences_lib.trim_note_sequence(sequence, 2.5, 4.75),
+        trimmed.to_sequence(sequence, total_time=4.75))
+
+  def testNoteArrayExtractSubsequences(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(52, 99, 4.75, 5.0), (12, 100, 0.01, 10.0), (11, 55, 0.22, 0.50),
+         (40, 45, 2.50, 3.50), (55, 120, 4.0, 4.01)])
+    split_times = [0.2, 2.5, 4.75, 5.5]
+
+    notes = sequences_lib.NoteArray.from_sequence(sequence)
+    subsequences = notes.extract_subsequences(split_times)
+    expected_subsequences = [
+        sequences_lib.extract_subsequence(sequence, start_time, end_time)
+        for start_time, end_time in zip(split_times[:-1], split_times[1:])]
+    self.assertEqual(3, len(subsequences))
+    for subsequence, expected in zip(subsequences, expected_subsequences):
+      self.assertEqual(list(expected.notes),
+                       list(subsequence.to_sequence(sequence).notes))
+      self.assertAlmostEqual(expected.total_time, subsequence.max_end_time())
+
+    extracted = notes.extract(2.5, 4.75)
+    self.assertAllEqual([3, 4], extracted.index)
+    self.assertAllClose([0.0, 1.5], extracted.start_time)
+    self.assertAllClose([1.0, 1.51], extracted.end_time)
+
+  def testNoteArrayApplySustain(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_control_changes_to_sequence(
+        sequence, 0, [(1.0, 64, 127), (4.0, 64, 0)])
+    testing_lib.add_control_changes_to_sequence(
+        sequence, 1, [(0.5, 64, 127)])
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(60, 100, 0.25, 1.50), (60, 100, 1.25, 1.50), (72, 100, 2.00, 3.50),
+         (60, 100, 2.0, 3.00), (60, 100, 3.50, 4.50), (64, 100, 5.0, 6.0)])
+    testing_lib.add_track_to_sequence(
+        sequence, 1,
+        [(48, 100, 1.0, 2.0), (48, 100, 1.0, 2.0), (50, 100, 1.0, 3.0)])
+
+    notes = sequences_lib.NoteArray.from_sequence(sequence)
+    sustained = notes.apply_sustain(
+        sustain_times=[1.0, 4.0, 0.5], sustain_instruments=[0, 0, 1],
+        sustain_on=[True, False, True])
+
+    expected = sequences_lib.apply_sustain_control_changes(sequence)
+    self.assertAllEqual([0, 1, 2, 3, 4, 5, 7, 8], sustained.index)
+    self.assertAllEqual([note.end_time for note in expected.notes],
+                        sustained.end_time)
+    self.assertAllEqual([1.25, 2.0, 4.0, 3.5, 4.5, 6.0, 6.0, 6.0],
+                        sustained.end_time)
+
+  def testNoteArrayQuantizedSteps(self):
+    sequence = copy.copy(self.note_sequence)
+    testing_lib.add_track_to_sequence(
+        sequence, 0,
+        [(12, 100, 0.01, 0.24), (11, 55, 0.22, 0.55), (40, 45, 0.50, 3.50),
+         (55, 120, 4.0, 4.01), (52, 99, 4.75, 5.0)])
+
+    notes = sequences_lib.NoteArray.from_sequence(sequence)
+    start_steps, end_steps = notes.quantized_steps(steps_per_second=4)
+    expected = sequences_lib.quantize_note_sequence_absolute(sequence, 4)
+    self.assertAllEqual(
+        [note.quantized_start_step for note in expected.notes], start_steps)
+    self.assertAllEqual(
+        [note.quantized_end_step for note in expected.notes], end_steps)
+
 if __name__ == '__main__':
   tf.test.main()
@@ -33,11 +33,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import itertools
+import multiprocessing
+import sys
+import threading
+import time
 
 # internal imports
 import six
+from six.moves import queue as Queue
 from magenta.pipelines import pipeline
+from magenta.pipelines import statistics
 
 
 class DagOutput(object):
@@ -383,6 +390,9 @@ class DAGPipeline(pipeline.Pipeline):
     call_list.reverse()
     assert call_list[0] == self.input
 
+    # Counters of the most recent `transform_stream`.
+    self.stage_counters = {}
+
   def _expand_dag_shorthands(self, dag):
     """Expand DAG shorthand.
 
@@ -489,8 +499,10 @@ class DAGPipeline(pipeline.Pipeline):
       collection. See get_output_names method.
     """
     def stats_accumulator(unit, unit_inputs, cumulative_stats):
+      profile_name = '%s_%s' % (self.name, unit.name)
       for single_input in unit_inputs:
-        results_ = unit.transform(single_input)
+        results_ = pipeline.profiled_transform(
+            unit, single_input, self._profile, profile_name)
         stats = unit.get_stats()
         cumulative_stats.extend(stats)
         yield results_
@@ -517,6 +529,211 @@ class DAGPipeline(pipeline.Pipeline):
     self._set_stats(stats)
     return dict([(output.name, results[output]) for output in self.outputs])
 
+  def set_profile(self, profile):
+    """Sets the `PipelineProfile` in which to record calls to units.
+
+    Each unit is profiled under the name of this DAGPipeline followed by an
+    underscore and the name of the unit. The profile is passed on to the
+    units, so units that are DAGPipelines themselves profile their units too.
+
+    Args:
+      profile: A `PipelineProfile` instance, or None to stop profiling.
+    """
+    super(DAGPipeline, self).set_profile(profile)
+    for unit in self.call_list[1:]:
+      if isinstance(unit, pipeline.Pipeline):
+        unit.set_profile(profile)
+
+  def transform_stream(self, input_iterator, queue_size=8, num_workers=None):
+    """Runs the DAG on a stream of inputs, with every unit in its own stage.
+
+    Each unit runs in its own thread and consumes the outputs of the units it
+    depends on from bounded queues, so all units work on different inputs at
+    the same time and a slow unit only holds back the stages downstream of
+    it. Units listed in `num_workers` additionally run their transforms in a
+    pool of worker processes, with up to twice as many inputs in flight as
+    there are workers. Such units, and their inputs and outputs, must be
+    picklable.
+
+    Outputs are yielded in the order of the inputs and are the same as those
+    of calling `transform` on each input. After the stream is exhausted,
+    `get_stats` returns the statistics of the units merged over all inputs.
+    If a unit raises, or the generator is closed before the end, all stages
+    are stopped and the worker pools are terminated.
+
+    While the stream runs, `stage_counters` maps the name of each unit to a
+    `StageCounters` instance with its throughput and input queue depth.
+
+    Args:
+      input_iterator: Iterates over the input data.
+      queue_size: The maximum number of inputs queued between two units.
+      num_workers: An optional dictionary mapping units, or their names, to
+          the number of worker processes to run them in.
+
+    Yields:
+      For each input, a dictionary mapping output names to lists of objects.
+    """
+    num_workers = num_workers or {}
+    units = self.call_list[1:]
+    consumers = collections.defaultdict(list)
+    for unit in units:
+      for dep_unit in set(self._get_units(self.dag[unit])):
+        consumers[dep_unit].append(unit)
+    queues = dict(
+        ((dep_unit, unit), Queue.Queue(maxsize=queue_size))
+        for dep_unit, dep_consumers in consumers.items()
+        for unit in dep_consumers)
+
+    self.stage_counters = dict(
+        (unit.name, StageCounters(unit.name))
+        for unit in units if isinstance(unit, pipeline.Pipeline))
+    # Maps units to the StatisticsAccumulator of their stage once it is done.
+    stage_stats = {}
+    # Set when the stream ends, fails or is abandoned, to release the stages.
+    stop = threading.Event()
+    # Start worker processes before any threads, so they are not forked while
+    # another thread holds a lock.
+    pools = {}
+    for unit in units:
+      workers = (0 if isinstance(unit, DagOutput) else
+                 num_workers.get(unit, num_workers.get(unit.name, 0)))
+      if workers > 1:
+        pools[unit] = (multiprocessing.Pool(
+            workers, initializer=_init_stage_worker, initargs=(unit,)),
+                       workers)
+    threads = [threading.Thread(
+        target=self._run_source_stage,
+        args=(input_iterator,
+              [queues[(self.input, unit)] for unit in consumers[self.input]],
+              stop))]
+    for unit in units:
+      if isinstance(unit, DagOutput):
+        continue
+      threads.append(threading.Thread(
+          target=self._run_unit_stage,
+          args=(unit, self._get_stage_queues(unit, queues),
+                [queues[(unit, consumer)] for consumer in consumers[unit]],
+                pools.get(unit, (None, 0)), self.stage_counters[unit.name],
+                stage_stats, stop)))
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+
+    output_queues = dict((output, self._get_stage_queues(output, queues))
+                         for output in self.outputs)
+    try:
+      while True:
+        outputs = {}
+        for output in self.outputs:
+          results = self._get_stage_results(output_queues[output])
+          if results is _END_OF_STREAM:
+            for thread in threads:
+              thread.join()
+            stats = statistics.StatisticsAccumulator()
+            for unit in units:
+              if unit in stage_stats:
+                stats.merge_from(stage_stats[unit])
+            self._set_stats(stats.snapshot())
+            return
+          outputs[output.name] = self._get_outputs_as_signature(
+              self.dag[output], results)
+        yield outputs
+    finally:
+      # Stages blocked on a full or empty queue, or on their workers, notice
+      # the event within _POLL_INTERVAL and exit.
+      stop.set()
+      for pool, _ in pools.values():
+        pool.terminate()
+
+  def _get_stage_queues(self, unit, queues):
+    """Returns (dependency unit, queue) pairs feeding the stage of `unit`."""
+    return [(dep_unit, queues[(dep_unit, unit)])
+            for dep_unit in set(self._get_units(self.dag[unit]))]
+
+  def _get_stage_results(self, stage_queues, counters=None, stop=None):
+    """Gets the next message from each input queue of a stage.
+
+    Args:
+      stage_queues: A list of (dependency unit, queue) pairs.
+      counters: An optional `StageCounters` in which to record queue depth.
+      stop: An optional `threading.Event` that stops the wait when set.
+
+    Returns:
+      A dictionary mapping dependency units to their outputs for the next
+      input, or _END_OF_STREAM.
+
+    Raises:
+      Exception: Any exception raised by an upstream stage.
+      _StreamStopped: If `stop` is set while waiting.
+    """
+    results = {}
+    for dep_unit, queue in stage_queues:
+      if counters is not None:
+        counters.record_queue_depth(queue.qsize())
+      message = queue.get() if stop is None else _get(queue, stop)
+      if isinstance(message, _StageFailure):
+        six.reraise(*message.exc_info)
+      if message is _END_OF_STREAM:
+        return _END_OF_STREAM
+      results[dep_unit] = message
+    return results
+
+  def _run_source_stage(self, input_iterator, out_queues, stop):
+    """Feeds each input into the stages that depend on `self.input`."""
+    try:
+      for input_object in input_iterator:
+        for queue in out_queues:
+          _put(queue, [input_object], stop)
+      message = _END_OF_STREAM
+    except Exception:  # pylint: disable=broad-except
+      message = _StageFailure(sys.exc_info())
+    _put_final(out_queues, message, stop)
+
+  def _run_unit_stage(self, unit, in_queues, out_queues, pool_and_size,
+                      counters, stage_stats, stop):
+    """Runs `unit` on every input arriving on `in_queues` until the end."""
+    pool, num_workers = pool_and_size
+    in_flight = collections.deque()
+    stats = statistics.StatisticsAccumulator()
+
+    def emit(unjoined_outputs_and_stats):
+      unjoined_outputs = []
+      for outputs, unit_stats, busy_time in unjoined_outputs_and_stats:
+        unjoined_outputs.append(outputs)
+        stats.add(unit_stats)
+        counters.busy_time += busy_time
+      unit_outputs = self._join_lists_or_dicts(unjoined_outputs, unit)
+      counters.num_inputs += 1
+      counters.num_transforms += len(unjoined_outputs)
+      counters.num_outputs += _count_outputs(unit_outputs)
+      for queue in out_queues:
+        _put(queue, unit_outputs, stop)
+
+    try:
+      while True:
+        results = self._get_stage_results(in_queues, counters, stop)
+        if results is _END_OF_STREAM:
+          break
+        unit_inputs = self._get_inputs_for_unit(unit, results)
+        if pool is None:
+          emit([_transform_with_stats(unit, unit_input)
+                for unit_input in unit_inputs])
+        else:
+          in_flight.append(
+              pool.map_async(_transform_in_stage_worker, unit_inputs))
+          if len(in_flight) > 2 * num_workers:
+            emit(_wait(in_flight.popleft(), stop))
+      while in_flight:
+        emit(_wait(in_flight.popleft(), stop))
+      stage_stats[unit] = stats
+      message = _END_OF_STREAM
+    except Exception:  # pylint: disable=broad-except
+      message = _StageFailure(sys.exc_info())
+    finally:
+      if pool is not None:
+        pool.terminate()
+    _put_final(out_queues, message, stop)
+
   def _get_outputs_as_signature(self, dependency, outputs):
     """Returns a list or dict which matches the type signature of dependency.
 
@@ -639,3 +856,128 @@ class DAGPipeline(pipeline.Pipeline):
               % (unit, unit.output_type, [type(inst) for inst in l]))
         concated += l
     return concated
+
+
+class StageCounters(object):
+  """Throughput and queue depth counters for a unit in a streamed DAG.
+
+  Attributes:
+    name: The name of the unit.
+    num_inputs: The number of inputs to the DAGPipeline the unit has handled.
+    num_transforms: The number of calls to the unit's `transform`.
+    num_outputs: The number of objects the unit has output.
+    busy_time: Total seconds spent in the unit's `transform`, summed over
+        worker processes.
+    queue_depth: The number of inputs waiting in the unit's input queues when
+        it last took an input.
+    max_queue_depth: The maximum of `queue_depth` so far.
+  """
+
+  def __init__(self, name):
+    self.name = name
+    self.num_inputs = 0
+    self.num_transforms = 0
+    self.num_outputs = 0
+    self.busy_time = 0.0
+    self.queue_depth = 0
+    self.max_queue_depth = 0
+
+  def record_queue_depth(self, depth):
+    self.queue_depth = depth
+    self.max_queue_depth = max(self.max_queue_depth, depth)
+
+  @property
+  def throughput(self):
+    """Transforms per second of busy time."""
+    return self.num_transforms / self.busy_time if self.busy_time else 0.0
+
+  def __str__(self):
+    return ('%s: %d inputs, %d transforms, %d outputs, %.1f transforms/sec, '
+            'queue depth %d (max %d)' % (
+                self.name, self.num_inputs, self.num_transforms,
+                self.num_outputs, self.throughput, self.queue_depth,
+                self.max_queue_depth))
+
+
+class _StageFailure(object):
+  """Passed downstream in place of outputs when a stage raises."""
+
+  def __init__(self, exc_info):
+    self.exc_info = exc_info
+
+
+# Passed downstream after the outputs for the last input.
+_END_OF_STREAM = object()
+
+# Seconds between checks of the stop event by a stage that is waiting.
+_POLL_INTERVAL = 0.1
+
+
+class _StreamStopped(Exception):
+  """Raised in a stage when the stream has stopped while it was waiting."""
+  pass
+
+
+def _put(queue, message, stop):
+  """Puts `message` on `queue`, unless `stop` is set while waiting."""
+  while not stop.is_set():
+    try:
+      queue.put(message, timeout=_POLL_INTERVAL)
+      return
+    except Queue.Full:
+      pass
+  raise _StreamStopped()
+
+
+def _put_final(queues, message, stop):
+  """Puts the last message of a stage on `queues`, unless it has stopped."""
+  try:
+    for queue in queues:
+      _put(queue, message, stop)
+  except _StreamStopped:
+    pass
+
+
+def _get(queue, stop):
+  """Gets a message from `queue`, unless `stop` is set while waiting."""
+  while not stop.is_set():
+    try:
+      return queue.get(timeout=_POLL_INTERVAL)
+    except Queue.Empty:
+      pass
+  raise _StreamStopped()
+
+
+def _wait(async_result, stop):
+  """Returns the value of `async_result`, unless `stop` is set first."""
+  while not async_result.ready():
+    if stop.is_set():
+      raise _StreamStopped()
+    async_result.wait(_POLL_INTERVAL)
+  return async_result.get()
+
+
+def _count_outputs(unit_outputs):
+  if isinstance(unit_outputs, dict):
+    return sum(len(outputs) for outputs in unit_outputs.values())
+  return len(unit_outputs)
+
+
+def _transform_with_stats(unit, unit_input):
+  """Returns `unit`'s outputs and stats for `unit_input`, and the time taken."""
+  start_time = time.time()
+  outputs = unit.transform(unit_input)
+  return outputs, unit.get_stats(), time.time() - start_time
+
+
+# The unit run by a stage worker process.
+_stage_worker_unit = None
+
+
+def _init_stage_worker(unit):
+  global _stage_worker_unit
+  _stage_worker_unit = unit
+
+
+def _transform_in_stage_worker(unit_input):
+  return _transform_with_stats(_stage_worker_unit, unit_input)
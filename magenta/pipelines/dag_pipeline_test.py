@@ -18,6 +18,10 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import itertools
+import multiprocessing
+import threading
+import time
 
 # internal imports
 import tensorflow as tf
@@ -454,6 +458,184 @@ class DAGPipelineTest(tf.test.TestCase):
         else:
           self.assertEqual(stat.count, 1)
 
+  def testProfile(self):
+    a, b, c, d = UnitA(), UnitB(), UnitC(), UnitD()
+    dag = {a: dag_pipeline.DagInput(Type0),
+           b: a['t1'],
+           c: {'A_data': a['t2'], 'B_data': b},
+           d: {'0': c['regular_data'], '1': b, '2': c['special_data']},
+           dag_pipeline.DagOutput('abcdz'): d}
+    dag_pipe_obj = dag_pipeline.DAGPipeline(dag, 'DAGPipelineName')
+    profile = pipeline.PipelineProfile()
+    dag_pipe_obj.set_profile(profile)
+    for i in range(4):
+      dag_pipe_obj.transform(Type0(i, -i, i))
+
+    unit_profiles = dict((unit.name, unit) for unit in profile.units)
+    self.assertEqual(
+        set(['DAGPipelineName_UnitA', 'DAGPipelineName_UnitB',
+             'DAGPipelineName_UnitC', 'DAGPipelineName_UnitD']),
+        set(unit_profiles.keys()))
+    for unit_profile in unit_profiles.values():
+      self.assertEqual(4, unit_profile.num_inputs)
+    self.assertEqual(8, unit_profiles['DAGPipelineName_UnitA'].num_outputs)
+    self.assertEqual(2, unit_profiles['DAGPipelineName_UnitA'].max_outputs)
+    self.assertEqual(8, unit_profiles['DAGPipelineName_UnitC'].num_outputs)
+
+    dag_pipe_obj.set_profile(None)
+    dag_pipe_obj.transform(Type0(1, 2, 3))
+    self.assertEqual(4, unit_profiles['DAGPipelineName_UnitA'].num_inputs)
+
+  def testTransformStream(self):
+    a, b, c, d = UnitA(), UnitB(), UnitC(), UnitD()
+    dag = {a: dag_pipeline.DagInput(Type0),
+           b: a['t1'],
+           c: {'A_data': a['t2'], 'B_data': b},
+           d: {'0': c['regular_data'], '1': b, '2': c['special_data']},
+           dag_pipeline.DagOutput('abcdz'): d,
+           dag_pipeline.DagOutput('regular'): c['regular_data']}
+    dag_pipe_obj = dag_pipeline.DAGPipeline(dag)
+    inputs = [Type0(i, -i, i % 3) for i in range(20)]
+
+    expected = [dag_pipe_obj.transform(input_object)
+                for input_object in inputs]
+    self.assertEqual(
+        expected,
+        list(dag_pipe_obj.transform_stream(iter(inputs), queue_size=2)))
+
+    counters = dag_pipe_obj.stage_counters
+    self.assertEqual(set(['UnitA', 'UnitB', 'UnitC', 'UnitD']),
+                     set(counters.keys()))
+    for name in counters:
+      self.assertEqual(len(inputs), counters[name].num_inputs)
+      self.assertEqual(len(inputs), counters[name].num_transforms)
+      self.assertLessEqual(counters[name].max_queue_depth, 2)
+    self.assertEqual(2 * len(inputs), counters['UnitA'].num_outputs)
+
+  def testTransformStreamWithWorkers(self):
+    a, b, c, d = UnitA(), UnitB(), UnitC(), UnitD()
+    dag = {a: dag_pipeline.DagInput(Type0),
+           b: a['t1'],
+           c: {'A_data': a['t2'], 'B_data': b},
+           d: {'0': c['regular_data'], '1': b, '2': c['special_data']},
+           dag_pipeline.DagOutput('abcdz'): d}
+    dag_pipe_obj = dag_pipeline.DAGPipeline(dag)
+    inputs = [Type0(i, -i, i % 3) for i in range(20)]
+
+    expected = [dag_pipe_obj.transform(input_object)
+                for input_object in inputs]
+    self.assertEqual(
+        expected,
+        list(dag_pipe_obj.transform_stream(
+            iter(inputs), num_workers={b: 2, 'UnitD': 2})))
+    self.assertEqual(len(inputs),
+                     dag_pipe_obj.stage_counters['UnitB'].num_transforms)
+
+  def testTransformStreamStatistics(self):
+
+    class UnitQ(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type0, Type1)
+
+      def transform(self, input_object):
+        self._set_stats([statistics.Counter('output_count', input_object.z)])
+        return [Type1(x=input_object.x + i, y=input_object.y + i)
+                for i in range(input_object.z)]
+
+    class UnitR(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type1, Type1)
+
+      def transform(self, input_object):
+        self._set_stats([statistics.Counter('input_count', 1)])
+        return [input_object]
+
+    q, r = UnitQ(), UnitR()
+    dag = {q: dag_pipeline.DagInput(q.input_type),
+           r: q,
+           dag_pipeline.DagOutput('output'): r}
+    dag_pipe_obj = dag_pipeline.DAGPipeline(dag, 'DAGPipelineName')
+    inputs = [Type0(-3, 0, 8), Type0(1, 2, 3), Type0(5, -5, 0)]
+    outputs = list(dag_pipe_obj.transform_stream(iter(inputs)))
+
+    self.assertEqual([8, 3, 0], [len(output['output']) for output in outputs])
+    stats = dict((stat.name, stat.count)
+                 for stat in dag_pipe_obj.get_stats())
+    self.assertEqual(
+        {'DAGPipelineName_UnitQ_output_count': 11,
+         'DAGPipelineName_UnitR_input_count': 11},
+        stats)
+
+  def testTransformStreamException(self):
+
+    class UnitQ(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type1, Type1)
+
+      def transform(self, input_object):
+        if input_object.x < 0:
+          raise ValueError('negative input')
+        return [input_object]
+
+    q = UnitQ()
+    dag = {q: dag_pipeline.DagInput(q.input_type),
+           dag_pipeline.DagOutput('output'): q}
+    dag_pipe_obj = dag_pipeline.DAGPipeline(dag)
+    with self.assertRaisesRegexp(ValueError, 'negative input'):
+      list(dag_pipe_obj.transform_stream(
+          iter([Type1(1, 2), Type1(-1, 2), Type1(3, 4)])))
+
+  def assertThreadsExit(self, num_threads):
+    deadline = time.time() + 10
+    while threading.active_count() > num_threads and time.time() < deadline:
+      time.sleep(0.05)
+    self.assertEqual(num_threads, threading.active_count())
+
+  def testTransformStreamExceptionStopsStages(self):
+
+    class UnitQ(pipeline.Pipeline):
+
+      def __init__(self):
+        pipeline.Pipeline.__init__(self, Type1, Type1)
+
+      def transform(self, input_object):
+        if input_object.x == 3:
+          raise ValueError('bad input')
+        return [input_object]
+
+    q, r = UnitQ(), UnitB()
+    dag = {q: dag_pipeline.DagInput(q.input_type),
+           r: q,
+           dag_pipeline.DagOutput('output'): r}
+    dag_pipe_obj = dag_pipeline.DAGPipeline(dag)
+    num_threads = threading.active_count()
+    # The source stage would otherwise block forever on the full queue of the
+    # failed stage.
+    with self.assertRaisesRegexp(ValueError, 'bad input'):
+      list(dag_pipe_obj.transform_stream(
+          (Type1(i, i) for i in itertools.count()), queue_size=1))
+    self.assertThreadsExit(num_threads)
+
+  def testTransformStreamClosedEarly(self):
+    a, b = UnitA(), UnitB()
+    dag = {a: dag_pipeline.DagInput(Type0),
+           b: a['t1'],
+           dag_pipeline.DagOutput('output'): b}
+    dag_pipe_obj = dag_pipeline.DAGPipeline(dag)
+    num_threads = threading.active_count()
+    outputs = dag_pipe_obj.transform_stream(
+        (Type0(i, -i, 0) for i in itertools.count()), queue_size=1,
+        num_workers={b: 2})
+    self.assertEqual([{'output': [Type3(s=i * 1000, t=-i - 100)]}
+                      for i in range(3)],
+                     list(itertools.islice(outputs, 3)))
+    outputs.close()
+    self.assertThreadsExit(num_threads)
+    self.assertEqual([], multiprocessing.active_children())
+
   def testInvalidDAGException(self):
     class UnitQ(pipeline.Pipeline):
 
@@ -13,9 +13,8 @@
 # limitations under the License.
 """NoteSequence processing pipelines."""
 
-import copy
-
 # internal imports
+import numpy as np
 import tensorflow as tf
 
 from magenta.music import constants
@@ -180,25 +179,47 @@ class TranspositionPipeline(NoteSequencePipeline):
            for ta in sequence.text_annotations):
       tf.logging.warn('Chord symbols ignored by TranspositionPipeline.')
 
+    notes = sequences_lib.NoteArray.from_sequence(sequence)
+    pitches = notes.pitch[~notes.is_drum]
+
+    # Check the pitch range once for all transposition amounts: an amount is
+    # valid only if it keeps both the lowest and highest pitch within range.
+    # Note that this includes a transposition amount of zero, to ensure that
+    # out-of-range pitches are handled correctly.
+    if pitches.size:
+      min_amount = self._min_pitch - int(pitches.min())
+      max_amount = self._max_pitch - int(pitches.max())
+    else:
+      min_amount = max_amount = None
+
     transposed = []
     for amount in self._transposition_range:
-      # Note that transpose is called even with a transpose amount of zero, to
-      # ensure that out-of-range pitches are handled correctly.
-      ts = self._transpose(sequence, amount, stats)
-      if ts is not None:
-        transposed.append(ts)
+      if min_amount is not None and not min_amount <= amount <= max_amount:
+        stats['skipped_due_to_range_exceeded'].increment()
+        continue
+      transposed.append(self._transpose(sequence, notes, amount))
 
     stats['transpositions_generated'].increment(len(transposed))
     self._set_stats(stats.values())
     return transposed
 
-  def _transpose(self, ns, amount, stats):
-    """Transposes a note sequence by the specified amount."""
-    ts = copy.deepcopy(ns)
-    for note in ts.notes:
-      if not note.is_drum:
-        note.pitch += amount
-        if note.pitch < self._min_pitch or note.pitch > self._max_pitch:
-          stats['skipped_due_to_range_exceeded'].increment()
-          return None
+  def _transpose(self, ns, notes, amount):
+    """Transposes a note sequence by the specified amount.
+
+    Only valid transposition amounts should be passed; the sequence is copied
+    once and all (non-drum) pitches are written in a single pass.
+
+    Args:
+      ns: The NoteSequence to transpose.
+      notes: A NoteArray of the notes in `ns`.
+      amount: The number of semitones to transpose by.
+
+    Returns:
+      A transposed copy of `ns`.
+    """
+    ts = music_pb2.NoteSequence()
+    ts.CopyFrom(ns)
+    pitches = np.where(notes.is_drum, notes.pitch, notes.pitch + amount)
+    for note, pitch in zip(ts.notes, pitches.tolist()):
+      note.pitch = pitch
     return ts
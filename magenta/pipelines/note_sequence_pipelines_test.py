@@ -186,6 +186,33 @@ class PipelineUnitsCommonTest(tf.test.TestCase):
     self.assertEqual(11, transposed[0].notes[1].pitch)
     self.assertEqual(12, transposed[0].notes[2].pitch)
 
+  def testTranspositionPipelineIgnoresDrumPitchRange(self):
+    note_sequence = common_testing_lib.parse_test_proto(
+        music_pb2.NoteSequence,
+        """
+        time_signatures: {
+          numerator: 4
+          denominator: 4}
+        tempos: {
+          qpm: 60}""")
+    tp = note_sequence_pipelines.TranspositionPipeline(
+        range(-3, 4), min_pitch=10, max_pitch=14)
+    testing_lib.add_track_to_sequence(
+        note_sequence, 0, [(11, 100, 1.0, 2.0), (13, 100, 2.0, 4.0)])
+    testing_lib.add_track_to_sequence(
+        note_sequence, 9, [(36, 100, 2.0, 2.01)], is_drum=True)
+    transposed = tp.transform(note_sequence)
+    self.assertEqual(3, len(transposed))
+    self.assertEqual([[10, 12, 36], [11, 13, 36], [12, 14, 36]],
+                     [[note.pitch for note in ts.notes] for ts in transposed])
+    self.assertEqual([11, 13, 36], [note.pitch for note in note_sequence.notes])
+
+    stats = dict((stat.name, stat.count) for stat in tp.get_stats())
+    self.assertEqual(
+        4, stats['TranspositionPipeline_skipped_due_to_range_exceeded'])
+    self.assertEqual(
+        3, stats['TranspositionPipeline_transpositions_generated'])
+
 
 if __name__ == '__main__':
   tf.test.main()
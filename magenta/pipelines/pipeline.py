@@ -18,11 +18,17 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
+import collections
 import inspect
+import json
+import multiprocessing
 import os.path
+import time
+import traceback
 
 # internal imports
 import six
+from six.moves import queue as Queue
 import tensorflow as tf
 
 from magenta.pipelines import statistics
@@ -167,6 +173,7 @@ class Pipeline(object):
     self._input_type = input_type
     self._output_type = output_type
     self._stats = []
+    self._profile = None
 
   def __getitem__(self, key):
     return PipelineKey(self, key)
@@ -259,6 +266,137 @@ class Pipeline(object):
     """
     return list(self._stats)
 
+  def set_profile(self, profile):
+    """Sets the `PipelineProfile` in which to record calls to sub-pipelines.
+
+    Pipelines that run other pipelines, such as `DAGPipeline`, record the wall
+    time and outputs of each of those in `profile`.
+
+    Args:
+      profile: A `PipelineProfile` instance, or None to stop profiling.
+    """
+    self._profile = profile
+
+  @property
+  def profile(self):
+    """The `PipelineProfile` set with `set_profile`, or None."""
+    return self._profile
+
+
+class UnitProfile(object):
+  """Wall time and input/output counts of calls to a Pipeline's `transform`.
+
+  Attributes:
+    name: The name under which the Pipeline is profiled.
+    num_inputs: The number of calls to `transform`, one per input.
+    num_outputs: The total number of outputs returned.
+    max_outputs: The largest number of outputs returned by a single call.
+    wall_time: The total seconds spent in `transform`.
+  """
+
+  def __init__(self, name):
+    self.name = name
+    self.num_inputs = 0
+    self.num_outputs = 0
+    self.max_outputs = 0
+    self.wall_time = 0.0
+
+  def record(self, wall_time, num_outputs):
+    """Records a single call to `transform`."""
+    self.num_inputs += 1
+    self.num_outputs += num_outputs
+    self.max_outputs = max(self.max_outputs, num_outputs)
+    self.wall_time += wall_time
+
+  def merge_from(self, other):
+    """Adds the calls recorded by another UnitProfile into this instance."""
+    self.num_inputs += other.num_inputs
+    self.num_outputs += other.num_outputs
+    self.max_outputs = max(self.max_outputs, other.max_outputs)
+    self.wall_time += other.wall_time
+
+  def to_dict(self):
+    return {'num_inputs': self.num_inputs,
+            'num_outputs': self.num_outputs,
+            'max_outputs': self.max_outputs,
+            'wall_time': self.wall_time}
+
+  def __str__(self):
+    return ('%s: %.3f sec in %d calls (%.3f ms/call), %d outputs '
+            '(max %d per call)' % (
+                self.name, self.wall_time, self.num_inputs,
+                1000 * self.wall_time / max(self.num_inputs, 1),
+                self.num_outputs, self.max_outputs))
+
+
+class PipelineProfile(object):
+  """Collects a `UnitProfile` for each profiled Pipeline.
+
+  Units inside a `DAGPipeline` are profiled under the name of the DAG followed
+  by an underscore and the name of the unit, as their statistics are.
+  """
+
+  def __init__(self):
+    self._units = collections.OrderedDict()
+
+  def get(self, name):
+    """Returns the `UnitProfile` for `name`, creating it if needed."""
+    unit_profile = self._units.get(name)
+    if unit_profile is None:
+      unit_profile = self._units[name] = UnitProfile(name)
+    return unit_profile
+
+  @property
+  def units(self):
+    """A list of the `UnitProfile` instances in order of first call."""
+    return list(self._units.values())
+
+  def merge_from(self, other):
+    """Adds the calls recorded by another PipelineProfile."""
+    for unit_profile in other.units:
+      self.get(unit_profile.name).merge_from(unit_profile)
+
+  def to_dict(self):
+    """Returns a dictionary mapping names to dictionaries of measurements."""
+    return dict((unit_profile.name, unit_profile.to_dict())
+                for unit_profile in self.units)
+
+  def write_json(self, path):
+    """Writes the profile to `path` as a JSON object, see `to_dict`."""
+    with tf.gfile.Open(path, 'w') as f:
+      f.write(json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+  def log(self, logger_fn=tf.logging.info):
+    """Calls `logger_fn` on each `UnitProfile`, slowest first."""
+    for unit_profile in sorted(self.units, key=lambda u: -u.wall_time):
+      logger_fn(str(unit_profile))
+
+
+def profiled_transform(unit, input_object, profile, name=None):
+  """Calls `unit.transform`, recording the call in `profile` if given.
+
+  Args:
+    unit: A Pipeline instance.
+    input_object: The input to `unit.transform`.
+    profile: A `PipelineProfile` instance, or None to just call `transform`.
+    name: The name to record the call under. Defaults to `unit.name`.
+
+  Returns:
+    The outputs of `unit.transform`.
+  """
+  if profile is None:
+    return unit.transform(input_object)
+  start_time = time.time()
+  outputs = unit.transform(input_object)
+  wall_time = time.time() - start_time
+  if isinstance(outputs, dict):
+    num_outputs = sum(len(output_list) for output_list in outputs.values())
+  else:
+    num_outputs = len(outputs)
+  profile.get(unit.name if name is None else name).record(
+      wall_time, num_outputs)
+  return outputs
+
 
 def file_iterator(root_dir, extension=None, recurse=True):
   """Generator that iterates over all files in the given directory.
@@ -312,10 +450,54 @@ def tf_record_iterator(tfrecord_file, proto):
     yield proto.FromString(raw_bytes)
 
 
+def _assert_serializable_output_type(pipeline):
+  """Raises ValueError if `pipeline`'s outputs cannot be serialized."""
+  if isinstance(pipeline.output_type, dict):
+    for name, type_ in pipeline.output_type.items():
+      if not hasattr(type_, 'SerializeToString'):
+        raise ValueError(
+            'Pipeline output "%s" does not have method SerializeToString. '
+            'Output type = %s' % (name, pipeline.output_type))
+  else:
+    if not hasattr(pipeline.output_type, 'SerializeToString'):
+      raise ValueError(
+          'Pipeline output type %s does not have method SerializeToString.'
+          % pipeline.output_type)
+
+
+def _get_output_paths(output_names, output_dir, output_file_base=None,
+                      shard=None, num_shards=None):
+  """Returns the TFRecord paths for the given dataset names.
+
+  Args:
+    output_names: Dataset names output by the pipeline.
+    output_dir: Path to directory where datasets will be written.
+    output_file_base: An optional string prefix for all datasets.
+    shard: If given, the index of the shard the paths are for. The paths are
+        suffixed with e.g. '-00002-of-00008'.
+    num_shards: The total number of shards. Required if `shard` is given.
+
+  Returns:
+    A list of paths, one for each name in `output_names`.
+  """
+  if output_file_base is None:
+    output_paths = [os.path.join(output_dir, name + '.tfrecord')
+                    for name in output_names]
+  else:
+    output_paths = [os.path.join(output_dir,
+                                 '%s_%s.tfrecord' % (output_file_base, name))
+                    for name in output_names]
+  if shard is not None:
+    output_paths = ['%s-%05d-of-%05d' % (path, shard, num_shards)
+                    for path in output_paths]
+  return output_paths
+
+
 def run_pipeline_serial(pipeline,
                         input_iterator,
                         output_dir,
-                        output_file_base=None):
+                        output_file_base=None,
+                        profile_path=None):
   """Runs the a pipeline on a data source and writes to a directory.
 
   Run the the pipeline on each input from the iterator one at a time.
@@ -336,61 +518,299 @@ def run_pipeline_serial(pipeline,
         directory does not exist, it will be created.
     output_file_base: An optional string prefix for all datasets output by this
         run. The prefix will also be followed by an underscore.
+    profile_path: An optional path to which to write a JSON profile of the
+        wall time and outputs of the pipeline and its units, see
+        `PipelineProfile`. The profile is logged along with the statistics
+        either way.
 
   Raises:
     ValueError: If any of `pipeline`'s output types do not have a
         SerializeToString method.
   """
-  if isinstance(pipeline.output_type, dict):
-    for name, type_ in pipeline.output_type.items():
-      if not hasattr(type_, 'SerializeToString'):
-        raise ValueError(
-            'Pipeline output "%s" does not have method SerializeToString. '
-            'Output type = %s' % (name, pipeline.output_type))
-  else:
-    if not hasattr(pipeline.output_type, 'SerializeToString'):
-      raise ValueError(
-          'Pipeline output type %s does not have method SerializeToString.'
-          % pipeline.output_type)
+  _assert_serializable_output_type(pipeline)
 
   if not tf.gfile.Exists(output_dir):
     tf.gfile.MakeDirs(output_dir)
 
+  profile = PipelineProfile()
+  pipeline.set_profile(profile)
   output_names = pipeline.output_type_as_dict.keys()
-
-  if output_file_base is None:
-    output_paths = [os.path.join(output_dir, name + '.tfrecord')
-                    for name in output_names]
-  else:
-    output_paths = [os.path.join(output_dir,
-                                 '%s_%s.tfrecord' % (output_file_base, name))
-                    for name in output_names]
+  output_paths = _get_output_paths(output_names, output_dir, output_file_base)
 
   writers = dict([(name, tf.python_io.TFRecordWriter(path))
                   for name, path in zip(output_names, output_paths)])
 
   total_inputs = 0
   total_outputs = 0
-  stats = []
+  stats = statistics.StatisticsAccumulator()
   for input_ in input_iterator:
     total_inputs += 1
-    for name, outputs in _guarantee_dict(pipeline.transform(input_),
-                                         list(output_names)[0]).items():
+    outputs_dict = _guarantee_dict(
+        profiled_transform(pipeline, input_, profile),
+        list(output_names)[0])
+    for name, outputs in outputs_dict.items():
       for output in outputs:
         writers[name].write(output.SerializeToString())
       total_outputs += len(outputs)
-    stats = statistics.merge_statistics(stats + pipeline.get_stats())
+    stats.add(pipeline.get_stats())
     if total_inputs % 500 == 0:
       tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
                       total_inputs, total_outputs)
-      statistics.log_statistics_list(stats, tf.logging.info)
+      statistics.log_statistics_list(stats.snapshot(), tf.logging.info)
+      profile.log(tf.logging.info)
+  pipeline.set_profile(None)
   tf.logging.info('\n\nCompleted.\n')
   tf.logging.info('Processed %d inputs total. Produced %d outputs.',
                   total_inputs, total_outputs)
+  statistics.log_statistics_list(stats.snapshot(), tf.logging.info)
+  profile.log(tf.logging.info)
+  if profile_path is not None:
+    profile.write_json(profile_path)
+
+
+def run_pipeline_parallel(pipeline,
+                          input_iterator,
+                          output_dir,
+                          output_file_base=None,
+                          num_workers=None,
+                          chunk_size=32,
+                          profile_path=None):
+  """Runs a pipeline on a data source in parallel and writes to a directory.
+
+  Like `run_pipeline_serial`, but inputs are distributed over `num_workers`
+  processes, each of which runs its own copy of the pipeline. Each worker
+  writes its own shard of every dataset, so instead of `<name>.tfrecord` the
+  datasets are written to `<name>.tfrecord-<shard>-of-<num_workers>`. Together
+  the shards of a dataset contain the same outputs as the file written by
+  `run_pipeline_serial`, although in a different order. Statistics are
+  accumulated by each worker and merged once at the end.
+
+  Inputs are sent to the workers in chunks of `chunk_size`, so items returned
+  by `input_iterator` and the pipeline itself must be picklable.
+
+  Args:
+    pipeline: A Pipeline instance. `pipeline.output_type` must be a protocol
+        buffer or a dictionary mapping names to protocol buffers.
+    input_iterator: Iterates over the input data. Items returned by it are fed
+        directly into the pipeline's `transform` method.
+    output_dir: Path to directory where datasets will be written. If the
+        directory does not exist, it will be created.
+    output_file_base: An optional string prefix for all datasets output by this
+        run. The prefix will also be followed by an underscore.
+    num_workers: The number of worker processes. Defaults to the number of
+        CPUs.
+    chunk_size: The number of inputs sent to a worker at a time.
+    profile_path: An optional path to which to write a JSON profile of the
+        wall time and outputs of the pipeline and its units, merged over all
+        workers, see `PipelineProfile`. The profile is logged along with the
+        statistics either way.
+
+  Returns:
+    A list of the merged `Statistic` objects of the run.
+
+  Raises:
+    ValueError: If any of `pipeline`'s output types do not have a
+        SerializeToString method.
+    RuntimeError: If a worker fails. The message contains the worker's
+        traceback, or its exit code if it died without one.
+  """
+  _assert_serializable_output_type(pipeline)
+
+  if not tf.gfile.Exists(output_dir):
+    tf.gfile.MakeDirs(output_dir)
+
+  if num_workers is None:
+    num_workers = multiprocessing.cpu_count()
+  output_names = list(pipeline.output_type_as_dict.keys())
+
+  # Bound the number of chunks in flight so that the input iterator is not
+  # read far ahead of the workers.
+  input_queue = multiprocessing.Queue(maxsize=2 * num_workers)
+  result_queue = multiprocessing.Queue()
+  workers = []
+  for shard in range(num_workers):
+    output_paths = _get_output_paths(output_names, output_dir,
+                                     output_file_base, shard, num_workers)
+    worker = multiprocessing.Process(
+        target=_run_pipeline_worker,
+        args=(pipeline, shard, dict(zip(output_names, output_paths)),
+              input_queue, result_queue))
+    worker.daemon = True
+    worker.start()
+    workers.append(worker)
+
+  progress = _ParallelProgress(num_workers)
+
+  def put(item):
+    # Workers that die stop draining `input_queue`, so check on them while
+    # it is full.
+    while True:
+      try:
+        input_queue.put(item, timeout=_POLL_INTERVAL)
+        return
+      except Queue.Full:
+        progress.poll(result_queue)
+        progress.check_workers(workers, result_queue)
+
+  completed = False
+  try:
+    chunk = []
+    for input_ in input_iterator:
+      chunk.append(input_)
+      if len(chunk) == chunk_size:
+        put(chunk)
+        chunk = []
+        progress.poll(result_queue)
+    if chunk:
+      put(chunk)
+    for _ in workers:
+      put(None)
+    while not progress.finished:
+      try:
+        progress.update(result_queue.get(timeout=_POLL_INTERVAL))
+      except Queue.Empty:
+        progress.check_workers(workers, result_queue)
+    completed = True
+  finally:
+    if not completed:
+      input_queue.cancel_join_thread()
+    for worker in workers:
+      if completed:
+        worker.join()
+      else:
+        worker.terminate()
+
+  stats = progress.stats.snapshot()
+  tf.logging.info('\n\nCompleted.\n')
+  tf.logging.info('Processed %d inputs total. Produced %d outputs.',
+                  progress.total_inputs, progress.total_outputs)
   statistics.log_statistics_list(stats, tf.logging.info)
+  progress.profile.log(tf.logging.info)
+  if profile_path is not None:
+    progress.profile.write_json(profile_path)
+  return stats
+
 
+# Number of inputs after which a worker reports progress.
+_WORKER_REPORT_INTERVAL = 500
 
-def load_pipeline(pipeline, input_iterator):
+# Seconds between checks on the workers while the parent waits for them.
+_POLL_INTERVAL = 1.0
+
+
+def _run_pipeline_worker(pipeline, shard, output_paths, input_queue,
+                         result_queue):
+  """Runs `pipeline` on chunks of inputs from `input_queue` until None.
+
+  Reports ('progress', num_inputs, num_outputs) messages while running and
+  a final ('done', shard, accumulated stats, profile) message, or
+  ('error', traceback) if anything fails. After a failure the worker keeps
+  draining `input_queue` so that the parent does not block on it.
+  """
+  failed = False
+  try:
+    writers = dict([(name, tf.python_io.TFRecordWriter(path))
+                    for name, path in output_paths.items()])
+    default_name = list(output_paths.keys())[0]
+    stats = statistics.StatisticsAccumulator()
+    profile = PipelineProfile()
+    pipeline.set_profile(profile)
+    num_inputs = 0
+    num_outputs = 0
+    while True:
+      chunk = input_queue.get()
+      if chunk is None:
+        break
+      for input_ in chunk:
+        outputs = _guarantee_dict(
+            profiled_transform(pipeline, input_, profile), default_name)
+        for name, output_list in outputs.items():
+          for output in output_list:
+            writers[name].write(output.SerializeToString())
+          num_outputs += len(output_list)
+        stats.add(pipeline.get_stats())
+        num_inputs += 1
+        if num_inputs % _WORKER_REPORT_INTERVAL == 0:
+          result_queue.put(('progress', num_inputs, num_outputs))
+          num_inputs = num_outputs = 0
+    for writer in writers.values():
+      writer.close()
+    result_queue.put(('progress', num_inputs, num_outputs))
+    result_queue.put(('done', shard, stats, profile))
+  except Exception:  # pylint: disable=broad-except
+    failed = True
+    result_queue.put(('error', traceback.format_exc()))
+  if failed:
+    while input_queue.get() is not None:
+      pass
+
+
+class _ParallelProgress(object):
+  """Aggregates the messages sent by workers of `run_pipeline_parallel`."""
+
+  def __init__(self, num_workers):
+    self.num_running = num_workers
+    self.total_inputs = 0
+    self.total_outputs = 0
+    self.stats = statistics.StatisticsAccumulator()
+    self.profile = PipelineProfile()
+    self.error = None
+    self.done_shards = set()
+    self._last_logged = 0
+
+  @property
+  def finished(self):
+    return not self.num_running
+
+  def check_workers(self, workers, result_queue):
+    """Raises RuntimeError if a worker exited without reporting that it is done.
+
+    Args:
+      workers: The worker processes, indexed by shard.
+      result_queue: The queue of worker messages. Messages sent by a worker
+          before it exited are processed before the worker is considered dead.
+    """
+    exited = [shard for shard, worker in enumerate(workers)
+              if shard not in self.done_shards and worker.exitcode is not None]
+    if not exited:
+      return
+    self.poll(result_queue)
+    for shard in exited:
+      if shard not in self.done_shards:
+        self.error = 'Worker %d exited with code %d.' % (
+            shard, workers[shard].exitcode)
+        raise RuntimeError('Pipeline worker failed:\n%s' % self.error)
+
+  def poll(self, result_queue):
+    """Processes all messages that are available without blocking."""
+    while True:
+      try:
+        message = result_queue.get_nowait()
+      except Queue.Empty:
+        return
+      self.update(message)
+
+  def update(self, message):
+    """Processes one message, raising RuntimeError if a worker failed."""
+    kind = message[0]
+    if kind == 'progress':
+      self.total_inputs += message[1]
+      self.total_outputs += message[2]
+      if self.total_inputs - self._last_logged >= _WORKER_REPORT_INTERVAL:
+        self._last_logged = self.total_inputs
+        tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
+                        self.total_inputs, self.total_outputs)
+    elif kind == 'done':
+      self.done_shards.add(message[1])
+      self.stats.merge_from(message[2])
+      self.profile.merge_from(message[3])
+      self.num_running -= 1
+    else:
+      self.error = message[1]
+      raise RuntimeError('Pipeline worker failed:\n%s' % self.error)
+
+
+def load_pipeline(pipeline, input_iterator, profile_path=None):
   """Runs a pipeline saving the output into memory.
 
   Use this instead of `run_pipeline_serial` to build a dataset on the fly
@@ -400,6 +820,10 @@ def load_pipeline(pipeline, input_iterator):
     pipeline: A Pipeline instance.
     input_iterator: Iterates over the input data. Items returned by it are fed
         directly into the pipeline's `transform` method.
+    profile_path: An optional path to which to write a JSON profile of the
+        wall time and outputs of the pipeline and its units, see
+        `PipelineProfile`. The profile is logged along with the statistics
+        either way.
 
   Returns:
     The aggregated return values of pipeline.transform. Specifically a
@@ -410,21 +834,29 @@ def load_pipeline(pipeline, input_iterator):
       [(name, []) for name in pipeline.output_type_as_dict])
   total_inputs = 0
   total_outputs = 0
-  stats = []
+  stats = statistics.StatisticsAccumulator()
+  profile = PipelineProfile()
+  pipeline.set_profile(profile)
   for input_object in input_iterator:
     total_inputs += 1
-    outputs = _guarantee_dict(pipeline.transform(input_object),
-                              list(aggregated_outputs.keys())[0])
+    outputs = _guarantee_dict(
+        profiled_transform(pipeline, input_object, profile),
+        list(aggregated_outputs.keys())[0])
     for name, output_list in outputs.items():
       aggregated_outputs[name].extend(output_list)
       total_outputs += len(output_list)
-    stats = statistics.merge_statistics(stats + pipeline.get_stats())
+    stats.add(pipeline.get_stats())
     if total_inputs % 500 == 0:
       tf.logging.info('Processed %d inputs so far. Produced %d outputs.',
                       total_inputs, total_outputs)
-      statistics.log_statistics_list(stats, tf.logging.info)
+      statistics.log_statistics_list(stats.snapshot(), tf.logging.info)
+      profile.log(tf.logging.info)
+  pipeline.set_profile(None)
   tf.logging.info('\n\nCompleted.\n')
   tf.logging.info('Processed %d inputs total. Produced %d outputs.',
                   total_inputs, total_outputs)
-  statistics.log_statistics_list(stats, tf.logging.info)
+  statistics.log_statistics_list(stats.snapshot(), tf.logging.info)
+  profile.log(tf.logging.info)
+  if profile_path is not None:
+    profile.write_json(profile_path)
   return aggregated_outputs
@@ -17,6 +17,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
 import os
 import tempfile
 
@@ -47,6 +48,23 @@ class MockPipeline(pipeline.Pipeline):
         'dataset_2': [MockStringProto(input_object + '_C')]}
 
 
+class MockCountingPipeline(MockPipeline):
+
+  def transform(self, input_object):
+    self._set_stats([statistics.Counter('inputs', 1),
+                     statistics.Counter('characters', len(input_object))])
+    return super(MockCountingPipeline, self).transform(input_object)
+
+
+class MockDyingPipeline(MockPipeline):
+
+  def transform(self, input_object):
+    if input_object == 'die':
+      # Exit without reporting, as when a worker is killed.
+      os._exit(3)  # pylint: disable=protected-access
+    return super(MockDyingPipeline, self).transform(input_object)
+
+
 class PipelineTest(tf.test.TestCase):
 
   def testFileIteratorRecursive(self):
@@ -129,6 +147,84 @@ class PipelineTest(tf.test.TestCase):
         set([('serialized:%s_C' % s).encode('utf-8') for s in strings]),
         set(dataset_2_reader))
 
+  def testRunPipelineParallel(self):
+    strings = ['abcdefg', 'helloworld!', 'qwerty', 'xyz', '12345']
+    root_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    stats = pipeline.run_pipeline_parallel(
+        MockCountingPipeline(), iter(strings), root_dir, num_workers=2,
+        chunk_size=2)
+
+    def read_shards(name):
+      paths = tf.gfile.Glob(os.path.join(root_dir, name + '.tfrecord-*'))
+      self.assertEqual(
+          [os.path.join(root_dir, name + '.tfrecord-%05d-of-00002' % i)
+           for i in range(2)],
+          sorted(paths))
+      records = []
+      for path in paths:
+        records.extend(tf.python_io.tf_record_iterator(path))
+      return records
+
+    dataset_1 = read_shards('dataset_1')
+    self.assertEqual(len(strings) * 2, len(dataset_1))
+    self.assertEqual(
+        set([('serialized:%s_A' % s).encode('utf-8') for s in strings] +
+            [('serialized:%s_B' % s).encode('utf-8') for s in strings]),
+        set(dataset_1))
+
+    dataset_2 = read_shards('dataset_2')
+    self.assertEqual(len(strings), len(dataset_2))
+    self.assertEqual(
+        set([('serialized:%s_C' % s).encode('utf-8') for s in strings]),
+        set(dataset_2))
+
+    stats = dict((stat.name, stat.count) for stat in stats)
+    self.assertEqual(
+        {'MockCountingPipeline_inputs': len(strings),
+         'MockCountingPipeline_characters': len(''.join(strings))},
+        stats)
+
+  def testRunPipelineParallelWorkerDies(self):
+    strings = ['abcdefg', 'die', 'qwerty', 'xyz', '12345']
+    root_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    with self.assertRaisesRegexp(RuntimeError, 'exited with code 3'):
+      pipeline.run_pipeline_parallel(
+          MockDyingPipeline(), iter(strings), root_dir, num_workers=2,
+          chunk_size=1)
+
+  def testRunPipelineSerialProfile(self):
+    strings = ['abcdefg', 'helloworld!', 'qwerty']
+    root_dir = tempfile.mkdtemp(dir=self.get_temp_dir())
+    profile_path = os.path.join(root_dir, 'profile.json')
+    pipeline.run_pipeline_serial(
+        MockPipeline(), iter(strings), root_dir, profile_path=profile_path)
+
+    with tf.gfile.Open(profile_path) as f:
+      profile = json.loads(f.read())
+    self.assertEqual(['MockPipeline'], list(profile.keys()))
+    self.assertEqual(3, profile['MockPipeline']['num_inputs'])
+    self.assertEqual(9, profile['MockPipeline']['num_outputs'])
+    self.assertEqual(3, profile['MockPipeline']['max_outputs'])
+    self.assertGreaterEqual(profile['MockPipeline']['wall_time'], 0)
+
+  def testPipelineProfile(self):
+    profile = pipeline.PipelineProfile()
+    outputs = pipeline.profiled_transform(MockPipeline(), 'abc', profile)
+    self.assertEqual(2, len(outputs['dataset_1']))
+    pipeline.profiled_transform(MockPipeline(), 'abc', profile, name='other')
+
+    other_profile = pipeline.PipelineProfile()
+    other_profile.get('other').record(1.0, 5)
+    profile.merge_from(other_profile)
+
+    self.assertEqual(['MockPipeline', 'other'],
+                     [unit.name for unit in profile.units])
+    other = profile.get('other')
+    self.assertEqual(2, other.num_inputs)
+    self.assertEqual(8, other.num_outputs)
+    self.assertEqual(5, other.max_outputs)
+    self.assertGreaterEqual(other.wall_time, 1.0)
+
   def testPipelineIterator(self):
     strings = ['abcdefg', 'helloworld!', 'qwerty']
     result = pipeline.load_pipeline(MockPipeline(), iter(strings))
@@ -275,3 +275,125 @@ class Histogram(Statistic):
 
   def copy(self):
     return copy.copy(self)
+
+
+class StatisticsAccumulator(object):
+  """Accumulates Statistics in place, one fixed slot per name.
+
+  Use this instead of repeatedly calling `merge_statistics` on a growing list
+  when aggregating statistics over many calls to `transform`. The counts of
+  each `Counter` and `Histogram` are added into a preallocated slot, so adding
+  statistics does not create or copy any `Statistic` objects. Call `snapshot`
+  to get `Statistic` objects, e.g. for logging.
+
+  Accumulators are picklable and can be merged with `merge_from`, e.g. to
+  combine the statistics of worker processes.
+  """
+
+  def __init__(self):
+    # Maps names to (kind, index) pairs, where `kind` is one of the _*_SLOT
+    # constants and `index` indexes the list of slots of that kind.
+    self._slots = {}
+    self._names = []
+    # Counter slots hold counts.
+    self._counts = []
+    # Histogram slots hold [buckets, counts per bucket, verbose_pretty_print].
+    self._histograms = []
+    # Other Statistic types are merged with their `merge_from`.
+    self._others = []
+
+  def __len__(self):
+    return len(self._names)
+
+  def add(self, stats_list):
+    """Adds the given Statistics into their slots.
+
+    Args:
+      stats_list: A list of `Statistic` objects.
+
+    Raises:
+      MergeStatisticsException: If a Statistic cannot be merged with the
+          Statistics of the same name added before.
+    """
+    for stat in stats_list:
+      slot = self._slots.get(stat.name)
+      if slot is None:
+        self._register(stat)
+        continue
+      kind, index = slot
+      if kind == _COUNTER_SLOT and isinstance(stat, Counter):
+        self._counts[index] += stat.count
+      elif kind == _HISTOGRAM_SLOT and isinstance(stat, Histogram):
+        buckets, counts, _ = self._histograms[index]
+        if stat.buckets is not buckets and stat.buckets != buckets:
+          raise MergeStatisticsException(
+              'Histogram buckets do not match. Expected %s, got %s'
+              % (buckets, stat.buckets))
+        stat_counters = stat.counters
+        for i, bucket_lower in enumerate(buckets):
+          counts[i] += stat_counters[bucket_lower]
+      elif kind == _OTHER_SLOT:
+        self._others[index].merge_from(stat)
+      else:
+        raise MergeStatisticsException(
+            'Cannot merge %s into %s' % (stat.__class__.__name__,
+                                         ('Counter', 'Histogram')[kind]))
+
+  def increment(self, name, inc=1):
+    """Increments the count of the Counter with the given name.
+
+    Args:
+      name: The name of the Counter. It is registered if not present yet.
+      inc: (defaults to 1) How much to increment the count by.
+    """
+    slot = self._slots.get(name)
+    if slot is not None and slot[0] == _COUNTER_SLOT:
+      self._counts[slot[1]] += inc
+    else:
+      self.add([Counter(name, inc)])
+
+  def merge_from(self, other):
+    """Adds the statistics accumulated by another accumulator."""
+    self.add(other.snapshot())
+
+  def snapshot_one(self, name):
+    """Returns a new `Statistic` holding the accumulated value for `name`."""
+    kind, index = self._slots[name]
+    if kind == _COUNTER_SLOT:
+      return Counter(name, self._counts[index])
+    elif kind == _HISTOGRAM_SLOT:
+      buckets, counts, verbose_pretty_print = self._histograms[index]
+      histogram = Histogram(name, buckets[1:], verbose_pretty_print)
+      histogram.counters = dict(zip(buckets, counts))
+      return histogram
+    else:
+      return self._others[index].copy()
+
+  def snapshot(self):
+    """Returns a list of new `Statistic` objects, one for each name."""
+    return [self.snapshot_one(name) for name in self._names]
+
+  def _register(self, stat):
+    """Allocates a slot for `stat` and stores its value there."""
+    if isinstance(stat, Counter):
+      slot = (_COUNTER_SLOT, len(self._counts))
+      self._counts.append(stat.count)
+    elif isinstance(stat, Histogram):
+      slot = (_HISTOGRAM_SLOT, len(self._histograms))
+      buckets = list(stat.buckets)
+      self._histograms.append(
+          [buckets, [stat.counters[bucket_lower] for bucket_lower in buckets],
+           stat.verbose_pretty_print])
+    elif isinstance(stat, Statistic):
+      slot = (_OTHER_SLOT, len(self._others))
+      self._others.append(stat.copy())
+    else:
+      raise MergeStatisticsException(
+          'Cannot merge with non-Statistic of type %s' % type(stat))
+    self._slots[stat.name] = slot
+    self._names.append(stat.name)
+
+
+_COUNTER_SLOT = 0
+_HISTOGRAM_SLOT = 1
+_OTHER_SLOT = 2
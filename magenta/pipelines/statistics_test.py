@@ -98,6 +98,62 @@ class StatisticsTest(tf.test.TestCase):
         statistics.MergeStatisticsException):
       counter_1.merge_from(counter_2)
 
+  def testStatisticsAccumulator(self):
+    accumulator = statistics.StatisticsAccumulator()
+    for i in range(3):
+      histo = statistics.Histogram('histo', [1, 2, 10])
+      histo.increment(i)
+      accumulator.add([statistics.Counter('counter', i + 1), histo])
+    accumulator.increment('counter', 10)
+    accumulator.increment('new_counter')
+    self.assertEqual(3, len(accumulator))
+
+    stats = accumulator.snapshot()
+    self.assertEqual(['counter', 'histo', 'new_counter'],
+                     [stat.name for stat in stats])
+    self.assertEqual(16, stats[0].count)
+    self.assertEqual({float('-inf'): 1, 1: 1, 2: 1, 10: 0}, stats[1].counters)
+    self.assertEqual(1, stats[2].count)
+
+    # Snapshots are independent of the accumulator.
+    stats[0].increment()
+    self.assertEqual(16, accumulator.snapshot_one('counter').count)
+
+    other = statistics.StatisticsAccumulator()
+    histo = statistics.Histogram('histo', [1, 2, 10])
+    histo.increment(20, 5)
+    other.add([histo, statistics.Counter('counter', 4)])
+    accumulator.merge_from(other)
+    self.assertEqual(20, accumulator.snapshot_one('counter').count)
+    self.assertEqual({float('-inf'): 1, 1: 1, 2: 1, 10: 5},
+                     accumulator.snapshot_one('histo').counters)
+
+  def testStatisticsAccumulatorMatchesMergeStatistics(self):
+    stats_lists = []
+    for i in range(5):
+      histo = statistics.Histogram('histo', [0, 5, 10])
+      histo.increment(i * 3)
+      stats_lists.append([statistics.Counter('counter', i), histo])
+
+    accumulator = statistics.StatisticsAccumulator()
+    merged = []
+    for stats in stats_lists:
+      accumulator.add(stats)
+      merged = statistics.merge_statistics(
+          merged + [stat.copy() for stat in stats])
+    self.assertEqual(
+        sorted(str(stat) for stat in merged),
+        sorted(str(stat) for stat in accumulator.snapshot()))
+
+  def testStatisticsAccumulatorMismatch(self):
+    accumulator = statistics.StatisticsAccumulator()
+    accumulator.add([statistics.Counter('name_123'),
+                     statistics.Histogram('histo', [1, 2])])
+    with self.assertRaises(statistics.MergeStatisticsException):
+      accumulator.add([statistics.Histogram('name_123', [1, 2])])
+    with self.assertRaises(statistics.MergeStatisticsException):
+      accumulator.add([statistics.Histogram('histo', [1, 3])])
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -25,9 +25,14 @@ Example usage:
     --log=INFO
 """
 
+from __future__ import division
+
+import collections
 import os
+import time
 
 # internal imports
+from concurrent import futures
 import tensorflow as tf
 
 from magenta.music import abc_parser
@@ -45,62 +50,39 @@ tf.app.flags.DEFINE_string('output_file', None,
 tf.app.flags.DEFINE_bool('recursive', False,
                          'Whether or not to recurse into subdirectories.')
 tf.app.flags.DEFINE_integer('num_threads', 1,
-                            'Number of worker threads to run in parallel.')
+                            'Number of worker processes that parse files in '
+                            'parallel.')
 tf.app.flags.DEFINE_string('log', 'INFO',
                            'The threshold for what messages will be logged '
                            'DEBUG, INFO, WARN, ERROR, or FATAL.')
 
+_CONVERTIBLE_EXTENSIONS = ('.mid', '.midi', '.xml', '.mxl', '.abc')
 
-def convert_files(root_dir, sub_dir, writer, recursive=False):
-  """Converts files.
+
+def list_files(root_dir, sub_dir, recursive=False):
+  """Lists the files to convert.
+
+  Files are listed in the order `convert_files` converts them: the files in a
+  directory first, then the files in its subdirectories.
 
   Args:
     root_dir: A string specifying a root directory.
     sub_dir: A string specifying a path to a directory under `root_dir` in which
-        to convert contents.
-    writer: A TFRecord writer
-    recursive: A boolean specifying whether or not recursively convert files
-        contained in subdirectories of the specified directory.
+        to list contents.
+    recursive: A boolean specifying whether or not to list files contained in
+        subdirectories of the specified directory.
 
-  Returns:
-    A map from the resulting Futures to the file paths being converted.
+  Yields:
+    Tuples of the subdirectory and the full path of each file to convert.
   """
   dir_to_convert = os.path.join(root_dir, sub_dir)
-  tf.logging.info("Converting files in '%s'.", dir_to_convert)
+  tf.logging.info("Listing files in '%s'.", dir_to_convert)
   files_in_dir = tf.gfile.ListDirectory(os.path.join(dir_to_convert))
   recurse_sub_dirs = []
-  written_count = 0
   for file_in_dir in files_in_dir:
-    tf.logging.log_every_n(tf.logging.INFO, '%d files converted.',
-                           1000, written_count)
     full_file_path = os.path.join(dir_to_convert, file_in_dir)
-    if (full_file_path.lower().endswith('.mid') or
-        full_file_path.lower().endswith('.midi')):
-      try:
-        sequence = convert_midi(root_dir, sub_dir, full_file_path)
-      except Exception as exc:  # pylint: disable=broad-except
-        tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
-        continue
-      if sequence:
-        writer.write(sequence)
-    elif (full_file_path.lower().endswith('.xml') or
-          full_file_path.lower().endswith('.mxl')):
-      try:
-        sequence = convert_musicxml(root_dir, sub_dir, full_file_path)
-      except Exception as exc:  # pylint: disable=broad-except
-        tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
-        continue
-      if sequence:
-        writer.write(sequence)
-    elif full_file_path.lower().endswith('.abc'):
-      try:
-        sequences = convert_abc(root_dir, sub_dir, full_file_path)
-      except Exception as exc:  # pylint: disable=broad-except
-        tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
-        continue
-      if sequences:
-        for sequence in sequences:
-          writer.write(sequence)
+    if full_file_path.lower().endswith(_CONVERTIBLE_EXTENSIONS):
+      yield sub_dir, full_file_path
     else:
       if recursive and tf.gfile.IsDirectory(full_file_path):
         recurse_sub_dirs.append(os.path.join(sub_dir, file_in_dir))
@@ -109,7 +91,127 @@ def convert_files(root_dir, sub_dir, writer, recursive=False):
             'Unable to find a converter for file %s', full_file_path)
 
   for recurse_sub_dir in recurse_sub_dirs:
-    convert_files(root_dir, recurse_sub_dir, writer, recursive)
+    for item in list_files(root_dir, recurse_sub_dir, recursive):
+      yield item
+
+
+def convert_file(root_dir, sub_dir, full_file_path):
+  """Converts a file to a list of sequence protos.
+
+  Args:
+    root_dir: A string specifying the root directory for the files being
+        converted.
+    sub_dir: The directory being converted currently.
+    full_file_path: the full path to the file to convert.
+
+  Returns:
+    A list of NoteSequence protos, empty if the file could not be converted.
+  """
+  lower_file_path = full_file_path.lower()
+  try:
+    if lower_file_path.endswith(('.mid', '.midi')):
+      sequences = [convert_midi(root_dir, sub_dir, full_file_path)]
+    elif lower_file_path.endswith(('.xml', '.mxl')):
+      sequences = [convert_musicxml(root_dir, sub_dir, full_file_path)]
+    else:
+      sequences = convert_abc(root_dir, sub_dir, full_file_path)
+  except Exception as exc:  # pylint: disable=broad-except
+    tf.logging.fatal('%r generated an exception: %s', full_file_path, exc)
+    return []
+  return [sequence for sequence in sequences or [] if sequence]
+
+
+def convert_files(root_dir, sub_dir, writer, recursive=False):
+  """Converts files.
+
+  Args:
+    root_dir: A string specifying a root directory.
+    sub_dir: A string specifying a path to a directory under `root_dir` in which
+        to convert contents.
+    writer: A TFRecord writer
+    recursive: A boolean specifying whether or not recursively convert files
+        contained in subdirectories of the specified directory.
+  """
+  files = list(list_files(root_dir, sub_dir, recursive))
+  progress = _ConversionProgress(len(files))
+  for file_sub_dir, full_file_path in files:
+    sequences = convert_file(root_dir, file_sub_dir, full_file_path)
+    for sequence in sequences:
+      writer.write(sequence)
+    progress.update(len(sequences))
+  progress.log()
+
+
+def convert_files_parallel(root_dir, sub_dir, writer, recursive=False,
+                           num_workers=1, max_in_flight=None):
+  """Converts files in a pool of worker processes.
+
+  Files are parsed in `num_workers` processes, and the resulting sequences are
+  written by the calling process in the same order as `convert_files` writes
+  them.
+
+  Args:
+    root_dir: A string specifying a root directory.
+    sub_dir: A string specifying a path to a directory under `root_dir` in which
+        to convert contents.
+    writer: A TFRecord writer
+    recursive: A boolean specifying whether or not recursively convert files
+        contained in subdirectories of the specified directory.
+    num_workers: The number of worker processes.
+    max_in_flight: The maximum number of files submitted to the workers but not
+        yet written. Bounds the memory held by converted sequences waiting for
+        slower files ahead of them. Defaults to 4 * `num_workers`.
+  """
+  if max_in_flight is None:
+    max_in_flight = 4 * num_workers
+  files = list(list_files(root_dir, sub_dir, recursive))
+  progress = _ConversionProgress(len(files))
+
+  def write_result(future):
+    sequences = future.result()
+    for sequence in sequences:
+      writer.write(sequence)
+    progress.update(len(sequences))
+
+  in_flight = collections.deque()
+  with futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+    for file_sub_dir, full_file_path in files:
+      if len(in_flight) >= max_in_flight:
+        write_result(in_flight.popleft())
+      in_flight.append(
+          executor.submit(convert_file, root_dir, file_sub_dir, full_file_path))
+    while in_flight:
+      write_result(in_flight.popleft())
+  progress.log()
+
+
+class _ConversionProgress(object):
+  """Logs throughput and estimated time remaining of a conversion."""
+
+  def __init__(self, num_files, log_interval_secs=10):
+    self.num_files = num_files
+    self.log_interval_secs = log_interval_secs
+    self.files_converted = 0
+    self.sequences_written = 0
+    self.start_time = time.time()
+    self.last_log_time = self.start_time
+
+  def update(self, num_sequences):
+    self.files_converted += 1
+    self.sequences_written += num_sequences
+    if time.time() - self.last_log_time >= self.log_interval_secs:
+      self.log()
+
+  def log(self):
+    self.last_log_time = time.time()
+    elapsed = self.last_log_time - self.start_time
+    rate = self.files_converted / elapsed if elapsed else 0.
+    remaining = ((self.num_files - self.files_converted) / rate
+                 if rate else float('inf'))
+    tf.logging.info(
+        '%d/%d files converted, %d sequences written '
+        '(%.1f files/sec, ETA %.0f sec).', self.files_converted,
+        self.num_files, self.sequences_written, rate, remaining)
 
 
 def convert_midi(root_dir, sub_dir, full_file_path):
@@ -204,7 +306,7 @@ def convert_abc(root_dir, sub_dir, full_file_path):
   return sequences
 
 
-def convert_directory(root_dir, output_file, recursive=False):
+def convert_directory(root_dir, output_file, recursive=False, num_workers=1):
   """Converts files to NoteSequences and writes to `output_file`.
 
   Input files found in `root_dir` are converted to NoteSequence protos with the
@@ -217,9 +319,14 @@ def convert_directory(root_dir, output_file, recursive=False):
     output_file: Path to TFRecord file to write results to.
     recursive: A boolean specifying whether or not recursively convert files
         contained in subdirectories of the specified directory.
+    num_workers: The number of processes in which to parse files. If greater
+        than 1, files are converted with `convert_files_parallel`.
   """
   with note_sequence_io.NoteSequenceRecordWriter(output_file) as writer:
-    convert_files(root_dir, '', writer, recursive)
+    if num_workers > 1:
+      convert_files_parallel(root_dir, '', writer, recursive, num_workers)
+    else:
+      convert_files(root_dir, '', writer, recursive)
 
 
 def main(unused_argv):
@@ -239,7 +346,7 @@ def main(unused_argv):
   if output_dir:
     tf.gfile.MakeDirs(output_dir)
 
-  convert_directory(input_dir, output_file, FLAGS.recursive)
+  convert_directory(input_dir, output_file, FLAGS.recursive, FLAGS.num_threads)
 
 
 def console_entry_point():
@@ -63,7 +63,7 @@ class ConvertMidiDirToSequencesTest(tf.test.TestCase):
     }
     self.root_dir = root_dir
 
-  def runTest(self, relative_root, recursive):
+  def runTest(self, relative_root, recursive, num_workers=1):
     """Tests the output for the given parameters."""
     root_dir = os.path.join(self.root_dir, relative_root)
     expected_filenames = self.expected_dir_midi_contents[relative_root]
@@ -76,7 +76,7 @@ class ConvertMidiDirToSequencesTest(tf.test.TestCase):
     with tempfile.NamedTemporaryFile(
         prefix='ConvertMidiDirToSequencesTest') as output_file:
       convert_dir_to_note_sequences.convert_directory(
-          root_dir, output_file.name, recursive)
+          root_dir, output_file.name, recursive, num_workers)
       actual_filenames = set()
       for sequence in note_sequence_io.note_sequence_record_iterator(
           output_file.name):
@@ -102,6 +102,23 @@ class ConvertMidiDirToSequencesTest(tf.test.TestCase):
     self.runTest('sub_1/sub', recursive=True)
     self.runTest('sub_2', recursive=True)
 
+  def testConvertMidiDirToSequences_Parallel(self):
+    self.runTest('', recursive=True, num_workers=2)
+    self.runTest('sub_2', recursive=False, num_workers=2)
+
+  def testConvertMidiDirToSequences_ParallelOrder(self):
+    filenames = []
+    for num_workers in [1, 3]:
+      with tempfile.NamedTemporaryFile(
+          prefix='ConvertMidiDirToSequencesTest') as output_file:
+        convert_dir_to_note_sequences.convert_directory(
+            self.root_dir, output_file.name, True, num_workers)
+        filenames.append([
+            sequence.filename for sequence in
+            note_sequence_io.note_sequence_record_iterator(output_file.name)])
+    self.assertEquals(6, len(filenames[0]))
+    self.assertEquals(filenames[0], filenames[1])
+
 
 if __name__ == '__main__':
   tf.test.main()